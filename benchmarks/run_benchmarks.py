@@ -0,0 +1,400 @@
+"""
+Benchmarks of the simulation hot paths.
+
+Every benchmark runs a fixed number of operations per repeat and reports the
+time per operation over several repeats. Random generators are seeded and
+sleeps run on a VirtualClock, so runs are comparable from one commit to the
+next. Brokers are replaced by local stand-ins and logging is disabled unless
+--with-logging is passed.
+
+Usage:
+    python benchmarks/run_benchmarks.py --output report.json
+    python benchmarks/run_benchmarks.py --baseline report.json --max-regression 0.2
+"""
+import argparse
+import contextlib
+import datetime
+import itertools
+import logging
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from concurrent import futures
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+from unittest import mock
+
+import pydantic
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT / "src"))
+
+from messaging import message_sender, rabbitmq_helper  # noqa: E402
+from messaging.event_codec import MessageEncoding  # noqa: E402
+from messaging.pubsub_helper import PubSubHelper  # noqa: E402
+from monitoring import log_config  # noqa: E402
+from simulation.clock import VirtualClock  # noqa: E402
+from toll_plaza_management.toll_plaza import TollPlaza  # noqa: E402
+from toll_plaza_management.toll_plazas_controller import (  # noqa: E402
+    PlazaRoutingStrategy, TollPlazasController)
+from traffic_management.booth import Booth  # noqa: E402
+from traffic_management.booth_business_logic import (  # noqa: E402
+    PROCESSING_STEPS, BoothBusinessLogic)
+from traffic_management.vehicle import VehicleFactory  # noqa: E402
+
+SEED = 1234
+BOOTHS_PER_PLAZA = 10
+BOOTH_COUNTS = (10, 100, 1000)
+
+
+class BenchmarkResult(pydantic.BaseModel):
+    """Timing of one benchmark, in nanoseconds per operation"""
+    name: str
+    params: Dict[str, Any] = {}
+    ops_per_repeat: int
+    repeats: int
+    min_ns_per_op: float
+    median_ns_per_op: float
+    mean_ns_per_op: float
+    stdev_ns_per_op: float
+    ops_per_second: float
+
+    def key(self) -> str:
+        params = ",".join(f"{name}={value}"
+                          for name, value in sorted(self.params.items()))
+        return f"{self.name}[{params}]" if params else self.name
+
+
+class BenchmarkReport(pydantic.BaseModel):
+    """Results of a benchmark run and the environment they come from"""
+    created_at: str
+    git_commit: Optional[str] = None
+    python_version: str
+    platform: str
+    cpu_count: Optional[int] = None
+    results: List[BenchmarkResult] = []
+
+
+def measure(name: str, run: Callable[[int], None], ops: int, repeats: int,
+            setup: Optional[Callable[[], None]] = None, warmup: int = 1,
+            **params) -> BenchmarkResult:
+    """
+    Time ``run(ops)`` over ``repeats`` repeats after ``warmup`` untimed ones.
+
+    Args:
+        name (str): Name of the benchmark.
+        run (Callable[[int], None]): Performs the given number of operations.
+        ops (int): Operations per repeat.
+        repeats (int): Timed repeats.
+        setup (Callable[[], None]): Untimed, called before every repeat.
+        warmup (int): Untimed repeats run first.
+        params: Parameters of the benchmark, recorded in the report.
+    """
+    timings = []
+    for iteration in range(warmup + repeats):
+        if setup is not None:
+            setup()
+        start = time.perf_counter_ns()
+        run(ops)
+        elapsed = time.perf_counter_ns() - start
+        if iteration >= warmup:
+            timings.append(elapsed / ops)
+    median = statistics.median(timings)
+    return BenchmarkResult(
+        name=name, params=params, ops_per_repeat=ops, repeats=repeats,
+        min_ns_per_op=min(timings),
+        median_ns_per_op=median,
+        mean_ns_per_op=statistics.fmean(timings),
+        stdev_ns_per_op=statistics.stdev(timings) if len(timings) > 1 else 0.0,
+        ops_per_second=1e9 / median if median else 0.0)
+
+
+def _vehicles(count: int):
+    random.seed(SEED)
+    return [VehicleFactory.generate_random_vehicle() for _ in range(count)]
+
+
+def bench_vehicle_factory(scale: int, repeats: int) -> List[BenchmarkResult]:
+    random.seed(SEED)
+
+    def run(ops):
+        for _ in range(ops):
+            VehicleFactory.generate_random_vehicle()
+
+    return [measure("vehicle.generate_random_vehicle", run, 1000 * scale,
+                    repeats)]
+
+
+class _NullSender(message_sender.MessageSender):
+    """Serializes events like a real sender but sends them nowhere."""
+
+    def send_message(self, message):
+        pass
+
+
+def bench_booth(scale: int, repeats: int) -> List[BenchmarkResult]:
+    ops = 1000 * scale
+    vehicles = _vehicles(ops)
+    results = []
+
+    booth = BoothBusinessLogic("1-1", queue_length=0, clock=VirtualClock())
+
+    def empty_queue():
+        booth.vehicle_queue.queue.clear()
+
+    def enqueue(count):
+        for new_vehicle in vehicles[:count]:
+            booth.enqueue_vehicle(new_vehicle)
+
+    results.append(measure("booth.enqueue_vehicle", enqueue, ops, repeats,
+                           setup=empty_queue))
+
+    for compact_events in (False, True):
+        booth = BoothBusinessLogic("1-1", queue_length=0, clock=VirtualClock(),
+                                   compact_events=compact_events)
+        sender = _NullSender()
+
+        def process(count, booth=booth, sender=sender):
+            for new_vehicle in vehicles[:count]:
+                booth.current_vehicle = new_vehicle
+                booth.process_current_vehicle(sender)
+
+        results.append(measure("booth.process_current_vehicle", process, ops,
+                               repeats, compact_events=compact_events))
+    return results
+
+
+def _build_plazas(num_booths: int) -> List[TollPlaza]:
+    plazas = []
+    for plaza_id in range(max(1, num_booths // BOOTHS_PER_PLAZA)):
+        booths = [Booth(f"{plaza_id}-{number}")
+                  for number in range(min(num_booths, BOOTHS_PER_PLAZA))]
+        plazas.append(TollPlaza(plaza_id=plaza_id, booths=booths))
+    return plazas
+
+
+def _drain(plazas: List[TollPlaza]):
+    """Empty every booth queue, keeping the load indexes up to date."""
+    for plaza in plazas:
+        for booth in plaza.booths:
+            while booth._set_next_vehicle_to_process():
+                booth.current_vehicle = None
+
+
+def bench_plaza_routing(scale: int, repeats: int) -> List[BenchmarkResult]:
+    results = []
+    for num_booths in BOOTH_COUNTS:
+        booths = [Booth(f"1-{number}") for number in range(num_booths)]
+        plaza = TollPlaza(plaza_id=1, booths=booths)
+        for booth in booths[::2]:
+            booth.add_vehicle(VehicleFactory.generate_random_vehicle())
+        for strategy in ("shortest_queue_booth_strategy",
+                         "random_booth_strategy"):
+            pick = getattr(plaza, strategy)
+
+            def run(ops, pick=pick):
+                for _ in range(ops):
+                    pick()
+
+            results.append(measure(f"plaza.{strategy}", run, 1000 * scale,
+                                   repeats, booths=num_booths))
+    return results
+
+
+def bench_controller(scale: int, repeats: int) -> List[BenchmarkResult]:
+    results = []
+    for num_booths in BOOTH_COUNTS:
+        for routing_strategy in PlazaRoutingStrategy:
+            plazas = _build_plazas(num_booths)
+            # Half the total queue capacity, drained between repeats, so no
+            # vehicle is rejected because queues are full.
+            capacity = sum(booth.vehicle_queue.maxsize
+                           for plaza in plazas for booth in plaza.booths)
+            ops = min(capacity // 2, 500 * scale)
+            vehicles = _vehicles(ops)
+            controller = TollPlazasController(plazas, routing_strategy)
+
+            def run(count, controller=controller):
+                for new_vehicle in vehicles[:count]:
+                    controller.assign_vehicle_to_plaza(new_vehicle)
+
+            results.append(measure(
+                "controller.assign_vehicle_to_plaza", run, ops, repeats,
+                setup=lambda plazas=plazas: _drain(plazas),
+                booths=num_booths, routing=routing_strategy.value))
+    return results
+
+
+class _StandInChannel:
+    """pika channel accepting every call without a broker."""
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+class _StandInConnection:
+    """pika BlockingConnection without a broker."""
+    is_open = True
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def channel(self):
+        return _StandInChannel()
+
+    def close(self):
+        self.is_open = False
+
+
+class _StandInPubSubClient:
+    """Pub/Sub publisher client settling every publish immediately."""
+
+    def __init__(self):
+        self._ids = itertools.count()
+
+    def topic_path(self, project_id, topic_name):
+        return f"projects/{project_id}/topics/{topic_name}"
+
+    def publish(self, topic_path, data):
+        future = futures.Future()
+        future.set_result(str(next(self._ids)))
+        return future
+
+
+def bench_message_sender(scale: int, repeats: int) -> List[BenchmarkResult]:
+    ops = 1000 * scale
+    results = []
+    booth = BoothBusinessLogic("1-1", clock=VirtualClock(), compact_events=True)
+    events = [booth.get_compact_booth_event(new_vehicle, event_type)
+              for new_vehicle in _vehicles(ops // 3 + 1)
+              for event_type, _ in PROCESSING_STEPS]
+
+    cases = [
+        (message_sender.MessagingSystem.STDOUT, MessageEncoding.TEXT, 0, {}),
+        (message_sender.MessagingSystem.RABBITMQ, MessageEncoding.TEXT, 0,
+         {"commit_batch_size": 1}),
+        (message_sender.MessagingSystem.RABBITMQ, MessageEncoding.TEXT, 0,
+         {"commit_batch_size": 64}),
+        (message_sender.MessagingSystem.RABBITMQ, MessageEncoding.BINARY, 0,
+         {"commit_batch_size": 64}),
+        (message_sender.MessagingSystem.RABBITMQ, MessageEncoding.BINARY, 50,
+         {"commit_batch_size": 64}),
+        (message_sender.MessagingSystem.PUBSUB, MessageEncoding.TEXT, 0, {}),
+        (message_sender.MessagingSystem.PUBSUB, MessageEncoding.BINARY, 50, {}),
+    ]
+    with open(os.devnull, "w") as devnull, \
+            contextlib.redirect_stdout(devnull), \
+            mock.patch.object(rabbitmq_helper.pika, "BlockingConnection",
+                              _StandInConnection):
+        for system, encoding, envelope_size, settings in cases:
+            message_sender.set_rabbitmq_publisher(
+                rabbitmq_helper.RabbitMQPublisher(queue_name="bench", **settings))
+            message_sender.set_pubsub_publisher(PubSubHelper(
+                "bench", "bench", publisher=_StandInPubSubClient(),
+                on_complete=lambda message, message_id, error: None))
+            sender = message_sender.MessageSender(system, encoding, envelope_size)
+
+            def run(count, sender=sender):
+                for event in events[:count]:
+                    sender.send_event(event)
+                sender.flush_envelope()
+
+            result = measure("message_sender.send_event", run, ops, repeats,
+                             backend=system.value, encoding=encoding.value,
+                             envelope_size=envelope_size, **settings)
+            message_sender.close_publishers()
+            results.append(result)
+    return results
+
+
+BENCHMARKS: Dict[str, Callable[[int, int], List[BenchmarkResult]]] = {
+    "vehicle": bench_vehicle_factory,
+    "booth": bench_booth,
+    "plaza": bench_plaza_routing,
+    "controller": bench_controller,
+    "messaging": bench_message_sender,
+}
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, check=True,
+            capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report: BenchmarkReport, baseline: BenchmarkReport,
+            max_regression: float) -> List[str]:
+    """Return the benchmarks whose median got slower than allowed."""
+    baseline_results = {result.key(): result for result in baseline.results}
+    regressions = []
+    for result in report.results:
+        previous = baseline_results.get(result.key())
+        if previous is None or not previous.median_ns_per_op:
+            continue
+        change = result.median_ns_per_op / previous.median_ns_per_op - 1
+        if change > max_regression:
+            regressions.append(f"{result.key()}: {change:+.1%} "
+                               f"({previous.median_ns_per_op:.0f} -> "
+                               f"{result.median_ns_per_op:.0f} ns/op)")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--output", type=Path,
+                        help="Write the JSON report to this file.")
+    parser.add_argument("--baseline", type=Path,
+                        help="JSON report to compare the results with.")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="Allowed slowdown of a median over the baseline.")
+    parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS),
+                        help="Run these benchmark groups only.")
+    parser.add_argument("--repeats", type=int, default=7)
+    parser.add_argument("--scale", type=int, default=1,
+                        help="Multiplies the operations per repeat.")
+    parser.add_argument("--with-logging", action="store_true",
+                        help="Keep the INFO logs of the hot paths, written as "
+                             "configured by the LOG_* variables.")
+    args = parser.parse_args(argv)
+
+    if args.with_logging:
+        log_config.configure_logging()
+    else:
+        logging.disable(logging.CRITICAL)
+
+    report = BenchmarkReport(
+        created_at=datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        git_commit=_git_commit(),
+        python_version=platform.python_version(),
+        platform=platform.platform(),
+        cpu_count=os.cpu_count())
+    for name in args.only or BENCHMARKS:
+        for result in BENCHMARKS[name](args.scale, args.repeats):
+            report.results.append(result)
+            print(f"{result.key():75s} {result.median_ns_per_op:12.0f} ns/op "
+                  f"{result.ops_per_second:12.0f} ops/s")
+
+    if args.output:
+        args.output.write_text(report.model_dump_json(indent=2))
+        print(f"Report written to {args.output}")
+
+    if args.baseline:
+        baseline = BenchmarkReport.model_validate_json(
+            args.baseline.read_text())
+        regressions = compare(report, baseline, args.max_regression)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,23 +1,89 @@
+import asyncio
 import os
 import logging
 from dotenv import load_dotenv
 
+from traffic_management.async_booth import AsyncBooth
 from traffic_management.booth import Booth
+from traffic_management.load_generator import (
+    LOAD_RATE, LoadGenerator, LoadProfile)
 from traffic_management.traffic_generator import TrafficGenerator
+from toll_plaza_management.async_toll_plaza import (
+    AsyncTollPlaza, AsyncTollPlazasController)
+from toll_plaza_management.sharded_controller import (
+    PlazaSpec, ShardedTollPlazasController)
 from toll_plaza_management.toll_plaza import TollPlaza
 from toll_plaza_management.toll_plazas_controller import TollPlazasController
 from messaging import message_sender
+from monitoring import log_config, metrics
+from simulation.engine import DiscreteEventEngine
 
 
 load_dotenv()
 
-logging.basicConfig(level=logging.INFO)
+log_config.configure_logging()
 logger = logging.getLogger(__name__)
 
+# "realtime" runs booths in threads on the wall clock, "asyncio" runs them as
+# tasks on one event loop, "sharded" spreads plazas over processes and
+# "discrete_event" runs the same logic on a virtual clock as fast as possible.
+SIMULATION_MODE = os.getenv("SIMULATION_MODE", "realtime")
+SIMULATED_DURATION = float(os.getenv("SIMULATED_DURATION", "86400"))
+
+
+async def run_asyncio(num_vehicles: int):
+    """Run the simulation with every booth as a task on one event loop."""
+    booth11 = AsyncBooth("1-1",
+                         message_publisher_type=message_sender.MessagingSystem.RABBITMQ)
+    booth12 = AsyncBooth("1-2",
+                         message_publisher_type=message_sender.MessagingSystem.RABBITMQ)
+    plaza1 = AsyncTollPlaza(plaza_id=1, booths=[booth11, booth12])
+
+    booth21 = AsyncBooth("2-1")
+    booth22 = AsyncBooth("2-2")
+    plaza2 = AsyncTollPlaza(plaza_id=2, booths=[booth21, booth22])
+
+    plazas_controller = AsyncTollPlazasController([plaza1, plaza2])
+    if LOAD_RATE > 0:
+        try:
+            await LoadGenerator(plazas_controller,
+                                LoadProfile.from_environment()).run_async()
+        finally:
+            await plazas_controller.astop_controller()
+        return
+    traffic_generator = TrafficGenerator.from_environment(plazas_controller,
+                                                          num_vehicles)
+    await traffic_generator.generate_vehicle_flow_async()
 
 
 def main():
     num_vehicles = int(os.getenv("NUM_VEHICLE", '0'))
+    if metrics.METRICS_PORT:
+        metrics.start_metrics_server()
+
+    if SIMULATION_MODE == "sharded":
+        sharded_controller = ShardedTollPlazasController([
+            PlazaSpec(plaza_id=1, booth_ids=["1-1", "1-2"],
+                      messaging_system=message_sender.MessagingSystem.RABBITMQ),
+            PlazaSpec(plaza_id=2, booth_ids=["2-1", "2-2"]),
+        ])
+        try:
+            if LOAD_RATE > 0:
+                LoadGenerator(sharded_controller,
+                              LoadProfile.from_environment()).run()
+            else:
+                TrafficGenerator.from_environment(
+                    sharded_controller, num_vehicles).generate_vehicle_flow()
+        finally:
+            sharded_controller.stop_controller()
+        return
+
+    if SIMULATION_MODE == "asyncio":
+        try:
+            asyncio.run(run_asyncio(num_vehicles))
+        except KeyboardInterrupt:
+            logger.info("Vehicle generation interrupted. Exiting...")
+        return
 
     booth11 = Booth("1-1", 
                     message_publisher_type=message_sender.MessagingSystem.RABBITMQ)
@@ -31,9 +97,24 @@ def main():
 
     plazas_controller = TollPlazasController([plaza1, plaza2])
 
-    traffic_generator = TrafficGenerator(plazas_controller, num_vehicles)
-    traffic_generator = TrafficGenerator(plazas_controller, 0)
+    if SIMULATION_MODE == "discrete_event":
+        traffic_generator = TrafficGenerator.from_environment(
+            plazas_controller, num_vehicles)
+        DiscreteEventEngine(plazas_controller, traffic_generator).run(
+            SIMULATED_DURATION)
+        traffic_generator.close()
+        message_sender.close_publishers()
+        return
+
+    if LOAD_RATE > 0:
+        try:
+            LoadGenerator(plazas_controller,
+                          LoadProfile.from_environment()).run()
+        finally:
+            plazas_controller.stop_controller()
+        return
 
+    traffic_generator = TrafficGenerator.from_environment(plazas_controller, 0)
     try:
         traffic_generator.generate_vehicle_flow()
     except KeyboardInterrupt:
@@ -3,21 +3,30 @@ import os
 import pika
 import dotenv
 
+from messaging import event_codec
+from monitoring import log_config
+from messaging.rabbitmq_helper import (
+    PREFETCH_COUNT, RabbitMQConsumer, RejectMessage)
+
 dotenv.load_dotenv()
 
 QUEUE_NAME = os.getenv("QUEUE_NAME", "")
 RABBITMQ_HOST = os.getenv("RABBITMQ_HOST", "")
+# Process messages on a worker pool with batched acks.
+CONSUMER_POOLED = os.getenv("CONSUMER_POOLED", "0") == "1"
 
 class MessageConsumer:
     def __init__(self, queue_name: str, rabbitmq_host: str):
         self.queue_name = queue_name
         self.rabbitmq_host = rabbitmq_host
 
-    def consume_message(self, callback):
+    def consume_message(self, callback,
+                        prefetch_count: int = PREFETCH_COUNT):
         """
         Start consuming messages from the queue.
 
         :param callback: A function to process the received messages.
+        :param prefetch_count: Unacknowledged messages the broker may send ahead.
         """
         # Establish connection to RabbitMQ
         connection = pika.BlockingConnection(
@@ -25,7 +34,7 @@ class MessageConsumer:
         channel = connection.channel()
 
         # Set QoS settings for fair dispatch
-        channel.basic_qos(prefetch_count=1)
+        channel.basic_qos(prefetch_count=prefetch_count)
 
         # Start consuming messages
         print(f"Using QUEUE_NAME: {self.queue_name}")
@@ -44,6 +53,69 @@ class MessageConsumer:
         finally:
             connection.close()
 
+    def consume_pooled(self, handler, **settings):
+        """
+        Start consuming messages on a bounded worker pool with batched acks.
+
+        :param handler: A function called with each message body from a
+            worker thread. Raising rejects the message, which is requeued once.
+        :param settings: Prefetch, worker and ack batching settings of
+            RabbitMQConsumer.
+        """
+        consumer = RabbitMQConsumer(self.rabbitmq_host, self.queue_name,
+                                    **settings)
+        consumer.consume(handler)
+        print(f" [*] Processed {consumer.processed_count} messages, "
+              f"{consumer.failed_count} failed.")
+
+    def consume_events(self, event_callback, pooled: bool = CONSUMER_POOLED):
+        """
+        Start consuming booth events, whatever encoding they were sent with.
+
+        Malformed messages are rejected without being requeued, pooled or
+        not. They are not acknowledged as if processed, so a dead letter
+        exchange configured on the queue can keep them for inspection.
+
+        :param event_callback: A function called with each decoded CompactBoothEvent.
+        :param pooled: Process messages on a worker pool, in which case
+            event_callback must be thread-safe.
+        """
+        if pooled:
+            def handle(body):
+                try:
+                    events = self.decode_message(body)
+                except event_codec.EventDecodeError as e:
+                    print(f" [!] Rejected undecodable message: {e}")
+                    raise RejectMessage(str(e)) from e
+                for event in events:
+                    event_callback(event)
+
+            self.consume_pooled(handle)
+            return
+
+        def on_message(ch, method, properties, body):
+            try:
+                events = self.decode_message(body)
+            except event_codec.EventDecodeError as e:
+                print(f" [!] Rejected undecodable message: {e}")
+                ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+                return
+            for event in events:
+                event_callback(event)
+            ch.basic_ack(delivery_tag=method.delivery_tag)
+
+        self.consume_message(on_message)
+
+    @staticmethod
+    def decode_message(body):
+        """
+        Decode a TEXT or BINARY message into its booth events.
+
+        :param body: The raw message body.
+        :return: The list of CompactBoothEvent it contains.
+        """
+        return event_codec.decode_message(body)
+
 # Example callback function to process the received messages
 
 
@@ -53,7 +125,12 @@ def callback(ch, method, properties, body):
     ch.basic_ack(delivery_tag=method.delivery_tag)  # Acknowledge the message
 
 
+def event_callback(event):
+    print(f" [x] Received {event}")
+
+
 # Create a consumer instance and start consuming messages
 if __name__ == "__main__":
+    log_config.configure_logging()
     consumer = MessageConsumer(QUEUE_NAME, RABBITMQ_HOST)
-    consumer.consume_message(callback)
+    consumer.consume_events(event_callback)
@@ -0,0 +1,188 @@
+"""
+Wire formats of booth events.
+
+TEXT is the historical ``BoothEvent.__str__`` line. BINARY is a versioned
+struct layout of about 25 bytes per event, sent either one event per message
+or packed by many into an optionally zlib-compressed envelope:
+
+    message  := kind:u8 version:u8 body
+    EVENT    := record
+    ENVELOPE := flags:u8 count:u32 records (zlib-compressed if flags & 1)
+    record   := timestamp_ns:i64 event_type:u8 vehicle_type:u8
+                booth_id_len:u8 plate_len:u8 booth_id plate
+"""
+import datetime
+import enum
+import json
+import re
+import struct
+import zlib
+from typing import Iterable, List, Union
+
+from traffic_management.booth_event import (
+    AnyBoothEvent, BoothEvent, BoothEventType, CompactBoothEvent)
+from traffic_management.vehicle import VehicleType
+
+FORMAT_VERSION = 1
+
+KIND_EVENT = 1
+KIND_ENVELOPE = 2
+ENVELOPE_FLAG_ZLIB = 1
+
+_HEADER = struct.Struct("<BB")
+_ENVELOPE_HEADER = struct.Struct("<BI")
+_RECORD = struct.Struct("<qBBBB")
+
+# Wire codes are positions in these tuples: only ever append to them.
+_EVENT_TYPES = tuple(BoothEventType)
+_VEHICLE_TYPES = tuple(VehicleType)
+_EVENT_TYPE_CODES = {member: code for code, member in enumerate(_EVENT_TYPES)}
+_VEHICLE_TYPE_CODES = {member: code for code, member in enumerate(_VEHICLE_TYPES)}
+
+# Enum members are formatted as "VehicleType.CAR" since Python 3.11 and as
+# their value, "car", before.
+_TEXT_EVENT = re.compile(
+    r"booth_id: (?P<booth_id>.*?),"
+    r"vehicle_plate_number: (?P<plate>.*?),"
+    r"vehicle_type: (?:VehicleType\.(?P<vehicle_name>\w+)|(?P<vehicle_value>\w+)),"
+    r"event_type: (?:BoothEventType\.(?P<event_name>\w+)|(?P<event_value>\w+)),"
+    r"timestamp: (?P<timestamp>[^)]*)\)")
+
+Message = Union[str, bytes]
+
+
+class MessageEncoding(str, enum.Enum):
+    """Class representing how booth events are serialized"""
+    TEXT = "text"
+    BINARY = "binary"
+
+
+class EventDecodeError(ValueError):
+    """Raised when a message does not contain booth events."""
+
+
+def to_compact_event(event: AnyBoothEvent) -> CompactBoothEvent:
+    """Return the event as a CompactBoothEvent"""
+    if isinstance(event, CompactBoothEvent):
+        return event
+    return CompactBoothEvent(
+        event.booth_id,
+        event.vehicle_plate_number.plate_number,
+        event.vehicle_type,
+        event.event_type,
+        _iso_to_ns(event.timestamp))
+
+
+def _iso_to_ns(timestamp: str) -> int:
+    return int(datetime.datetime.fromisoformat(timestamp).timestamp()
+               * 1_000_000_000)
+
+
+def _pack_record(event: AnyBoothEvent) -> bytes:
+    event = to_compact_event(event)
+    booth_id = event.booth_id.encode("utf-8")
+    plate = event.vehicle_plate_number.encode("utf-8")
+    return _RECORD.pack(event.timestamp_ns,
+                        _EVENT_TYPE_CODES[event.event_type],
+                        _VEHICLE_TYPE_CODES[event.vehicle_type],
+                        len(booth_id), len(plate)) + booth_id + plate
+
+
+def encode_event(event: AnyBoothEvent) -> bytes:
+    """Encode one event as a BINARY message"""
+    return _HEADER.pack(KIND_EVENT, FORMAT_VERSION) + _pack_record(event)
+
+
+def encode_envelope(events: Iterable[AnyBoothEvent],
+                    compress: bool = True) -> bytes:
+    """Pack many events into one BINARY envelope message"""
+    records = [_pack_record(event) for event in events]
+    body = b"".join(records)
+    flags = 0
+    if compress:
+        body = zlib.compress(body)
+        flags |= ENVELOPE_FLAG_ZLIB
+    return (_HEADER.pack(KIND_ENVELOPE, FORMAT_VERSION)
+            + _ENVELOPE_HEADER.pack(flags, len(records)) + body)
+
+
+def _unpack_records(body: bytes, count: int) -> List[CompactBoothEvent]:
+    events = []
+    offset = 0
+    try:
+        for _ in range(count):
+            (timestamp_ns, event_type, vehicle_type,
+             booth_id_len, plate_len) = _RECORD.unpack_from(body, offset)
+            offset += _RECORD.size
+            booth_id = body[offset:offset + booth_id_len].decode("utf-8")
+            offset += booth_id_len
+            plate = body[offset:offset + plate_len].decode("utf-8")
+            offset += plate_len
+            events.append(CompactBoothEvent(
+                booth_id, plate, _VEHICLE_TYPES[vehicle_type],
+                _EVENT_TYPES[event_type], timestamp_ns))
+    except (struct.error, IndexError, UnicodeDecodeError) as e:
+        raise EventDecodeError(f"Corrupted event record: {e}") from e
+    return events
+
+
+def _decode_binary(body: bytes) -> List[CompactBoothEvent]:
+    kind, version = _HEADER.unpack_from(body)
+    if version != FORMAT_VERSION:
+        raise EventDecodeError(f"Unsupported event format version {version}")
+    payload = body[_HEADER.size:]
+    if kind == KIND_EVENT:
+        return _unpack_records(payload, 1)
+    if kind == KIND_ENVELOPE:
+        flags, count = _ENVELOPE_HEADER.unpack_from(payload)
+        records = payload[_ENVELOPE_HEADER.size:]
+        if flags & ENVELOPE_FLAG_ZLIB:
+            try:
+                records = zlib.decompress(records)
+            except zlib.error as e:
+                raise EventDecodeError(f"Corrupted envelope: {e}") from e
+        return _unpack_records(records, count)
+    raise EventDecodeError(f"Unknown message kind {kind}")
+
+
+def _decode_text(text: str) -> List[CompactBoothEvent]:
+    if text.startswith("{"):
+        # Pub/Sub messages are wrapped as {"message": "<event text>"}
+        text = json.loads(text).get("message", "")
+    match = _TEXT_EVENT.fullmatch(text.strip())
+    if match is None:
+        raise EventDecodeError(f"Not a booth event: {text!r}")
+    return [CompactBoothEvent(
+        match["booth_id"], match["plate"],
+        VehicleType[match["vehicle_name"]] if match["vehicle_name"]
+        else VehicleType(match["vehicle_value"]),
+        BoothEventType[match["event_name"]] if match["event_name"]
+        else BoothEventType(match["event_value"]),
+        _iso_to_ns(match["timestamp"]))]
+
+
+def decode_message(body: Message) -> List[CompactBoothEvent]:
+    """
+    Decode a broker message of any supported format into its events.
+
+    Raises:
+        EventDecodeError: If the message cannot be decoded.
+    """
+    if isinstance(body, bytes) and body[:1] in (bytes([KIND_EVENT]),
+                                                bytes([KIND_ENVELOPE])):
+        try:
+            return _decode_binary(body)
+        except struct.error as e:
+            raise EventDecodeError(f"Truncated message: {e}") from e
+    try:
+        text = body if isinstance(body, str) else body.decode("utf-8")
+        return _decode_text(text)
+    except EventDecodeError:
+        raise
+    except (UnicodeDecodeError, ValueError, KeyError) as e:
+        raise EventDecodeError(f"Not a booth event: {e}") from e
+
+
+def decode_booth_events(body: Message) -> List[BoothEvent]:
+    """Decode a broker message into validated BoothEvent objects"""
+    return [event.to_booth_event() for event in decode_message(body)]
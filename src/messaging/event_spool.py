@@ -0,0 +1,439 @@
+"""
+Append-only local spool of messages, kept in segmented mmap-backed files.
+
+    segment  := record* (zero filled up to the segment size)
+    record   := magic:u8 kind:u8 length:u32 crc32:u32 payload
+    kind     := 0 for UTF-8 text, 1 for bytes
+
+Segments are named after increasing sequence numbers and the position of the
+oldest unconsumed record is saved in a checkpoint file, so a spool reopened
+after a crash resumes where its reader stopped. A torn record at the end of
+the last segment is detected by its checksum and overwritten.
+"""
+import logging
+import mmap
+import os
+import struct
+import threading
+import zlib
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from messaging.event_codec import Message
+from monitoring import metrics
+
+logger = logging.getLogger(__name__)
+
+SPOOL_SEGMENT_BYTES = int(os.getenv("SPOOL_SEGMENT_BYTES", str(8 * 1024 * 1024)))
+# Segments kept on disk; the oldest unsent segment is dropped beyond that.
+SPOOL_MAX_SEGMENTS = int(os.getenv("SPOOL_MAX_SEGMENTS", "64"))
+SPOOL_REPLAY_BATCH = int(os.getenv("SPOOL_REPLAY_BATCH", "500"))
+SPOOL_RETRY_INTERVAL = float(os.getenv("SPOOL_RETRY_INTERVAL", "1.0"))
+
+_MAGIC = 0xA5
+_RECORD_HEADER = struct.Struct("<BBII")
+_CHECKPOINT = struct.Struct("<QQ")
+_SEGMENT_SUFFIX = ".log"
+
+SPOOL_PENDING = metrics.REGISTRY.gauge(
+    "toll_spool_pending", "Messages waiting in a spool.", ["spool"])
+SPOOL_APPENDED = metrics.REGISTRY.counter(
+    "toll_spool_appended", "Messages written to a spool.", ["spool"])
+SPOOL_REPLAYED = metrics.REGISTRY.counter(
+    "toll_spool_replayed", "Spooled messages sent after all.", ["spool"])
+SPOOL_DROPPED = metrics.REGISTRY.counter(
+    "toll_spool_dropped", "Spooled messages dropped to bound the disk usage.",
+    ["spool"])
+
+
+class SpoolPosition(NamedTuple):
+    """Position in a spool: segment sequence and offset, and the number of
+    records before the offset in that segment."""
+    sequence: int
+    offset: int
+    index: int
+
+
+class _Segment:
+    """One mmap-backed log file."""
+
+    def __init__(self, path: Path, sequence: int, size: int):
+        self.path = path
+        self.sequence = sequence
+        self.records = 0
+        self.write_offset = 0
+        exists = path.exists()
+        self._file = open(path, "r+b" if exists else "w+b")
+        if not exists or os.path.getsize(path) < size:
+            self._file.truncate(size)
+        self.size = os.path.getsize(path)
+        self.map = mmap.mmap(self._file.fileno(), self.size)
+
+    def scan(self):
+        """Find the records already written, e.g. after a restart."""
+        offset = 0
+        self.records = 0
+        while True:
+            record = self.read(offset)
+            if record is None:
+                break
+            offset = record[1]
+            self.records += 1
+        self.write_offset = offset
+        # Clear a torn record so it is not read past once overwritten
+        self.map[offset:min(offset + _RECORD_HEADER.size, self.size)] = bytes(
+            min(_RECORD_HEADER.size, self.size - offset))
+
+    def free(self) -> int:
+        return self.size - self.write_offset
+
+    def append(self, kind: int, payload: bytes):
+        header = _RECORD_HEADER.pack(_MAGIC, kind, len(payload),
+                                     zlib.crc32(payload))
+        end = self.write_offset + len(header) + len(payload)
+        self.map[self.write_offset:end] = header + payload
+        self.write_offset = end
+        self.records += 1
+
+    def read(self, offset: int) -> Optional[Tuple[Message, int]]:
+        """Return the record at ``offset`` and the offset after it."""
+        if offset + _RECORD_HEADER.size > self.size:
+            return None
+        magic, kind, length, crc = _RECORD_HEADER.unpack_from(self.map, offset)
+        start = offset + _RECORD_HEADER.size
+        if magic != _MAGIC or start + length > self.size:
+            return None
+        payload = self.map[start:start + length]
+        if zlib.crc32(payload) != crc:
+            return None
+        message = payload if kind else payload.decode("utf-8")
+        return message, start + length
+
+    def flush(self):
+        self.map.flush()
+
+    def close(self):
+        self.map.flush()
+        self.map.close()
+        self._file.close()
+
+    def delete(self):
+        self.close()
+        self.path.unlink(missing_ok=True)
+
+
+class EventSpool:
+    """
+    Durable FIFO of messages waiting for a broker.
+
+    Writers append at the end of the newest segment; the reader ``read``s
+    records from the oldest one and ``commit``s the position ``read``
+    returned once they were sent. When more than ``max_segments`` segments
+    are needed the oldest one is dropped, which bounds the disk usage to
+    about ``segment_size * max_segments``. Thread-safe, with one reader.
+    """
+
+    def __init__(self, directory: str,
+                 segment_size: int = SPOOL_SEGMENT_BYTES,
+                 max_segments: int = SPOOL_MAX_SEGMENTS,
+                 name: Optional[str] = None):
+        """
+        Args:
+            directory (str): Directory of the segments, created if missing.
+                Messages spooled by a previous run are picked up.
+            segment_size (int): Size of a segment file in bytes.
+            max_segments (int): Segments kept before the oldest is dropped.
+            name (str): Label of the spool metrics, which are not reported
+                when None.
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.segment_size = segment_size
+        self.max_segments = max(2, max_segments)
+        self.name = name or self.directory.name
+
+        self._lock = threading.Lock()
+        self._segments: Dict[int, _Segment] = {}
+        # Position of the next record to read: segment sequence and offset,
+        # and the number of records before it in that segment.
+        self._read_sequence = 0
+        self._read_offset = 0
+        self._read_index = 0
+        # End of the last read, whose records may be in flight, and the
+        # records of it dropped with their segment before being committed.
+        self._read_end: Optional[SpoolPosition] = None
+        self._detached = 0
+        self._pending = 0
+        self.dropped = 0
+
+        self._appended = self._replayed = self._dropped = None
+        if name is not None:
+            self._appended = SPOOL_APPENDED.labels(spool=name)
+            self._replayed = SPOOL_REPLAYED.labels(spool=name)
+            self._dropped = SPOOL_DROPPED.labels(spool=name)
+            SPOOL_PENDING.labels(spool=name).set_function(self.pending)
+        self._open()
+
+    def pending(self) -> int:
+        """Number of records not committed yet."""
+        return self._pending
+
+    def append(self, message: Message):
+        """Add a message at the end of the spool."""
+        payload, kind = ((message, 1) if isinstance(message, bytes)
+                         else (message.encode("utf-8"), 0))
+        needed = _RECORD_HEADER.size + len(payload)
+        with self._lock:
+            segment = self._segments[max(self._segments)]
+            if segment.free() < needed:
+                segment.flush()
+                segment = self._new_segment(segment.sequence + 1,
+                                            max(self.segment_size, needed))
+            segment.append(kind, payload)
+            self._pending += 1
+        if self._appended is not None:
+            self._appended.inc()
+
+    def read(self, max_records: int) -> Tuple[List[Message], SpoolPosition]:
+        """
+        Return up to ``max_records`` of the oldest records, without
+        consuming them.
+
+        Returns:
+            Tuple[List[Message], SpoolPosition]: The records and the position
+                after them, to ``commit`` once they were sent.
+        """
+        messages = []
+        with self._lock:
+            # Records of the previous read that were dropped before being
+            # committed were not sent after all.
+            self._count_dropped(self._detached)
+            self._detached = 0
+            sequence, offset = self._read_sequence, self._read_offset
+            index = self._read_index
+            while len(messages) < max_records:
+                segment = self._segments.get(sequence)
+                if segment is None:
+                    break
+                record = segment.read(offset) if offset < segment.write_offset else None
+                if record is None:
+                    if sequence + 1 not in self._segments:
+                        break
+                    sequence, offset, index = sequence + 1, 0, 0
+                    continue
+                message, offset = record
+                messages.append(message)
+                index += 1
+            self._read_end = SpoolPosition(sequence, offset, index)
+        return messages, self._read_end
+
+    def commit(self, position: SpoolPosition):
+        """
+        Consume the records before ``position``, e.g. once they were sent.
+
+        Records whose segment was dropped meanwhile are already gone, they are
+        counted as replayed and the rest of the spool is left untouched.
+        """
+        with self._lock:
+            committed, self._detached = self._detached, 0
+            if position.sequence in self._segments and (
+                    position.sequence, position.offset) > (self._read_sequence,
+                                                           self._read_offset):
+                while (self._read_sequence, self._read_offset) < (
+                        position.sequence, position.offset):
+                    segment = self._segments[self._read_sequence]
+                    if self._read_index >= segment.records:
+                        self._finish_read_segment()
+                        continue
+                    _, self._read_offset = segment.read(self._read_offset)
+                    self._read_index += 1
+                    self._pending -= 1
+                    committed += 1
+                segment = self._segments[self._read_sequence]
+                if (self._read_index >= segment.records
+                        and self._read_sequence != max(self._segments)):
+                    self._finish_read_segment()
+                self._save_checkpoint()
+        if self._replayed is not None:
+            self._replayed.inc(committed)
+
+    def replay(self, send: Callable[[List[Message]], None],
+               batch_size: int = SPOOL_REPLAY_BATCH) -> int:
+        """
+        Send the spooled records in batches, oldest first.
+
+        Stops at the first batch ``send`` raises for, which stays spooled.
+
+        Returns:
+            int: Number of records sent.
+        """
+        sent = 0
+        while True:
+            batch, position = self.read(batch_size)
+            if not batch:
+                return sent
+            send(batch)
+            self.commit(position)
+            sent += len(batch)
+
+    def sync(self):
+        """Flush written records to disk."""
+        with self._lock:
+            for segment in self._segments.values():
+                segment.flush()
+
+    def close(self):
+        """Flush and close the segments, keeping the unsent records on disk."""
+        with self._lock:
+            for segment in self._segments.values():
+                segment.close()
+            self._segments.clear()
+
+    def _open(self):
+        sequences = sorted(int(path.stem) for path in
+                           self.directory.glob(f"*{_SEGMENT_SUFFIX}")
+                           if path.stem.isdigit())
+        checkpoint = self.directory / "checkpoint"
+        if checkpoint.exists() and checkpoint.stat().st_size == _CHECKPOINT.size:
+            self._read_sequence, self._read_offset = _CHECKPOINT.unpack(
+                checkpoint.read_bytes())
+        for sequence in sequences:
+            if sequence < self._read_sequence:
+                (self.directory / self._segment_name(sequence)).unlink()
+                continue
+            segment = _Segment(self.directory / self._segment_name(sequence),
+                               sequence, self.segment_size)
+            segment.scan()
+            self._segments[sequence] = segment
+            self._pending += segment.records
+        if not self._segments:
+            self._read_sequence, self._read_offset = max(
+                [self._read_sequence] + sequences), 0
+            self._new_segment(self._read_sequence, self.segment_size)
+            return
+        if self._read_sequence not in self._segments:
+            self._read_sequence, self._read_offset = min(self._segments), 0
+        # Records before the checkpoint offset were already sent.
+        segment = self._segments[self._read_sequence]
+        offset = 0
+        while offset < self._read_offset:
+            record = segment.read(offset)
+            if record is None:
+                break
+            offset = record[1]
+            self._read_index += 1
+        self._read_offset = offset
+        self._pending -= self._read_index
+        if self._pending:
+            logger.info("Spool %s has %d messages left from a previous run.",
+                        self.name, self._pending)
+
+    def _new_segment(self, sequence: int, size: int) -> _Segment:
+        segment = _Segment(self.directory / self._segment_name(sequence),
+                           sequence, size)
+        self._segments[sequence] = segment
+        while len(self._segments) > self.max_segments:
+            self._drop_oldest()
+        return segment
+
+    def _drop_oldest(self):
+        oldest = self._segments[self._read_sequence]
+        # Records read but not committed yet may still be sent
+        in_flight = 0
+        if self._read_end is not None:
+            if self._read_end.sequence > oldest.sequence:
+                in_flight = oldest.records - self._read_index
+            elif self._read_end.sequence == oldest.sequence:
+                in_flight = max(0, self._read_end.index - self._read_index)
+        lost = oldest.records - self._read_index - in_flight
+        self._pending -= lost + in_flight
+        self._detached += in_flight
+        self._count_dropped(lost)
+        logger.warning("Spool %s is full, dropped %d unsent messages.",
+                       self.name, lost)
+        self._finish_read_segment()
+        self._save_checkpoint()
+
+    def _count_dropped(self, lost: int):
+        if not lost:
+            return
+        self.dropped += lost
+        if self._dropped is not None:
+            self._dropped.inc(lost)
+
+    def _finish_read_segment(self):
+        self._segments.pop(self._read_sequence).delete()
+        self._read_sequence = min(self._segments)
+        self._read_offset = 0
+        self._read_index = 0
+
+    def _save_checkpoint(self):
+        temporary = self.directory / "checkpoint.tmp"
+        temporary.write_bytes(_CHECKPOINT.pack(self._read_sequence,
+                                               self._read_offset))
+        os.replace(temporary, self.directory / "checkpoint")
+
+    @staticmethod
+    def _segment_name(sequence: int) -> str:
+        return f"{sequence:012d}{_SEGMENT_SUFFIX}"
+
+
+class SpoolReplayer:
+    """
+    Background thread sending the records of a spool as soon as it can.
+
+    Replays are attempted when ``wake`` is called and, while records are
+    pending, every ``retry_interval`` seconds; a failed batch stays spooled.
+    """
+
+    def __init__(self, spool: EventSpool,
+                 send_batch: Callable[[List[Message]], None],
+                 retry_interval: float = SPOOL_RETRY_INTERVAL,
+                 batch_size: int = SPOOL_REPLAY_BATCH):
+        """
+        Args:
+            spool (EventSpool): Spool to empty.
+            send_batch (Callable[[List[Message]], None]): Sends messages in
+                order and raises if any of them could not be sent.
+            retry_interval (float): Seconds between replays while the
+                messaging system is unavailable.
+            batch_size (int): Most messages handed to send_batch at once.
+        """
+        self.spool = spool
+        self.send_batch = send_batch
+        self.retry_interval = retry_interval
+        self.batch_size = batch_size
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run,
+                                        name=f"Spool-{spool.name}",
+                                        daemon=True)
+        self._thread.start()
+
+    def wake(self):
+        """Replay now, e.g. after records were appended."""
+        self._wake.set()
+
+    def close(self, timeout: Optional[float] = None):
+        """Make a last replay attempt and stop the thread."""
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.retry_interval if self.spool.pending() else None)
+            self._wake.clear()
+            stopping = self._stop.is_set()
+            if self.spool.pending():
+                try:
+                    sent = self.spool.replay(self.send_batch, self.batch_size)
+                    logger.info("Replayed %d spooled messages.", sent)
+                except Exception as e:
+                    logger.warning("Replay of spool %s failed, %d messages "
+                                   "left: %s", self.spool.name,
+                                   self.spool.pending(), e)
+                    # Do not retry on every wake while the system is down
+                    self._stop.wait(self.retry_interval)
+            if stopping:
+                return
@@ -1,17 +1,43 @@
 
+import asyncio
 import enum
-import os
 import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Set
 
 import dotenv
-from google.cloud import pubsub_v1
-import pika
+
+from messaging import event_codec
+from messaging.event_codec import MessageEncoding
+from messaging.event_spool import EventSpool, SpoolReplayer
+from messaging.outbound_buffer import OutboundBuffer
+from messaging.pubsub_helper import PubSubHelper
+from messaging.rabbitmq_helper import RabbitMQPublisher
+from monitoring import metrics, profiling
 
 dotenv.load_dotenv()
 
 PROJECT_ID = os.getenv("GCP_PROJECT_ID", "")
 QUEUE_NAME = os.getenv("QUEUE_NAME", "")
 RABBITMQ_HOST = os.getenv("RABBITMQ_HOST", "")
+MESSAGE_ENCODING = MessageEncoding(os.getenv("MESSAGE_ENCODING",
+                                             MessageEncoding.TEXT.value))
+# Events packed per broker message, 0 sends every event on its own.
+MESSAGE_ENVELOPE_SIZE = int(os.getenv("MESSAGE_ENVELOPE_SIZE", "0"))
+MESSAGE_ENVELOPE_COMPRESSION = os.getenv(
+    "MESSAGE_ENVELOPE_COMPRESSION", "1") == "1"
+# Messages a sender buffers for its background flusher, 0 sends every
+# message from the calling thread.
+OUTBOUND_BUFFER_SIZE = int(os.getenv("OUTBOUND_BUFFER_SIZE", "0"))
+# Threads running blocking publishes on behalf of asyncio booths.
+ASYNC_PUBLISH_WORKERS = int(os.getenv("ASYNC_PUBLISH_WORKERS", "4"))
+# Directory where messages a broker refused are spooled until it is back,
+# messages that fail are dropped if empty.
+SPOOL_DIR = os.getenv("SPOOL_DIR", "")
 
 class MessagingSystem(str, enum.Enum):
     """Class representing the messaging system to use to send
@@ -20,14 +46,286 @@ class MessagingSystem(str, enum.Enum):
     RABBITMQ = "rabbit_mq"
     PUBSUB = "pub_sub"
 
+
+_publishers_lock = threading.Lock()
+_rabbitmq_publisher: Optional[RabbitMQPublisher] = None
+_pubsub_publisher: Optional[PubSubHelper] = None
+_publish_executor: Optional[ThreadPoolExecutor] = None
+_spools: Dict["MessagingSystem", SpoolReplayer] = {}
+_outbound_buffers: Dict["MessagingSystem", OutboundBuffer] = {}
+# Set while close_publishers runs, no spool is created then
+_closing_publishers = False
+
+
+def get_rabbitmq_publisher() -> RabbitMQPublisher:
+    """Return the RabbitMQ publisher shared by every MessageSender."""
+    global _rabbitmq_publisher
+    if _rabbitmq_publisher is None:
+        with _publishers_lock:
+            if _rabbitmq_publisher is None:
+                _rabbitmq_publisher = RabbitMQPublisher(
+                    host=RABBITMQ_HOST, queue_name=QUEUE_NAME)
+    return _rabbitmq_publisher
+
+
+def set_rabbitmq_publisher(publisher: Optional[RabbitMQPublisher]):
+    """Replace the shared RabbitMQ publisher, e.g. with one on other settings."""
+    global _rabbitmq_publisher
+    with _publishers_lock:
+        _rabbitmq_publisher = publisher
+
+
+def _print_pubsub_outcome(message, message_id, error):
+    if error:
+        metrics.PUBLISH_FAILURES.labels(
+            system=MessagingSystem.PUBSUB.value).inc()
+        print(f"Failed to publish message to Pub/Sub: {error}")
+        if isinstance(message, dict):
+            message = message["message"]
+        _spool_message(MessagingSystem.PUBSUB, message)
+    else:
+        print(f"Published message to Pub/Sub: {message}")
+
+
+def get_pubsub_publisher() -> PubSubHelper:
+    """Return the batching Pub/Sub publisher shared by every MessageSender."""
+    global _pubsub_publisher
+    if _pubsub_publisher is None:
+        with _publishers_lock:
+            if _pubsub_publisher is None:
+                _pubsub_publisher = PubSubHelper(
+                    PROJECT_ID, QUEUE_NAME, on_complete=_print_pubsub_outcome)
+    return _pubsub_publisher
+
+
+def set_pubsub_publisher(publisher: Optional[PubSubHelper]):
+    """Replace the shared Pub/Sub publisher, e.g. with one using a fake client."""
+    global _pubsub_publisher
+    with _publishers_lock:
+        _pubsub_publisher = publisher
+
+
+def get_publish_executor() -> ThreadPoolExecutor:
+    """Return the executor running blocking publishes for asyncio booths."""
+    global _publish_executor
+    if _publish_executor is None:
+        with _publishers_lock:
+            if _publish_executor is None:
+                _publish_executor = ThreadPoolExecutor(
+                    ASYNC_PUBLISH_WORKERS, thread_name_prefix="publisher")
+    return _publish_executor
+
+
+def _replay_to_rabbitmq(messages: List[event_codec.Message]):
+    get_rabbitmq_publisher().publish_batch(messages)
+
+
+def _replay_to_pubsub(messages: List[event_codec.Message]):
+    # Same payloads as MessageSender._send_to_pubsub
+    get_pubsub_publisher().publish_batch([
+        message if isinstance(message, bytes)
+        else json.dumps({"message": message}).encode("utf-8")
+        for message in messages])
+
+
+_REPLAY_SENDERS = {
+    MessagingSystem.RABBITMQ: _replay_to_rabbitmq,
+    MessagingSystem.PUBSUB: _replay_to_pubsub,
+}
+
+
+def _get_spool_replayer(messaging_system: MessagingSystem
+                        ) -> Optional[SpoolReplayer]:
+    if not SPOOL_DIR or messaging_system not in _REPLAY_SENDERS:
+        return None
+    replayer = _spools.get(messaging_system)
+    if replayer is None:
+        with _publishers_lock:
+            replayer = _spools.get(messaging_system)
+            if replayer is None and not _closing_publishers:
+                spool = EventSpool(str(Path(SPOOL_DIR) / messaging_system.value),
+                                   name=messaging_system.value)
+                replayer = _spools[messaging_system] = SpoolReplayer(
+                    spool, _REPLAY_SENDERS[messaging_system])
+                if spool.pending():
+                    replayer.wake()
+    return replayer
+
+
+def get_event_spool(messaging_system: MessagingSystem) -> Optional[EventSpool]:
+    """
+    Return the spool shared by every MessageSender of a messaging system,
+    None if SPOOL_DIR is not set or the system cannot fail.
+
+    Messages left in the spool by a previous run are replayed.
+    """
+    replayer = _get_spool_replayer(messaging_system)
+    return None if replayer is None else replayer.spool
+
+
+def _spool_message(messaging_system: MessagingSystem,
+                   message: event_codec.Message) -> bool:
+    """Spool a message for the replayer, return False if spooling is off."""
+    replayer = _get_spool_replayer(messaging_system)
+    if replayer is None:
+        return False
+    replayer.spool.append(message)
+    replayer.wake()
+    return True
+
+
+def get_outbound_buffer(messaging_system: MessagingSystem,
+                        capacity: int) -> Optional[OutboundBuffer]:
+    """
+    Return the OutboundBuffer shared by the MessageSenders of a messaging
+    system, so a single flusher thread publishes for all of them. The first
+    sender creates it with its capacity. None while the publishers close.
+    """
+    outbound = _outbound_buffers.get(messaging_system)
+    if outbound is None:
+        with _publishers_lock:
+            outbound = _outbound_buffers.get(messaging_system)
+            if outbound is None and not _closing_publishers:
+                flusher = MessageSender(messaging_system, buffer_size=0)
+                outbound = _outbound_buffers[messaging_system] = OutboundBuffer(
+                    flusher._send_batch, capacity,
+                    name=messaging_system.value)
+    return outbound
+
+
+def close_publishers():
+    """Flush and close the shared publishers. Safe to call more than once.
+
+    Spooled messages that cannot be replayed stay on disk for the next run,
+    as do the messages whose publication fails while the publishers close.
+    """
+    global _rabbitmq_publisher, _pubsub_publisher, _publish_executor
+    global _closing_publishers
+    with _publishers_lock:
+        _closing_publishers = True
+        publish_executor, _publish_executor = _publish_executor, None
+        outbound_buffers = list(_outbound_buffers.values())
+        _outbound_buffers.clear()
+    try:
+        # Buffered messages first, they are published like any other
+        for outbound in outbound_buffers:
+            outbound.close()
+        if publish_executor is not None:
+            publish_executor.shutdown(wait=True)
+        # Last replays, while the publishers are still open
+        for replayer in list(_spools.values()):
+            replayer.close()
+        with _publishers_lock:
+            rabbitmq_publisher, _rabbitmq_publisher = _rabbitmq_publisher, None
+            pubsub_publisher, _pubsub_publisher = _pubsub_publisher, None
+        if rabbitmq_publisher is not None:
+            rabbitmq_publisher.close()
+        if pubsub_publisher is not None:
+            pubsub_publisher.close()
+        # Failed publications were spooled by the publishers' callbacks
+        with _publishers_lock:
+            replayers = list(_spools.values())
+            _spools.clear()
+        for replayer in replayers:
+            replayer.spool.close()
+    finally:
+        with _publishers_lock:
+            _closing_publishers = False
+
+
 class MessageSender:
-    def __init__(self, message_sender_system: MessagingSystem = MessagingSystem.STDOUT) -> None:
+    def __init__(self, message_sender_system: MessagingSystem = MessagingSystem.STDOUT,
+                 encoding: MessageEncoding = MESSAGE_ENCODING,
+                 envelope_size: int = MESSAGE_ENVELOPE_SIZE,
+                 buffer_size: int = OUTBOUND_BUFFER_SIZE) -> None:
+        """
+        Args:
+            message_sender_system (MessagingSystem): Backend to publish to.
+            encoding (MessageEncoding): Serialization of booth events.
+            envelope_size (int): When above 0, booth events are packed by
+                that many into one BINARY envelope message.
+            buffer_size (int): When above 0, messages are queued in the
+                OutboundBuffer shared by the senders of the messaging system
+                and published by its flusher thread, so slow brokers do not
+                stall the caller.
+        """
         self.messaging_system = message_sender_system
+        self.encoding = encoding
+        self.envelope_size = envelope_size
+        self._envelope: List[event_codec.AnyBoothEvent] = []
+        self._envelope_lock = threading.Lock()
+        system = message_sender_system.value
+        self._publish_seconds = metrics.PUBLISH_SECONDS.labels(system=system)
+        self._publish_failures = metrics.PUBLISH_FAILURES.labels(system=system)
+        self.buffer_size = buffer_size
 
-    def send_message(self, message: str):
+    @profiling.profiled("message_sender.send_message")
+    def send_message(self, message: event_codec.Message):
         """Send message using the setted message sender system"""
+        if self.buffer_size > 0:
+            outbound = get_outbound_buffer(self.messaging_system,
+                                           self.buffer_size)
+            # Sent directly while the publishers close
+            if outbound is not None and outbound.put(message):
+                return
+        sender = self._get_sender(self.messaging_system)
+        self._timed_send(sender, message)
+
+    def _send_batch(self, messages: List[event_codec.Message]):
         sender = self._get_sender(self.messaging_system)
+        for message in messages:
+            self._timed_send(sender, message)
+
+    def _timed_send(self, sender, message: event_codec.Message):
+        start = time.perf_counter()
         sender(message)
+        self._publish_seconds.observe(time.perf_counter() - start)
+
+    def send_event(self, event: event_codec.AnyBoothEvent):
+        """
+        Serialize a booth event with the configured encoding and send it.
+
+        Returns:
+            The text that was sent in TEXT mode, otherwise the event itself,
+            so callers can log it without formatting it a second time.
+        """
+        if self.envelope_size > 0:
+            with self._envelope_lock:
+                self._envelope.append(event)
+                if len(self._envelope) < self.envelope_size:
+                    return event
+                events, self._envelope = self._envelope, []
+            self.send_message(event_codec.encode_envelope(
+                events, MESSAGE_ENVELOPE_COMPRESSION))
+            return event
+        if self.encoding == MessageEncoding.BINARY:
+            self.send_message(event_codec.encode_event(event))
+            return event
+        message = f"{event}"
+        self.send_message(message)
+        return message
+
+    def flush_envelope(self):
+        """Send the events waiting for their envelope to fill up"""
+        with self._envelope_lock:
+            events, self._envelope = self._envelope, []
+        if events:
+            self.send_message(event_codec.encode_envelope(
+                events, MESSAGE_ENVELOPE_COMPRESSION))
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        """
+        Send the partial envelope and wait for the outbound buffer of the
+        messaging system to empty.
+
+        Returns:
+            bool: False if buffered messages are left after ``timeout`` seconds.
+        """
+        self.flush_envelope()
+        outbound = _outbound_buffers.get(self.messaging_system)
+        if self.buffer_size <= 0 or outbound is None:
+            return True
+        return outbound.flush(timeout)
 
     def _get_sender(self, messaging_system: MessagingSystem):
         if messaging_system == MessagingSystem.STDOUT:
@@ -42,40 +340,84 @@ class MessageSender:
     def _print_message(self, message):
         print(f"{message}")
 
+    def _spool_behind(self, message) -> bool:
+        """Spool a message if earlier ones still wait in the spool, so that
+        it is not delivered before them."""
+        spool = get_event_spool(self.messaging_system)
+        if spool is None or not spool.pending():
+            return False
+        return _spool_message(self.messaging_system, message)
+
     def _send_to_rabbitmq(self, message):
-        connection = None
+        if self._spool_behind(message):
+            return
         try:
-            connection = pika.BlockingConnection(
-                pika.ConnectionParameters(host=RABBITMQ_HOST))
-            channel = connection.channel()
-            channel.queue_declare(queue=QUEUE_NAME, durable=True)
-            channel.basic_publish(
-                exchange='',
-                routing_key=QUEUE_NAME,
-                body=message,
-                properties=pika.BasicProperties(delivery_mode=2)
-            )
+            get_rabbitmq_publisher().publish(message)
             print(f" [x] Sent to RabbitMQ: {message}")
         except Exception as e:
+            self._publish_failures.inc()
             print(f"Failed to send message to RabbitMQ: {e}")
-        finally:
-            if connection:
-                connection.close()
+            _spool_message(MessagingSystem.RABBITMQ, message)
 
     def _send_to_pubsub(self, message):
+        if self._spool_behind(message):
+            return
         try:
-            publisher = pubsub_v1.PublisherClient()
-            topic_path = publisher.topic_path(PROJECT_ID, QUEUE_NAME)
+            if isinstance(message, bytes):
+                # Binary events are published as they are
+                get_pubsub_publisher().publish_data(message)
+                return
 
             # Ensure the message is in JSON format if necessary
             if not isinstance(message, dict):
                 # Convert to dict if it's a plain string
                 message = {"message": message}
 
-            json_str = json.dumps(message)
-            data = json_str.encode("utf-8")
-            future = publisher.publish(topic_path, data=data)
-            future.result()  # Wait for the publish to complete
-            print(f"Published message to Pub/Sub: {message}")
+            # Completion is reported asynchronously by the shared publisher
+            get_pubsub_publisher().publish_message(message)
         except Exception as e:
+            self._publish_failures.inc()
             print(f"Failed to publish message to Pub/Sub: {e}")
+            if isinstance(message, dict):
+                message = message["message"]
+            _spool_message(MessagingSystem.PUBSUB, message)
+
+
+class AsyncMessageSender(MessageSender):
+    """
+    MessageSender for booths running as asyncio coroutines.
+
+    ``send_message`` never blocks the event loop: blocking backends publish
+    from a shared thread pool and Pub/Sub publishes are already asynchronous.
+    Await ``flush`` to wait for the messages handed to the pool.
+    """
+
+    def __init__(self, message_sender_system: MessagingSystem = MessagingSystem.STDOUT,
+                 encoding: MessageEncoding = MESSAGE_ENCODING,
+                 envelope_size: int = MESSAGE_ENVELOPE_SIZE) -> None:
+        # Publishes already leave the event loop, no outbound buffer needed.
+        super().__init__(message_sender_system, encoding, envelope_size,
+                         buffer_size=0)
+        self._pending: Set[asyncio.Future] = set()
+
+    @profiling.profiled("message_sender.send_message")
+    def send_message(self, message: event_codec.Message):
+        """Send message without blocking the running event loop"""
+        sender = self._get_sender(self.messaging_system)
+        if self.messaging_system != MessagingSystem.RABBITMQ:
+            self._timed_send(sender, message)
+            return
+        future = asyncio.get_running_loop().run_in_executor(
+            get_publish_executor(), self._timed_send, sender, message)
+        self._pending.add(future)
+        future.add_done_callback(self._pending.discard)
+
+    async def send_message_async(self, message: event_codec.Message):
+        """Send message and wait until it is handed to the broker"""
+        self.send_message(message)
+        await self.flush()
+
+    async def flush(self):
+        """Wait for every message handed to the publishing threads"""
+        if self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
@@ -0,0 +1,250 @@
+import collections
+import enum
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from typing import Callable, Deque, List, Optional
+
+from messaging.event_codec import Message
+from messaging.event_spool import EventSpool
+from monitoring import metrics
+
+logger = logging.getLogger(__name__)
+
+OUTBOUND_BATCH_SIZE = int(os.getenv("OUTBOUND_BATCH_SIZE", "100"))
+OUTBOUND_FLUSH_INTERVAL = float(os.getenv("OUTBOUND_FLUSH_INTERVAL", "0.05"))
+OUTBOUND_SPILL_DIR = os.getenv("OUTBOUND_SPILL_DIR", "")
+
+OUTBOUND_QUEUE_DEPTH = metrics.REGISTRY.gauge(
+    "toll_outbound_queue_depth",
+    "Messages waiting in outbound buffers, including spilled ones.",
+    ["system"])
+OUTBOUND_FLUSH_SECONDS = metrics.REGISTRY.histogram(
+    "toll_outbound_flush_seconds", "Time to send one batch of messages.",
+    ["system"])
+OUTBOUND_DROPPED = metrics.REGISTRY.counter(
+    "toll_outbound_dropped", "Messages dropped because a buffer was full.",
+    ["system"])
+OUTBOUND_SPILLED = metrics.REGISTRY.counter(
+    "toll_outbound_spilled", "Messages spilled to disk because a buffer was full.",
+    ["system"])
+
+
+class BackpressurePolicy(str, enum.Enum):
+    """What happens to a message sent while the outbound buffer is full"""
+    BLOCK = "block"
+    DROP_OLDEST = "drop_oldest"
+    SPILL = "spill"
+
+
+OUTBOUND_POLICY = BackpressurePolicy(
+    os.getenv("OUTBOUND_POLICY", BackpressurePolicy.BLOCK.value))
+
+
+class OutboundBuffer:
+    """
+    Bounded buffer of messages drained in batches by a background thread.
+
+    Producers only append to the buffer, so they do not wait on the broker
+    unless the buffer is full and the policy is BLOCK. With SPILL, messages
+    that do not fit are appended to a file and sent once the buffer is
+    drained; messages keep their order since nothing enters the buffer while
+    some are spilled. The spill is a temporary EventSpool, bounded like any
+    spool by SPOOL_MAX_SEGMENTS, and removed on close.
+    """
+
+    def __init__(self, send_batch: Callable[[List[Message]], None],
+                 capacity: int,
+                 batch_size: int = OUTBOUND_BATCH_SIZE,
+                 flush_interval: float = OUTBOUND_FLUSH_INTERVAL,
+                 policy: BackpressurePolicy = OUTBOUND_POLICY,
+                 name: str = "outbound",
+                 spill_dir: str = OUTBOUND_SPILL_DIR):
+        """
+        Args:
+            send_batch (Callable[[List[Message]], None]): Sends messages,
+                called from the flusher thread only.
+            capacity (int): Messages held in memory.
+            batch_size (int): Most messages handed to send_batch at once.
+            flush_interval (float): Longest time in seconds a message waits
+                for its batch to fill up.
+            policy (BackpressurePolicy): Behavior when the buffer is full.
+            name (str): Label of the buffer metrics and of the thread.
+            spill_dir (str): Directory of the spill spools, the system
+                temporary directory by default.
+        """
+        self.send_batch = send_batch
+        self.capacity = max(1, capacity)
+        self.batch_size = max(1, min(batch_size, self.capacity))
+        self.flush_interval = flush_interval
+        self.policy = policy
+        self.name = name
+        self.spill_dir = spill_dir or None
+
+        self._messages: Deque[Message] = collections.deque()
+        self._condition = threading.Condition()
+        self._sending = 0  # Messages taken by the flusher, not yet sent
+        self._flush_waiters = 0
+        self._spilled = 0
+        self._spill: Optional[EventSpool] = None
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+
+        self._depth = OUTBOUND_QUEUE_DEPTH.labels(system=name)
+        self._flush_seconds = OUTBOUND_FLUSH_SECONDS.labels(system=name)
+        self._dropped = OUTBOUND_DROPPED.labels(system=name)
+        self._spilled_count = OUTBOUND_SPILLED.labels(system=name)
+
+    def __len__(self) -> int:
+        return len(self._messages) + self._spilled
+
+    def put(self, message: Message) -> bool:
+        """
+        Queue a message for the flusher.
+
+        Returns:
+            bool: False if the buffer is closed and the message was not queued.
+        """
+        with self._condition:
+            if self._closed:
+                return False
+            if self._thread is None:
+                self._start()
+            if self._spilled or len(self._messages) >= self.capacity:
+                if not self._handle_full(message):
+                    return True
+            self._messages.append(message)
+            self._depth.inc()
+            if len(self._messages) >= self.batch_size:
+                self._condition.notify_all()
+        return True
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until every queued and spilled message was sent.
+
+        Returns:
+            bool: False if messages are left after ``timeout`` seconds.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            self._flush_waiters += 1
+            self._condition.notify_all()
+            try:
+                while self._messages or self._sending or self._spilled:
+                    remaining = (None if deadline is None
+                                 else deadline - time.monotonic())
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    self._condition.wait(remaining)
+            finally:
+                self._flush_waiters -= 1
+        return True
+
+    def close(self, timeout: Optional[float] = None):
+        """Send what is left, then stop the flusher."""
+        self.flush(timeout)
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+        if self._spill is not None:
+            self._spill.close()
+            shutil.rmtree(self._spill.directory, ignore_errors=True)
+            self._spill = None
+
+    def _handle_full(self, message: Message) -> bool:
+        """Apply the policy, return True if the message still has to be queued."""
+        if self.policy == BackpressurePolicy.DROP_OLDEST:
+            self._messages.popleft()
+            self._depth.dec()
+            self._dropped.inc()
+            return True
+        if self.policy == BackpressurePolicy.SPILL:
+            self._spill_message(message)
+            return False
+        while len(self._messages) >= self.capacity and not self._closed:
+            self._condition.notify_all()
+            self._condition.wait()
+        return True
+
+    def _spill_message(self, message: Message):
+        if self._spill is None:
+            self._spill = EventSpool(tempfile.mkdtemp(
+                prefix=f"{self.name}-spill-", dir=self.spill_dir))
+        dropped = self._spill.dropped
+        self._spill.append(message)
+        # A full spill drops its oldest segment
+        lost = self._spill.dropped - dropped
+        self._spilled += 1 - lost
+        self._depth.inc(1 - lost)
+        self._spilled_count.inc()
+        if lost:
+            self._dropped.inc(lost)
+
+    def _read_spilled(self) -> List[Message]:
+        messages, position = self._spill.read(self.batch_size)
+        self._spill.commit(position)
+        self._spilled -= len(messages)
+        return messages
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._run,
+                                        name=f"Outbound-{self.name}",
+                                        daemon=True)
+        self._thread.start()
+
+    def _next_batch(self) -> Optional[List[Message]]:
+        """Wait for a full batch or the flush interval, None once closed."""
+        with self._condition:
+            deadline = None
+            while not self._closed and len(self._messages) < self.batch_size:
+                if not self._messages:
+                    if self._spilled:
+                        break
+                    deadline = None
+                    self._condition.wait()
+                    continue
+                if self._flush_waiters:
+                    break
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            if self._closed and not self._messages and not self._spilled:
+                return None
+            if self._messages:
+                count = min(self.batch_size, len(self._messages))
+                batch = [self._messages.popleft() for _ in range(count)]
+            else:
+                batch = self._read_spilled()
+            self._sending = len(batch)
+            # Producers blocked on a full buffer can go on
+            self._condition.notify_all()
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            for start in range(0, len(batch), self.batch_size):
+                chunk = batch[start:start + self.batch_size]
+                began = time.perf_counter()
+                try:
+                    self.send_batch(chunk)
+                except Exception as e:
+                    logger.error("Failed to send %d buffered messages: %s",
+                                 len(chunk), e)
+                self._flush_seconds.observe(time.perf_counter() - began)
+                self._depth.dec(len(chunk))
+            with self._condition:
+                self._sending = 0
+                self._condition.notify_all()
@@ -1,43 +1,166 @@
 import json
 import logging
+import os
+import threading
+from concurrent import futures
+from typing import Any, Callable, Dict, List, Optional, Set
+
 from google.cloud import pubsub_v1
-from typing import Dict, Any
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+PUBSUB_BATCH_MAX_MESSAGES = int(os.getenv("PUBSUB_BATCH_MAX_MESSAGES", "100"))
+PUBSUB_BATCH_MAX_BYTES = int(os.getenv("PUBSUB_BATCH_MAX_BYTES", "1000000"))
+PUBSUB_BATCH_MAX_LATENCY = float(os.getenv("PUBSUB_BATCH_MAX_LATENCY", "0.05"))
+PUBSUB_FLUSH_TIMEOUT = float(os.getenv("PUBSUB_FLUSH_TIMEOUT", "30"))
+
+# Called once a publish settles with (message, message_id, error).
+PublishCallback = Callable[[Any, Optional[str],
+                            Optional[BaseException]], None]
+
+
+def default_batch_settings() -> pubsub_v1.types.BatchSettings:
+    """Batch settings read from the PUBSUB_BATCH_* environment variables."""
+    return pubsub_v1.types.BatchSettings(
+        max_messages=PUBSUB_BATCH_MAX_MESSAGES,
+        max_bytes=PUBSUB_BATCH_MAX_BYTES,
+        max_latency=PUBSUB_BATCH_MAX_LATENCY,
+    )
+
 
 class PubSubHelper:
-    """Helper class for interacting with Google Cloud Pub/Sub."""
+    """Helper class for interacting with Google Cloud Pub/Sub.
+
+    Publishing never waits for the broker: the client batches messages in the
+    background and ``on_complete`` is invoked from the client's callback thread
+    once each publish settles. Set ``PUBSUB_EMULATOR_HOST`` to run against the
+    Pub/Sub emulator, or pass any object exposing ``topic_path`` and
+    ``publish`` returning a ``concurrent.futures.Future`` as ``publisher``.
+    """
 
-    def __init__(self, project_id: str, topic_name: str):
+    def __init__(self, project_id: str, topic_name: str,
+                 batch_settings: Optional[pubsub_v1.types.BatchSettings] = None,
+                 on_complete: Optional[PublishCallback] = None,
+                 publisher: Optional[Any] = None):
         """Initializes the PubSubHelper with the specified project ID and topic name.
 
         Args:
             project_id (str): The Google Cloud project ID.
             topic_name (str): The name of the Pub/Sub topic.
+            batch_settings (BatchSettings): Client side batching, defaults to
+                the PUBSUB_BATCH_* environment variables.
+            on_complete (PublishCallback): Called with (message, message_id,
+                error) when a publish settles. Defaults to logging the outcome.
+            publisher: Publisher client to use instead of creating one.
         """
-        self.publisher = pubsub_v1.PublisherClient()
+        if publisher is None:
+            publisher = pubsub_v1.PublisherClient(
+                batch_settings=batch_settings or default_batch_settings())
+        self.publisher = publisher
         self.topic_path = self.publisher.topic_path(project_id, topic_name)
+        self.on_complete = on_complete or self._log_outcome
+        self._pending: Set[futures.Future] = set()
+        self._pending_lock = threading.Lock()
 
-    def publish_message(self, message: Dict[str, Any]) -> None:
-        """Publishes a message to the Pub/Sub topic.
+    def publish_message(self, message: Dict[str, Any]) -> futures.Future:
+        """Publishes a message to the Pub/Sub topic without waiting for it.
 
         Args:
             message (Dict[str, Any]): The message to publish, represented as a dictionary.
 
+        Returns:
+            Future: Resolves to the message id once the broker accepted it.
+
         Raises:
-            Exception: If there is an error publishing the message.
+            Exception: If the message cannot be handed to the client.
         """
+        json_str = json.dumps(message)
+        data = json_str.encode("utf-8")
+        return self.publish_data(data, message)
+
+    def publish_data(self, data: bytes, message: Any = None) -> futures.Future:
+        """Publishes already serialized data to the Pub/Sub topic without waiting for it.
+
+        Args:
+            data (bytes): The message payload.
+            message: What on_complete receives, the payload itself by default.
+
+        Returns:
+            Future: Resolves to the message id once the broker accepted it.
+        """
+        if message is None:
+            message = data
+        future = self.publisher.publish(self.topic_path,
+                                        data=data)
+        with self._pending_lock:
+            self._pending.add(future)
+        future.add_done_callback(
+            lambda done: self._on_done(message, done))
+        return future
+
+    def publish_batch(self, data: List[bytes],
+                      timeout: Optional[float] = PUBSUB_FLUSH_TIMEOUT) -> List[str]:
+        """Publishes payloads and waits until the broker accepted all of them.
+
+        on_complete is not called for these messages.
+
+        Args:
+            data (List[bytes]): The message payloads.
+            timeout (float): Maximum number of seconds to wait for each message.
+
+        Returns:
+            List[str]: The message ids.
+
+        Raises:
+            Exception: The first error a message failed with.
+        """
+        published = [self.publisher.publish(self.topic_path, data=item)
+                     for item in data]
+        return [future.result(timeout) for future in published]
+
+    def pending_count(self) -> int:
+        """Number of publishes that have not settled yet."""
+        with self._pending_lock:
+            return len(self._pending)
+
+    def flush(self, timeout: Optional[float] = PUBSUB_FLUSH_TIMEOUT) -> bool:
+        """Wait for every in-flight publish to settle.
+
+        Args:
+            timeout (float): Maximum number of seconds to wait.
+
+        Returns:
+            bool: True if nothing is left in flight.
+        """
+        with self._pending_lock:
+            pending = list(self._pending)
+        _, not_done = futures.wait(pending, timeout=timeout)
+        if not_done:
+            logger.warning("%d Pub/Sub messages still in flight after flush.",
+                           len(not_done))
+        return not not_done
+
+    def close(self, timeout: Optional[float] = PUBSUB_FLUSH_TIMEOUT):
+        """Flush in-flight messages and stop the publisher client."""
+        stop = getattr(self.publisher, "stop", None)
+        if stop is not None:
+            stop()  # Sends every batched message before returning
+        self.flush(timeout)
+
+    def _on_done(self, message: Any, future: futures.Future):
+        with self._pending_lock:
+            self._pending.discard(future)
+        error = future.exception()
+        message_id = None if error else future.result()
         try:
-            json_str = json.dumps(message)
-            data = json_str.encode("utf-8")
-            future = self.publisher.publish(self.topic_path,
-                                            data=data)
-            #timestamp=message['timestamp'])
-            future.result()  # Wait for the publish call to complete.
-            logger.info("Published message: %s", message)
+            self.on_complete(message, message_id, error)
         except Exception as e:
-            logger.error("Failed to publish message: %s", e)
-            raise
+            logger.error("Pub/Sub completion callback failed: %s", e)
+
+    @staticmethod
+    def _log_outcome(message: Any, message_id: Optional[str],
+                     error: Optional[BaseException]):
+        if error:
+            logger.error("Failed to publish message: %s", error)
+        else:
+            logger.info("Published message %s: %s", message_id, message)
@@ -1,5 +1,39 @@
-import pika
+import collections
+import functools
 import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Deque, Dict, List, Optional, Union
+
+import pika
+import pika.exceptions
+
+logger = logging.getLogger(__name__)
+
+RABBITMQ_POOL_SIZE = int(os.getenv("RABBITMQ_POOL_SIZE", "4"))
+# 0 publishes without waiting for the broker, 1 waits for a publisher
+# confirm of every message and N > 1 commits channel transactions of N
+# messages, which blocking channels can do without a round trip per message.
+RABBITMQ_COMMIT_BATCH_SIZE = int(os.getenv("RABBITMQ_COMMIT_BATCH_SIZE", "1"))
+# Longest time in seconds a message waits in an uncommitted transaction
+# before it is committed with a smaller batch, 0 for no limit.
+RABBITMQ_COMMIT_INTERVAL = float(os.getenv("RABBITMQ_COMMIT_INTERVAL", "0.5"))
+RABBITMQ_PUBLISH_RETRIES = int(os.getenv("RABBITMQ_PUBLISH_RETRIES", "3"))
+# Unacknowledged messages the broker may send ahead of a consumer. When
+# unset, consumers acking one message at a time get 1 (fair dispatch) and
+# the pooled RabbitMQConsumer 200.
+RABBITMQ_PREFETCH_COUNT = int(os.getenv("RABBITMQ_PREFETCH_COUNT", "0"))
+PREFETCH_COUNT = RABBITMQ_PREFETCH_COUNT or 1
+POOLED_PREFETCH_COUNT = RABBITMQ_PREFETCH_COUNT or 200
+RABBITMQ_CONSUMER_WORKERS = int(os.getenv("RABBITMQ_CONSUMER_WORKERS", "4"))
+RABBITMQ_ACK_BATCH_SIZE = int(os.getenv("RABBITMQ_ACK_BATCH_SIZE", "50"))
+RABBITMQ_ACK_INTERVAL = float(os.getenv("RABBITMQ_ACK_INTERVAL", "0.1"))
+
+Message = Union[str, bytes]
+
 
 class RabbitMQHelper():
     def __init__(self, host: str ='localhost',
@@ -45,13 +79,15 @@ class RabbitMQHelper():
         )
         print(f" [X] Sent {message}")
 
-    def consume_message(self, callback):
+    def consume_message(self, callback,
+                        prefetch_count: int = PREFETCH_COUNT):
         """
         Start consuming messages from the queue.
         
         :param callback: A function to process the received messages.
+        :param prefetch_count: Unacknowledged messages the broker may send ahead.
         """
-        self.channel.basic_qos(prefetch_count=1)
+        self.channel.basic_qos(prefetch_count=prefetch_count)
         self.channel.basic_consume(
             queue=self.queue_name,
             on_message_callback=callback,
@@ -83,3 +119,445 @@ class RabbitMQHelper():
         :param requeue: Whether to requeue the message (default is False).
         """
         self.channel.basic_nack(delivery_tag, requeue=requeue)
+
+
+class _PooledChannel:
+    """A connection/channel pair owned by at most one publishing thread at a time."""
+
+    def __init__(self, host: str, commit_batch_size: int,
+                 commit_interval: float = RABBITMQ_COMMIT_INTERVAL):
+        self.connection = pika.BlockingConnection(
+            pika.ConnectionParameters(host=host))
+        self.channel = self.connection.channel()
+        self.commit_batch_size = commit_batch_size
+        self.commit_interval = commit_interval
+        if commit_batch_size > 1:
+            # Blocking channels wait for every publisher confirm, so batches
+            # are made durable by committing a channel transaction instead.
+            self.channel.tx_select()
+        elif commit_batch_size == 1:
+            self.channel.confirm_delivery()
+        # Messages handed to the channel but not yet committed or confirmed.
+        self.uncommitted: List[Message] = []
+        # When the oldest uncommitted message was published, monotonic time.
+        self.uncommitted_since = 0.0
+
+    def publish(self, exchange: str, routing_key: str, message: Message):
+        if not self.uncommitted:
+            self.uncommitted_since = time.monotonic()
+        self.uncommitted.append(message)
+        self.channel.basic_publish(
+            exchange=exchange,
+            routing_key=routing_key,
+            body=message,
+            properties=pika.BasicProperties(delivery_mode=2)
+        )
+        if (self.commit_batch_size <= 1
+                or len(self.uncommitted) >= self.commit_batch_size
+                or self.commit_overdue()):
+            self.commit()
+
+    def commit_overdue(self) -> bool:
+        """Whether the oldest uncommitted message waited commit_interval."""
+        return (self.commit_interval > 0 and bool(self.uncommitted)
+                and time.monotonic() - self.uncommitted_since
+                >= self.commit_interval)
+
+    def commit(self):
+        if self.commit_batch_size > 1 and self.uncommitted:
+            self.channel.tx_commit()
+        self.uncommitted.clear()
+
+    def close(self):
+        try:
+            if self.connection.is_open:
+                self.connection.close()
+        except pika.exceptions.AMQPError:
+            pass
+
+
+class RabbitMQPublisher:
+    """Long-lived, thread-safe RabbitMQ publisher backed by a channel pool.
+
+    pika connections must not be shared between threads, so every publishing
+    thread checks out its own connection/channel pair from the pool and
+    returns it once the message is handed to the broker. Broken connections
+    are dropped and replaced transparently.
+    """
+
+    def __init__(self, host: str = 'localhost', queue_name: str = "",
+                 exchange: str = '', durable: bool = True,
+                 pool_size: int = RABBITMQ_POOL_SIZE,
+                 commit_batch_size: int = RABBITMQ_COMMIT_BATCH_SIZE,
+                 commit_interval: float = RABBITMQ_COMMIT_INTERVAL,
+                 max_retries: int = RABBITMQ_PUBLISH_RETRIES):
+        """
+        Initialize the publisher. Connections are opened lazily.
+
+        :param host: RabbitMQ host (default is 'localhost').
+        :param queue_name: The queue to publish to, declared once.
+        :param exchange: The exchange to publish to (default is '').
+        :param durable: Whether the queue should be durable.
+        :param pool_size: Maximum number of pooled connections.
+        :param commit_batch_size: 0 publishes without waiting for the
+            broker, 1 waits for a publisher confirm of every message and
+            N > 1 commits messages in channel transactions of N.
+        :param commit_interval: With N > 1, longest time in seconds a
+            message stays uncommitted, idle channels being committed by a
+            background thread. 0 waits for full batches.
+        :param max_retries: Reconnection attempts before a publish fails.
+        """
+        self.host = host
+        self.queue_name = queue_name
+        self.exchange = exchange
+        self.durable = durable
+        self.pool_size = max(1, pool_size)
+        self.commit_batch_size = max(0, commit_batch_size)
+        self.commit_interval = max(0.0, commit_interval)
+        self.max_retries = max(0, max_retries)
+
+        # Idle channels, the most recently used last. A slot is taken by
+        # every channel, idle, checked out or being opened; waiters for a
+        # channel are notified whenever one is returned or a slot is freed.
+        self._idle: List[_PooledChannel] = []
+        self._open_channels: List[_PooledChannel] = []
+        self._slots_in_use = 0
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._queue_declared = False
+        # Commits the batches of idle channels once they are overdue
+        self._committer: Optional[threading.Thread] = None
+        self._committer_stop = threading.Event()
+
+    def publish(self, message: Message):
+        """
+        Publish a message, reconnecting if the pooled connection was lost.
+
+        :param message: The message body.
+        :raises pika.exceptions.AMQPError: If the broker stays unreachable.
+        """
+        self._publish_pooled([message], commit=False)
+
+    def publish_batch(self, messages: List[Message]):
+        """
+        Publish messages in order on a single pooled channel.
+
+        Messages of a batch that failed halfway may be published twice once
+        the batch is retried.
+
+        :param messages: The message bodies.
+        :raises pika.exceptions.AMQPError: If the broker stays unreachable.
+        """
+        self._publish_pooled(messages, commit=True)
+
+    def flush(self):
+        """Commit the pending batch of every idle pooled channel."""
+        self._commit_idle(overdue_only=False)
+
+    def _commit_idle(self, overdue_only: bool):
+        with self._lock:
+            if overdue_only:
+                idle_channels = [pooled for pooled in self._idle
+                                 if pooled.commit_overdue()]
+                self._idle = [pooled for pooled in self._idle
+                              if pooled not in idle_channels]
+            else:
+                idle_channels, self._idle = self._idle, []
+        for pooled in idle_channels:
+            try:
+                pooled = self._publish_with_retry(pooled, [], commit=True)
+            except Exception as e:
+                logger.error("Failed to flush RabbitMQ batch: %s", e)
+                self._free_slot()
+                continue
+            self._release(pooled)
+
+    def close(self):
+        """
+        Flush pending batches and close every idle pooled connection.
+
+        Channels checked out by publishing threads go back to the pool when
+        their publish ends, the publisher stays usable.
+        """
+        with self._lock:
+            committer, self._committer = self._committer, None
+            self._committer_stop.set()
+        if committer is not None:
+            committer.join()
+        self.flush()
+        with self._lock:
+            idle_channels, self._idle = self._idle, []
+            for pooled in idle_channels:
+                if pooled in self._open_channels:
+                    self._open_channels.remove(pooled)
+            self._slots_in_use -= len(idle_channels)
+            self._queue_declared = False
+            self._available.notify_all()
+        for pooled in idle_channels:
+            pooled.close()
+
+    def _publish_pooled(self, messages: List[Message], commit: bool):
+        if (self._committer is None and self.commit_batch_size > 1
+                and self.commit_interval > 0):
+            self._start_committer()
+        pooled = self._acquire()
+        try:
+            pooled = self._publish_with_retry(pooled, messages, commit=commit)
+        except BaseException:
+            # The channel was discarded, give its slot to a waiting thread
+            self._free_slot()
+            raise
+        self._release(pooled)
+
+    def _publish_with_retry(self, pooled: Optional[_PooledChannel],
+                            messages: List[Message],
+                            commit: bool = False) -> _PooledChannel:
+        """
+        Publish on ``pooled``, or on a new channel if None, and return the
+        channel. On failure the channel is discarded before raising.
+        """
+        pending = list(messages)
+        attempt = 0
+        while True:
+            try:
+                if pooled is None:
+                    pooled = self._connect()
+                while pending:
+                    pooled.publish(self.exchange, self.queue_name,
+                                   pending.pop(0))
+                if commit:
+                    pooled.commit()
+                return pooled
+            except pika.exceptions.AMQPError as e:
+                if pooled is not None:
+                    # Uncommitted messages died with the connection,
+                    # publish them again on the new one.
+                    pending = pooled.uncommitted + pending
+                    self._discard(pooled)
+                    pooled = None
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                logger.warning("RabbitMQ publish failed (%s), reconnecting "
+                               "(attempt %d/%d).", e, attempt, self.max_retries)
+            except BaseException:
+                # The channel state is unknown, do not hand it out again
+                if pooled is not None:
+                    self._discard(pooled)
+                raise
+
+    def _start_committer(self):
+        with self._lock:
+            if self._committer is not None:
+                return
+            # An event per thread, so a closed publisher's thread stays stopped
+            self._committer_stop = threading.Event()
+            self._committer = threading.Thread(
+                target=self._commit_periodically,
+                args=(self._committer_stop,),
+                name="RabbitMQ-committer", daemon=True)
+            self._committer.start()
+
+    def _commit_periodically(self, stop: threading.Event):
+        while not stop.wait(self.commit_interval):
+            self._commit_idle(overdue_only=True)
+
+    def _acquire(self) -> Optional[_PooledChannel]:
+        """
+        Return an idle channel, or None when a new one may be opened, and
+        wait for one otherwise.
+        """
+        with self._available:
+            while True:
+                if self._idle:
+                    return self._idle.pop()
+                if self._slots_in_use < self.pool_size:
+                    self._slots_in_use += 1
+                    return None
+                self._available.wait()
+
+    def _release(self, pooled: _PooledChannel):
+        with self._available:
+            self._idle.append(pooled)
+            self._available.notify()
+
+    def _free_slot(self):
+        with self._available:
+            self._slots_in_use = max(0, self._slots_in_use - 1)
+            self._available.notify()
+
+    def _connect(self) -> _PooledChannel:
+        pooled = _PooledChannel(self.host, self.commit_batch_size,
+                                self.commit_interval)
+        with self._lock:
+            declare = not self._queue_declared and bool(self.queue_name)
+            self._queue_declared = True
+            self._open_channels.append(pooled)
+        if declare:
+            pooled.channel.queue_declare(queue=self.queue_name,
+                                         durable=self.durable)
+        return pooled
+
+    def _discard(self, pooled: _PooledChannel):
+        with self._lock:
+            if pooled in self._open_channels:
+                self._open_channels.remove(pooled)
+            # Redeclare on the next connection in case the broker restarted.
+            self._queue_declared = False
+        pooled.close()
+
+
+class RejectMessage(Exception):
+    """Raised by a RabbitMQConsumer handler to reject a message without
+    requeueing it, e.g. when it can never be processed."""
+
+
+class RabbitMQConsumer:
+    """RabbitMQ consumer processing messages on a bounded worker pool.
+
+    The connection stays owned by the consuming thread: workers only run the
+    handler and hand the outcome back with ``add_callback_threadsafe``.
+    Processed messages are acknowledged in batches with ``multiple=True`` up
+    to the highest delivery tag below which every message is settled, while
+    failed messages are rejected right away, requeued once and dropped if
+    they fail again after redelivery. Handlers raise ``RejectMessage`` to
+    drop a message at once.
+    """
+
+    def __init__(self, host: str = 'localhost', queue_name: str = "",
+                 durable: bool = True,
+                 prefetch_count: int = POOLED_PREFETCH_COUNT,
+                 workers: int = RABBITMQ_CONSUMER_WORKERS,
+                 ack_batch_size: int = RABBITMQ_ACK_BATCH_SIZE,
+                 ack_interval: float = RABBITMQ_ACK_INTERVAL):
+        """
+        Initialize the consumer. The connection is opened by ``consume``.
+
+        :param host: RabbitMQ host (default is 'localhost').
+        :param queue_name: The queue to consume from.
+        :param durable: Whether the queue should be durable.
+        :param prefetch_count: Unacknowledged messages the broker may send
+            ahead, which also bounds the messages waiting for a worker.
+        :param workers: Number of threads running the handler.
+        :param ack_batch_size: Settled messages acknowledged together.
+        :param ack_interval: Longest time in seconds an ack is held back.
+        """
+        self.host = host
+        self.queue_name = queue_name
+        self.durable = durable
+        self.prefetch_count = max(1, prefetch_count)
+        self.workers = max(1, workers)
+        self.ack_batch_size = max(1, ack_batch_size)
+        self.ack_interval = ack_interval
+
+        self.connection: Optional[pika.BlockingConnection] = None
+        self.channel = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        # Delivery tags in delivery order, and the outcome of each tag:
+        # None while processing, then True if processed, False if rejected.
+        self._in_flight: Deque[int] = collections.deque()
+        self._outcomes: Dict[int, Optional[bool]] = {}
+        self._ack_tag = 0
+        self._unacked_settled = 0
+        self.processed_count = 0
+        self.failed_count = 0
+
+    def consume(self, handler: Callable[[bytes], None]):
+        """
+        Consume messages until interrupted, then drain the worker pool.
+
+        :param handler: Called with each message body from a worker thread.
+            Raising marks the message as failed, RejectMessage drops it
+            without a retry.
+        """
+        self.connection = pika.BlockingConnection(
+            pika.ConnectionParameters(host=self.host))
+        self.channel = self.connection.channel()
+        if self.queue_name:
+            self.channel.queue_declare(queue=self.queue_name,
+                                       durable=self.durable)
+        self.channel.basic_qos(prefetch_count=self.prefetch_count)
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="Consumer")
+        self.channel.basic_consume(
+            queue=self.queue_name,
+            on_message_callback=functools.partial(self._on_message, handler),
+            auto_ack=False)
+        self.connection.call_later(self.ack_interval, self._flush_periodically)
+        print(f" [*] Waiting for messages in {self.queue_name} with "
+              f"{self.workers} workers. To exit press CTRL+C")
+        try:
+            self.channel.start_consuming()
+        except KeyboardInterrupt:
+            print(" [*] Stopping consumption...")
+        finally:
+            self._shutdown()
+
+    def stop(self):
+        """Ask the consuming thread to stop, safe to call from any thread."""
+        if self.connection is not None:
+            self.connection.add_callback_threadsafe(self.channel.stop_consuming)
+
+    def _on_message(self, handler, ch, method, properties, body):
+        self._in_flight.append(method.delivery_tag)
+        self._outcomes[method.delivery_tag] = None
+        self._executor.submit(self._process, handler, method, body)
+
+    def _process(self, handler, method, body):
+        # Retry once, a message failing after redelivery is dropped.
+        requeue = not method.redelivered
+        try:
+            handler(body)
+            success = True
+        except RejectMessage as e:
+            logger.error("Rejected message %s: %s", method.delivery_tag, e)
+            success = requeue = False
+        except Exception as e:
+            logger.error("Failed to process message %s: %s",
+                         method.delivery_tag, e)
+            success = False
+        self.connection.add_callback_threadsafe(functools.partial(
+            self._settle, method.delivery_tag, success, requeue))
+
+    def _settle(self, delivery_tag: int, success: bool, requeue: bool):
+        """Record an outcome, runs on the consuming thread."""
+        if success:
+            self.processed_count += 1
+        else:
+            self.failed_count += 1
+            self.channel.basic_nack(delivery_tag, requeue=requeue)
+        self._outcomes[delivery_tag] = success
+        while (self._in_flight
+               and self._outcomes[self._in_flight[0]] is not None):
+            tag = self._in_flight.popleft()
+            if self._outcomes.pop(tag):
+                self._ack_tag = tag
+                self._unacked_settled += 1
+        if self._unacked_settled >= self.ack_batch_size:
+            self._flush_acks()
+
+    def _flush_acks(self):
+        if self._unacked_settled:
+            # Every earlier tag is settled: processed or already rejected.
+            self.channel.basic_ack(self._ack_tag, multiple=True)
+            self._unacked_settled = 0
+
+    def _flush_periodically(self):
+        self._flush_acks()
+        if self.channel.is_open:
+            self.connection.call_later(self.ack_interval,
+                                       self._flush_periodically)
+
+    def _shutdown(self):
+        try:
+            if self.channel.is_open:
+                self.channel.stop_consuming()
+            self._executor.shutdown(wait=True)
+            # Run the settle callbacks of the last processed messages.
+            self.connection.process_data_events(time_limit=0)
+            self._flush_acks()
+        except pika.exceptions.AMQPError as e:
+            logger.error("Failed to acknowledge the last messages: %s", e)
+        finally:
+            if self.connection.is_open:
+                self.connection.close()
@@ -0,0 +1,349 @@
+"""
+Real-time aggregation of booth events into per plaza and per booth metrics.
+
+Events are folded into fixed-size windows as they arrive, so each event costs
+O(1) and memory only depends on the window settings and the number of
+booths. Windows follow event time: the newest event timestamp seen is the
+current time of the stream, and events older than the sliding window are
+counted as late and dropped.
+"""
+import collections
+import os
+import threading
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+import dotenv
+import pydantic
+
+from messaging.consume_message import MessageConsumer
+from monitoring import log_config
+from traffic_management.booth_event import BoothEventType, CompactBoothEvent
+from traffic_management.vehicle import VehicleType
+
+dotenv.load_dotenv()
+
+QUEUE_NAME = os.getenv("QUEUE_NAME", "")
+RABBITMQ_HOST = os.getenv("RABBITMQ_HOST", "")
+STREAM_WINDOW_SECONDS = float(os.getenv("STREAM_WINDOW_SECONDS", "60"))
+STREAM_SLIDE_SECONDS = float(os.getenv("STREAM_SLIDE_SECONDS", "5"))
+# Closed tumbling windows kept per plaza and booth.
+STREAM_TUMBLING_HISTORY = int(os.getenv("STREAM_TUMBLING_HISTORY", "60"))
+STREAM_REPORT_INTERVAL = float(os.getenv("STREAM_REPORT_INTERVAL", "10"))
+# Vehicles between ENTER and EXIT remembered per booth for service times.
+STREAM_MAX_OPEN_VEHICLES = int(os.getenv("STREAM_MAX_OPEN_VEHICLES", "1024"))
+
+NANOSECONDS = 1_000_000_000
+
+
+def plaza_from_booth_id(booth_id: str) -> str:
+    """Plaza of a booth named "<plaza_id>-<booth number>"."""
+    return booth_id.split("-", 1)[0]
+
+
+class WindowStats(pydantic.BaseModel):
+    """Metrics of the vehicles that left a plaza or booth during a window"""
+    key: str
+    window_start: float
+    window_seconds: float
+    vehicles: int = 0
+    vehicles_per_minute: float = 0
+    avg_service_time: Optional[float] = None
+    vehicles_by_type: Dict[VehicleType, int] = {}
+
+
+class _Accumulator:
+    """Running sums of a window, which can be added and subtracted."""
+    __slots__ = ("vehicles", "service_time_total", "service_time_count",
+                 "by_type")
+
+    def __init__(self):
+        self.vehicles = 0
+        self.service_time_total = 0
+        self.service_time_count = 0
+        self.by_type: Dict[VehicleType, int] = {}
+
+    def add(self, vehicle_type: VehicleType, service_time_ns: Optional[int]):
+        self.vehicles += 1
+        self.by_type[vehicle_type] = self.by_type.get(vehicle_type, 0) + 1
+        if service_time_ns is not None:
+            self.service_time_total += service_time_ns
+            self.service_time_count += 1
+
+    def merge(self, other: "_Accumulator", sign: int = 1):
+        self.vehicles += sign * other.vehicles
+        self.service_time_total += sign * other.service_time_total
+        self.service_time_count += sign * other.service_time_count
+        for vehicle_type, count in other.by_type.items():
+            total = self.by_type.get(vehicle_type, 0) + sign * count
+            if total:
+                self.by_type[vehicle_type] = total
+            else:
+                self.by_type.pop(vehicle_type, None)
+
+    def to_stats(self, key: str, window_start_ns: int,
+                 window_seconds: float) -> WindowStats:
+        return WindowStats(
+            key=key,
+            window_start=window_start_ns / NANOSECONDS,
+            window_seconds=window_seconds,
+            vehicles=self.vehicles,
+            vehicles_per_minute=self.vehicles * 60 / window_seconds,
+            avg_service_time=(
+                self.service_time_total / self.service_time_count / NANOSECONDS
+                if self.service_time_count else None),
+            vehicles_by_type=dict(self.by_type))
+
+
+class SlidingWindow:
+    """
+    Window of ``window_seconds`` moving by steps of ``slide_seconds``.
+
+    Keeps one accumulator per step in a ring plus their running total: a new
+    step subtracts the step that falls out of the window instead of
+    recomputing the window.
+    """
+
+    def __init__(self, window_seconds: float, slide_seconds: float):
+        self.window_seconds = window_seconds
+        self.slide_ns = int(slide_seconds * NANOSECONDS)
+        self.num_steps = max(1, round(window_seconds / slide_seconds))
+        self._ring: List[_Accumulator] = [_Accumulator()
+                                          for _ in range(self.num_steps)]
+        self._total = _Accumulator()
+        self._step: Optional[int] = None  # Newest step of the window
+
+    def add(self, timestamp_ns: int, vehicle_type: VehicleType,
+            service_time_ns: Optional[int]) -> bool:
+        """Count a vehicle, return False if it is too late for the window."""
+        step = timestamp_ns // self.slide_ns
+        self.advance(step)
+        if step <= self._step - self.num_steps:
+            return False
+        self._ring[step % self.num_steps].add(vehicle_type, service_time_ns)
+        self._total.add(vehicle_type, service_time_ns)
+        return True
+
+    def advance(self, step: int):
+        """Move the window so that it ends with ``step``."""
+        if self._step is None:
+            self._step = step
+            return
+        expired = min(step - self._step, self.num_steps)
+        for offset in range(1, expired + 1):
+            bucket = self._ring[(self._step + offset) % self.num_steps]
+            self._total.merge(bucket, -1)
+            self._ring[(self._step + offset) % self.num_steps] = _Accumulator()
+        self._step = max(self._step, step)
+
+    def stats(self, key: str) -> WindowStats:
+        """Return the metrics of the current window."""
+        newest = self._step or 0
+        start_ns = (newest - self.num_steps + 1) * self.slide_ns
+        return self._total.to_stats(key, start_ns, self.window_seconds)
+
+
+class TumblingWindow:
+    """Consecutive non-overlapping windows, keeping the last closed ones."""
+
+    def __init__(self, window_seconds: float, history: int):
+        self.window_seconds = window_seconds
+        self.window_ns = int(window_seconds * NANOSECONDS)
+        self._current = _Accumulator()
+        self._index: Optional[int] = None
+        self.closed: Deque[Tuple[int, _Accumulator]] = collections.deque(
+            maxlen=max(1, history))
+
+    def add(self, timestamp_ns: int, vehicle_type: VehicleType,
+            service_time_ns: Optional[int]) -> bool:
+        """Count a vehicle, return False if its window is already closed."""
+        index = timestamp_ns // self.window_ns
+        if self._index is None:
+            self._index = index
+        elif index > self._index:
+            self.closed.append((self._index, self._current))
+            self._current = _Accumulator()
+            self._index = index
+        elif index < self._index:
+            return False
+        self._current.add(vehicle_type, service_time_ns)
+        return True
+
+    def stats(self, key: str, include_current: bool = True) -> List[WindowStats]:
+        """Return the metrics of the closed windows, oldest first."""
+        windows = list(self.closed)
+        if include_current and self._index is not None:
+            windows.append((self._index, self._current))
+        return [accumulator.to_stats(key, index * self.window_ns,
+                                     self.window_seconds)
+                for index, accumulator in windows]
+
+
+class _KeyWindows:
+    """Sliding and tumbling windows of one plaza or booth."""
+    __slots__ = ("sliding", "tumbling")
+
+    def __init__(self, window_seconds: float, slide_seconds: float,
+                 history: int):
+        self.sliding = SlidingWindow(window_seconds, slide_seconds)
+        self.tumbling = TumblingWindow(window_seconds, history)
+
+    def add(self, timestamp_ns: int, vehicle_type: VehicleType,
+            service_time_ns: Optional[int]) -> bool:
+        on_time = self.sliding.add(timestamp_ns, vehicle_type, service_time_ns)
+        self.tumbling.add(timestamp_ns, vehicle_type, service_time_ns)
+        return on_time
+
+
+class StreamingAggregator:
+    """
+    Incremental per plaza and per booth metrics over booth events.
+
+    A vehicle is counted when its EXIT event arrives; its service time is
+    the time since its ENTER event at the same booth. Thread-safe, so it can
+    be fed by a pooled consumer.
+    """
+
+    def __init__(self, window_seconds: float = STREAM_WINDOW_SECONDS,
+                 slide_seconds: float = STREAM_SLIDE_SECONDS,
+                 tumbling_history: int = STREAM_TUMBLING_HISTORY,
+                 plaza_of_booth: Callable[[str], str] = plaza_from_booth_id,
+                 max_open_vehicles: int = STREAM_MAX_OPEN_VEHICLES):
+        """
+        Args:
+            window_seconds (float): Length of the sliding and tumbling windows.
+            slide_seconds (float): Step by which the sliding window moves.
+            tumbling_history (int): Closed tumbling windows kept per key.
+            plaza_of_booth (Callable[[str], str]): Returns the plaza id of a
+                booth id, events do not carry it.
+            max_open_vehicles (int): Vehicles waiting for their EXIT event
+                kept per booth, the oldest are forgotten beyond that.
+        """
+        self.window_seconds = window_seconds
+        self.slide_seconds = slide_seconds
+        self.tumbling_history = tumbling_history
+        self.plaza_of_booth = plaza_of_booth
+        self.max_open_vehicles = max_open_vehicles
+
+        self._lock = threading.Lock()
+        self._plazas: Dict[str, _KeyWindows] = {}
+        self._booths: Dict[str, _KeyWindows] = {}
+        self._plaza_of_booth: Dict[str, str] = {}
+        # ENTER timestamps of the vehicles in service, per booth.
+        self._entered: Dict[str, "collections.OrderedDict[str, int]"] = {}
+        self.events_processed = 0
+        self.late_events = 0
+
+    def process_event(self, event: CompactBoothEvent):
+        """Fold one event into the windows of its booth and plaza."""
+        with self._lock:
+            self.events_processed += 1
+            booth_id = event.booth_id
+            entered = self._entered.get(booth_id)
+            if entered is None:
+                entered = self._entered[booth_id] = collections.OrderedDict()
+                self._register_booth(booth_id)
+
+            if event.event_type == BoothEventType.ENTER:
+                entered[event.vehicle_plate_number] = event.timestamp_ns
+                if len(entered) > self.max_open_vehicles:
+                    entered.popitem(last=False)
+                return
+            if event.event_type != BoothEventType.EXIT:
+                return
+
+            entered_ns = entered.pop(event.vehicle_plate_number, None)
+            service_time_ns = (None if entered_ns is None
+                               else event.timestamp_ns - entered_ns)
+            on_time = self._booths[booth_id].add(
+                event.timestamp_ns, event.vehicle_type, service_time_ns)
+            self._plazas[self._plaza_of_booth[booth_id]].add(
+                event.timestamp_ns, event.vehicle_type, service_time_ns)
+            if not on_time:
+                self.late_events += 1
+
+    def plaza_ids(self) -> List[str]:
+        """Return the plazas seen so far."""
+        with self._lock:
+            return list(self._plazas)
+
+    def booth_ids(self) -> List[str]:
+        """Return the booths seen so far."""
+        with self._lock:
+            return list(self._booths)
+
+    def sliding_stats(self, plaza_id: Optional[str] = None,
+                      booth_id: Optional[str] = None) -> Optional[WindowStats]:
+        """
+        Return the sliding window metrics of a booth or a plaza.
+
+        Returns:
+            Optional[WindowStats]: None if no event was seen for the key.
+        """
+        with self._lock:
+            key, windows = self._find(plaza_id, booth_id)
+            return windows.sliding.stats(key) if windows else None
+
+    def tumbling_stats(self, plaza_id: Optional[str] = None,
+                       booth_id: Optional[str] = None) -> List[WindowStats]:
+        """Return the tumbling window metrics of a booth or a plaza."""
+        with self._lock:
+            key, windows = self._find(plaza_id, booth_id)
+            return windows.tumbling.stats(key) if windows else []
+
+    def _find(self, plaza_id: Optional[str],
+              booth_id: Optional[str]) -> Tuple[str, Optional[_KeyWindows]]:
+        if booth_id is not None:
+            return booth_id, self._booths.get(booth_id)
+        return plaza_id, self._plazas.get(plaza_id)
+
+    def _register_booth(self, booth_id: str):
+        plaza_id = self.plaza_of_booth(booth_id)
+        self._plaza_of_booth[booth_id] = plaza_id
+        self._booths[booth_id] = self._new_windows()
+        if plaza_id not in self._plazas:
+            self._plazas[plaza_id] = self._new_windows()
+
+    def _new_windows(self) -> _KeyWindows:
+        return _KeyWindows(self.window_seconds, self.slide_seconds,
+                           self.tumbling_history)
+
+
+class StreamingPipeline:
+    """Feeds a StreamingAggregator from a MessageConsumer and reports it."""
+
+    def __init__(self, consumer: MessageConsumer,
+                 aggregator: Optional[StreamingAggregator] = None,
+                 report_interval: float = STREAM_REPORT_INTERVAL):
+        self.consumer = consumer
+        self.aggregator = aggregator or StreamingAggregator()
+        self.report_interval = report_interval
+        self._stop = threading.Event()
+
+    def run(self, pooled: bool = False):
+        """Consume events until interrupted, reporting periodically."""
+        reporter = threading.Thread(target=self._report_periodically,
+                                    name="Stream-reporter", daemon=True)
+        reporter.start()
+        try:
+            self.consumer.consume_events(self.aggregator.process_event,
+                                         pooled=pooled)
+        finally:
+            self._stop.set()
+            self.report()
+
+    def report(self):
+        """Print the sliding window metrics of every plaza and booth."""
+        for plaza_id in self.aggregator.plaza_ids():
+            print(f" [=] Plaza {self.aggregator.sliding_stats(plaza_id=plaza_id)}")
+        for booth_id in self.aggregator.booth_ids():
+            print(f" [=] Booth {self.aggregator.sliding_stats(booth_id=booth_id)}")
+
+    def _report_periodically(self):
+        while not self._stop.wait(self.report_interval):
+            self.report()
+
+
+if __name__ == "__main__":
+    log_config.configure_logging()
+    pipeline = StreamingPipeline(MessageConsumer(QUEUE_NAME, RABBITMQ_HOST))
+    pipeline.run()
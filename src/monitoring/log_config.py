@@ -0,0 +1,260 @@
+"""
+Logging setup of the simulator, installed once by the entry points.
+
+Records are handed to a queue and written in batches by a writer thread, so
+booth threads do not wait on stderr or on the stream handler lock. Per-vehicle
+messages are logged with a ``LogCategory`` and can be sampled or rate
+limited per category, e.g. LOG_SAMPLE_RATES="publishing=0.01" keeps one
+"Publishing ... event" line out of a hundred and
+LOG_RATE_LIMITS="assignment=20" keeps at most 20 assignment lines a second.
+Suppressed messages are counted in the toll_log_suppressed metric.
+"""
+import atexit
+import collections
+import enum
+import logging
+import os
+import sys
+import threading
+import time
+from typing import Deque, Dict, List, Optional, TextIO
+
+from monitoring import metrics
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_ASYNC = os.getenv("LOG_ASYNC", "1") == "1"
+# Records waiting for the writer thread, newer ones are dropped beyond that.
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Seconds between two writes of the queued records.
+LOG_WRITE_INTERVAL = float(os.getenv("LOG_WRITE_INTERVAL", "0.05"))
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "")
+LOG_RATE_LIMITS = os.getenv("LOG_RATE_LIMITS", "")
+
+LOG_SUPPRESSED = metrics.REGISTRY.counter(
+    "toll_log_suppressed",
+    "Log messages dropped by sampling, rate limiting or a full log queue.",
+    ["category", "reason"])
+
+
+class LogCategory(str, enum.Enum):
+    """Per-vehicle log messages that can be sampled or rate limited"""
+    ASSIGNMENT = "assignment"
+    PROCESSING = "processing"
+    PUBLISHING = "publishing"
+    IDLE = "idle"
+
+
+def category(log_category: LogCategory) -> Dict[str, str]:
+    """Return the ``extra`` argument of a log call in ``log_category``."""
+    return {"category": log_category.value}
+
+
+def parse_category_values(setting: str) -> Dict[str, float]:
+    """
+    Parse "category=value,..." settings such as LOG_SAMPLE_RATES.
+
+    Raises:
+        ValueError: If a category is unknown or a value is not a number.
+    """
+    values = {}
+    for item in filter(None, (part.strip() for part in setting.split(","))):
+        name, _, value = item.partition("=")
+        values[LogCategory(name.strip()).value] = float(value)
+    return values
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep a fraction of the records of a category, and at most a number of
+    them per second. Records without a category always pass.
+
+    Counters are updated without a lock, concurrent threads may let a few
+    more records through than configured.
+    """
+
+    def __init__(self, sample_rates: Dict[str, float],
+                 rate_limits: Dict[str, float]):
+        """
+        Args:
+            sample_rates (Dict[str, float]): Fraction of the records kept
+                per category, from 0 to 1.
+            rate_limits (Dict[str, float]): Records kept per second and
+                category.
+        """
+        super().__init__()
+        self.sample_rates = sample_rates
+        self.rate_limits = rate_limits
+        self._seen: Dict[str, int] = {}
+        # Per category: [second, records logged in that second]
+        self._windows: Dict[str, List[int]] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record_category = getattr(record, "category", None)
+        if record_category is None:
+            return True
+        rate = self.sample_rates.get(record_category)
+        if rate is not None:
+            seen = self._seen.get(record_category, 0) + 1
+            self._seen[record_category] = seen
+            # Keep the records where seen * rate reaches a new integer
+            if int(seen * rate) == int((seen - 1) * rate):
+                LOG_SUPPRESSED.labels(category=record_category,
+                                      reason="sampled").inc()
+                return False
+        limit = self.rate_limits.get(record_category)
+        if limit is not None:
+            second = int(time.monotonic())
+            window = self._windows.get(record_category)
+            if window is None or window[0] != second:
+                window = self._windows[record_category] = [second, 0]
+            window[1] += 1
+            if window[1] > limit:
+                LOG_SUPPRESSED.labels(category=record_category,
+                                      reason="rate_limited").inc()
+                return False
+        return True
+
+
+class AsyncStreamHandler(logging.Handler):
+    """
+    Handler queueing records for a writer thread.
+
+    Logging threads only append to a deque, without taking the handler lock;
+    the writer drains it every ``interval`` seconds, or as soon as it is half
+    full, and writes each batch to the stream with one write and one flush.
+    Records beyond ``capacity`` are dropped and counted.
+    """
+
+    def __init__(self, stream: TextIO, capacity: int = LOG_QUEUE_SIZE,
+                 interval: float = LOG_WRITE_INTERVAL):
+        super().__init__()
+        self.stream = stream
+        self.capacity = capacity
+        self.interval = interval
+        self._records: Deque[logging.LogRecord] = collections.deque()
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="Log-writer",
+                                        daemon=True)
+        self._thread.start()
+
+    def handle(self, record: logging.LogRecord) -> bool:
+        if not self.filter(record):
+            return False
+        self.emit(record)
+        return True
+
+    def emit(self, record: logging.LogRecord):
+        if len(self._records) >= self.capacity:
+            LOG_SUPPRESSED.labels(category=getattr(record, "category", "none"),
+                                  reason="queue_full").inc()
+            return
+        # Merge the arguments now since they may change before the writer
+        # runs, the rest of the formatting is left to the writer thread.
+        record.msg = record.getMessage()
+        record.args = None
+        self._records.append(record)
+        if len(self._records) == self.capacity // 2:
+            self._wake.set()
+
+    def close(self):
+        """Write the queued records and stop the writer thread."""
+        self._stopping = True
+        self._wake.set()
+        self._thread.join()
+        self._write()
+        super().close()
+
+    def _run(self):
+        while not self._stopping:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self._write()
+
+    def _write(self):
+        records = self._records
+        lines = []
+        while records:
+            record = records.popleft()
+            try:
+                lines.append(self.format(record))
+            except Exception:
+                self.handleError(record)
+        if lines:
+            try:
+                self.stream.write("\n".join(lines) + "\n")
+                self.stream.flush()
+            except Exception:
+                self.handleError(record)
+
+
+_lock = threading.Lock()
+_handlers: List[logging.Handler] = []
+_atexit_registered = False
+
+
+def configure_logging(level: str = LOG_LEVEL,
+                      asynchronous: bool = LOG_ASYNC,
+                      sample_rates: Optional[Dict[str, float]] = None,
+                      rate_limits: Optional[Dict[str, float]] = None,
+                      stream: Optional[TextIO] = None,
+                      force: bool = False):
+    """
+    Install the handler of the root logger, like ``logging.basicConfig``.
+
+    Does nothing if the root logger already has handlers installed by
+    someone else, unless ``force`` is set. Calling it again replaces the
+    handlers it installed.
+
+    Args:
+        level (str): Level of the root logger.
+        asynchronous (bool): Write records from a writer thread.
+        sample_rates (Dict[str, float]): Fraction of the records kept per
+            LogCategory value, LOG_SAMPLE_RATES by default.
+        rate_limits (Dict[str, float]): Records kept per second and
+            LogCategory value, LOG_RATE_LIMITS by default.
+        stream (TextIO): Where records are written, stderr by default.
+        force (bool): Remove the handlers installed by someone else.
+    """
+    global _atexit_registered
+    if sample_rates is None:
+        sample_rates = parse_category_values(LOG_SAMPLE_RATES)
+    if rate_limits is None:
+        rate_limits = parse_category_values(LOG_RATE_LIMITS)
+
+    root = logging.getLogger()
+    with _lock:
+        foreign = [handler for handler in root.handlers
+                   if handler not in _handlers]
+        if foreign and not force:
+            return
+        _remove_handlers(root)
+        for handler in foreign:
+            root.removeHandler(handler)
+
+        if asynchronous:
+            handler = AsyncStreamHandler(stream or sys.stderr)
+        else:
+            handler = logging.StreamHandler(stream or sys.stderr)
+        handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+        # Filtered in the logging thread, before the record is queued
+        handler.addFilter(SamplingFilter(sample_rates, rate_limits))
+        root.addHandler(handler)
+        root.setLevel(level)
+        _handlers.append(handler)
+        if not _atexit_registered:
+            atexit.register(shutdown_logging)
+            _atexit_registered = True
+
+
+def shutdown_logging():
+    """Write the queued records and remove the installed handlers."""
+    with _lock:
+        _remove_handlers(logging.getLogger())
+
+
+def _remove_handlers(root: logging.Logger):
+    for handler in _handlers:
+        root.removeHandler(handler)
+        handler.close()  # Writes the records still queued
+    _handlers.clear()
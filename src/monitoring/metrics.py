@@ -0,0 +1,412 @@
+"""
+Counters, gauges and histograms of the simulator, served in the Prometheus
+text format.
+
+Updates do not take locks: every thread adds to its own slot of a metric and
+slots are only summed when the metrics are scraped. Metrics with labels
+return a child per label set; hot paths look their child up once and keep it.
+"""
+import bisect
+import http.server
+import logging
+import math
+import os
+import threading
+import weakref
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Port of the /metrics endpoint, 0 does not serve metrics.
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_ADDRESS = os.getenv("METRICS_ADDRESS", "127.0.0.1")
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1, 2.5, 5, 10)
+
+LabelValues = Tuple[str, ...]
+Sample = Tuple[str, Dict[str, str], float]
+
+
+class _ThreadSlots:
+    """Float sum split in one slot per thread, each written by its thread only."""
+    __slots__ = ("_slots",)
+
+    def __init__(self):
+        self._slots: Dict[int, float] = {}
+
+    def add(self, amount: float):
+        slots = self._slots
+        ident = threading.get_ident()
+        slots[ident] = slots.get(ident, 0.0) + amount
+
+    def get(self) -> float:
+        return math.fsum(list(self._slots.values()))
+
+
+class Metric:
+    """Base class of metrics, holding one child per label values."""
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str,
+                 labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[LabelValues, object] = {}
+        self._children_lock = threading.Lock()
+
+    def labels(self, **labels: str):
+        """Return the child for the given label values, creating it once."""
+        values = self._label_values(labels)
+        child = self._children.get(values)
+        if child is None:
+            with self._children_lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def remove(self, child, **labels: str):
+        """Drop the child of the given label values if it is still ``child``,
+        so it is no longer reported."""
+        values = self._label_values(labels)
+        with self._children_lock:
+            if self._children.get(values) is child:
+                del self._children[values]
+
+    def _label_values(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _default(self):
+        if self.labelnames:
+            raise ValueError(f"Metric {self.name} requires labels "
+                             f"{self.labelnames}")
+        return self.labels()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def samples(self) -> Iterable[Sample]:
+        """Yield (sample name, labels, value) for every child."""
+        for values, child in list(self._children.items()):
+            labels = dict(zip(self.labelnames, values))
+            yield from child.samples(self.name, labels)
+
+
+class _CounterChild:
+    __slots__ = ("_value",)
+
+    def __init__(self):
+        self._value = _ThreadSlots()
+
+    def inc(self, amount: float = 1):
+        self._value.add(amount)
+
+    def get(self) -> float:
+        return self._value.get()
+
+    def samples(self, name: str, labels: Dict[str, str]) -> Iterable[Sample]:
+        yield f"{name}_total", labels, self.get()
+
+
+class Counter(Metric):
+    """Value that only goes up, e.g. vehicles processed"""
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1):
+        self._default().inc(amount)
+
+    def total(self, **labels: Sequence[str]) -> float:
+        """
+        Sum of the counter over every label set, or over those whose label
+        values are among the given ones, e.g. ``total(outcome=["a", "b"])``.
+        """
+        indexes = [(self.labelnames.index(name), set(values))
+                   for name, values in labels.items()]
+        return math.fsum(
+            child.get() for label_values, child in list(self._children.items())
+            if all(label_values[index] in values for index, values in indexes))
+
+
+class _GaugeChild:
+    __slots__ = ("_value", "_function")
+
+    def __init__(self):
+        self._value = _ThreadSlots()
+        self._function: Optional[Callable[[], float]] = None
+
+    def inc(self, amount: float = 1):
+        self._value.add(amount)
+
+    def dec(self, amount: float = 1):
+        self._value.add(-amount)
+
+    def set_function(self, function: Callable[[], float]):
+        """Compute the value when scraped instead of tracking it."""
+        self._function = function
+
+    def get(self) -> float:
+        if self._function is not None:
+            return self._function()
+        return self._value.get()
+
+    def samples(self, name: str, labels: Dict[str, str]) -> Iterable[Sample]:
+        yield name, labels, self.get()
+
+
+class Gauge(Metric):
+    """Value that goes up and down, e.g. vehicles in a queue"""
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def inc(self, amount: float = 1):
+        self._default().inc(amount)
+
+    def dec(self, amount: float = 1):
+        self._default().dec(amount)
+
+    def set_function(self, function: Callable[[], float]):
+        self._default().set_function(function)
+
+
+class _HistogramChild:
+    __slots__ = ("_buckets", "_slots")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self._buckets = buckets
+        # Per thread: one count per bucket plus +Inf, then the sum.
+        self._slots: Dict[int, List[float]] = {}
+
+    def observe(self, value: float):
+        ident = threading.get_ident()
+        slot = self._slots.get(ident)
+        if slot is None:
+            slot = self._slots[ident] = [0.0] * (len(self._buckets) + 2)
+        slot[bisect.bisect_left(self._buckets, value)] += 1
+        slot[-1] += value
+
+    def samples(self, name: str, labels: Dict[str, str]) -> Iterable[Sample]:
+        totals = [0.0] * (len(self._buckets) + 2)
+        for slot in list(self._slots.values()):
+            for index, value in enumerate(slot):
+                totals[index] += value
+        cumulative = 0.0
+        for bound, count in zip(self._buckets + (math.inf,), totals):
+            cumulative += count
+            yield (f"{name}_bucket",
+                   {**labels, "le": _format_value(bound)}, cumulative)
+        yield f"{name}_sum", labels, totals[-1]
+        yield f"{name}_count", labels, cumulative
+
+
+class Histogram(Metric):
+    """Distribution of observed values, e.g. service times"""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str,
+                 labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self._default().observe(value)
+
+
+class MetricsRegistry:
+    """Metrics exposed together on one endpoint."""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: Metric) -> Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str,
+                labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str,
+              labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str,
+                  labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames,
+                                        buckets))
+
+    def render(self) -> str:
+        """Return every metric in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} "
+                             f"{_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(
+        f'{name}="{_escape(value)}"' for name, value in labels.items())
+    return f"{{{pairs}}}"
+
+
+def _escape(value: str) -> str:
+    return (value.replace("\\", "\\\\").replace("\n", "\\n")
+            .replace('"', '\\"'))
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if value == -math.inf:
+        return "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+REGISTRY = MetricsRegistry()
+
+BOOTH_QUEUE_DEPTH = REGISTRY.gauge(
+    "toll_booth_queue_depth", "Vehicles waiting in a booth queue.",
+    ["booth_id"])
+BOOTH_VEHICLES_ENQUEUED = REGISTRY.counter(
+    "toll_booth_vehicles_enqueued", "Vehicles accepted in a booth queue.",
+    ["booth_id"])
+BOOTH_VEHICLES_REJECTED = REGISTRY.counter(
+    "toll_booth_vehicles_rejected", "Vehicles refused by a booth queue.",
+    ["booth_id", "reason"])
+BOOTH_VEHICLES_PROCESSED = REGISTRY.counter(
+    "toll_booth_vehicles_processed", "Vehicles that left a booth.",
+    ["booth_id"])
+BOOTH_VEHICLES_STOLEN = REGISTRY.counter(
+    "toll_booth_vehicles_stolen",
+    "Vehicles an idle booth took from a sibling booth's queue.",
+    ["booth_id"])
+BOOTH_STEP_SECONDS = REGISTRY.histogram(
+    "toll_booth_step_seconds",
+    "Service time of each processing step (enter, pay, exit).",
+    ["event_type"])
+PLAZA_QUEUED_VEHICLES = REGISTRY.gauge(
+    "toll_plaza_queued_vehicles", "Vehicles waiting in a plaza's booths.",
+    ["plaza_id"])
+PLAZA_OPEN_BOOTHS = REGISTRY.gauge(
+    "toll_plaza_open_booths", "Booths of a plaza accepting vehicles.",
+    ["plaza_id"])
+PLAZA_ADMISSIONS = REGISTRY.counter(
+    "toll_plaza_admissions",
+    "Vehicles sent to a plaza, by admission outcome.",
+    ["plaza_id", "outcome"])
+PLAZA_REROUTED_VEHICLES = REGISTRY.counter(
+    "toll_plaza_rerouted_vehicles",
+    "Vehicles a plaza refused and the controller sent to another plaza.",
+    ["plaza_id"])
+PLAZA_SPILLED_VEHICLES = REGISTRY.gauge(
+    "toll_plaza_spilled_vehicles",
+    "Vehicles waiting in a plaza's spill queue for a booth.",
+    ["plaza_id"])
+PUBLISH_SECONDS = REGISTRY.histogram(
+    "toll_publish_seconds", "Time to hand a message to a messaging system.",
+    ["system"])
+PUBLISH_FAILURES = REGISTRY.counter(
+    "toll_publish_failures", "Messages a messaging system failed to publish.",
+    ["system"])
+
+
+
+def _track(gauge: Gauge, method: Callable[[], float], **labels: str):
+    """
+    Report the value of a bound method when metrics are scraped. Only a weak
+    reference to the method is kept, the child is removed once its object
+    is garbage collected.
+    """
+    child = gauge.labels(**labels)
+    reference = weakref.WeakMethod(
+        method, lambda _: gauge.remove(child, **labels))
+
+    def read() -> float:
+        function = reference()
+        return function() if function is not None else 0
+
+    child.set_function(read)
+
+
+def track_booth(booth):
+    """Report the queue depth of a booth, read when metrics are scraped."""
+    _track(BOOTH_QUEUE_DEPTH, booth.vehicle_queue.qsize,
+           booth_id=booth.booth_id)
+
+
+def track_plaza(plaza):
+    """Report the queued vehicles, open booths and spilled vehicles of a
+    plaza, read when metrics are scraped."""
+    _track(PLAZA_QUEUED_VEHICLES, plaza.queued_vehicles,
+           plaza_id=plaza.plaza_id)
+    _track(PLAZA_OPEN_BOOTHS, plaza.booth_index.active_count,
+           plaza_id=plaza.plaza_id)
+    _track(PLAZA_SPILLED_VEHICLES, plaza.spilled_vehicles,
+           plaza_id=plaza.plaza_id)
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("Metrics request: " + format, *args)
+
+
+def start_metrics_server(port: int = METRICS_PORT,
+                         address: str = METRICS_ADDRESS,
+                         registry: MetricsRegistry = REGISTRY
+                         ) -> http.server.ThreadingHTTPServer:
+    """
+    Serve the metrics on http://<address>:<port>/metrics from a daemon thread.
+
+    Args:
+        port (int): Port to listen on, 0 picks a free one.
+        address (str): Address to bind, local only by default.
+        registry (MetricsRegistry): Metrics to serve.
+
+    Returns:
+        ThreadingHTTPServer: The running server, ``shutdown`` stops it.
+    """
+    handler = type("MetricsHandler", (_MetricsHandler,), {"registry": registry})
+    server = http.server.ThreadingHTTPServer((address, port), handler)
+    thread = threading.Thread(target=server.serve_forever,
+                              name="Metrics-server", daemon=True)
+    thread.start()
+    logger.info("Serving metrics on http://%s:%d/metrics",
+                address, server.server_address[1])
+    return server
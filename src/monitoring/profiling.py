@@ -0,0 +1,266 @@
+"""
+Opt-in timing spans around the simulator hot paths.
+
+Set PROFILING=1 or call ``enable()`` to time every function decorated with
+``profiled`` (and every ``span`` block). Each thread aggregates its own span
+statistics without locks, and time spent in nested spans is attributed to
+their full stack so it can be rendered as a flame graph. With
+PROFILING_CPROFILE=1 each outermost span also runs under cProfile.
+
+When profiling is off a decorated function costs one flag check.
+"""
+import atexit
+import contextlib
+import cProfile
+import functools
+import json
+import logging
+import os
+import pstats
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+PROFILING = os.getenv("PROFILING", "0") == "1"
+PROFILING_CPROFILE = os.getenv("PROFILING_CPROFILE", "0") == "1"
+# Directory the reports are written to at exit, nothing is written if empty.
+PROFILING_OUTPUT = os.getenv("PROFILING_OUTPUT", "")
+
+Function = TypeVar("Function", bound=Callable)
+
+_enabled = False
+_use_cprofile = False
+_local = threading.local()
+_threads_lock = threading.Lock()
+_threads: List["_ThreadProfile"] = []
+_atexit_registered = False
+
+
+class SpanStats:
+    """Timing of one span name, in seconds"""
+    __slots__ = ("count", "total", "min", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+
+    def add(self, elapsed: float):
+        self.count += 1
+        self.total += elapsed
+        if elapsed < self.min:
+            self.min = elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+
+    def merge(self, other: "SpanStats"):
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def to_dict(self) -> Dict[str, float]:
+        return {"count": self.count,
+                "total_seconds": self.total,
+                "mean_seconds": self.total / self.count if self.count else 0.0,
+                "min_seconds": self.min if self.count else 0.0,
+                "max_seconds": self.max}
+
+
+class _ThreadProfile:
+    """Spans of one thread, only written by that thread and cleared by
+    ``reset()``."""
+
+    def __init__(self):
+        self.thread = threading.current_thread()
+        self.thread_name = self.thread.name
+        self.spans: Dict[str, SpanStats] = {}
+        # Exclusive time per stack of span names, e.g. "a;b".
+        self.folded: Dict[str, float] = {}
+        # Open spans: [name, stack, start, time spent in child spans].
+        self.stack: List[list] = []
+        self.profiler: Optional[cProfile.Profile] = None
+
+    def clear(self):
+        """Forget the recorded spans, keeping the spans still open."""
+        self.spans = {}
+        self.folded = {}
+        if self.profiler is not None:
+            self.profiler.clear()
+
+
+def _thread_profile() -> _ThreadProfile:
+    profile = getattr(_local, "profile", None)
+    if profile is None:
+        profile = _local.profile = _ThreadProfile()
+        with _threads_lock:
+            _threads.append(profile)
+    return profile
+
+
+def enable(cprofile: bool = PROFILING_CPROFILE,
+           output: Optional[str] = PROFILING_OUTPUT or None):
+    """
+    Start recording spans.
+
+    Args:
+        cprofile (bool): Also run the outermost spans under cProfile.
+        output (str): Directory to write the reports to at exit.
+    """
+    global _enabled, _use_cprofile, _atexit_registered
+    _use_cprofile = cprofile
+    _enabled = True
+    if output and not _atexit_registered:
+        atexit.register(dump, output)
+        _atexit_registered = True
+
+
+def disable():
+    """Stop recording spans, keeping what was recorded."""
+    global _enabled
+    _enabled = False
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def reset():
+    """Forget every recorded span, in every thread."""
+    with _threads_lock:
+        _threads[:] = [profile for profile in _threads
+                       if profile.thread.is_alive()]
+        for profile in _threads:
+            profile.clear()
+
+
+@contextlib.contextmanager
+def span(name: str):
+    """Time the enclosed block as ``name`` if profiling is enabled."""
+    if not _enabled:
+        yield
+        return
+    profile = _thread_profile()
+    _open(profile, name)
+    try:
+        yield
+    finally:
+        _close(profile)
+
+
+def profiled(name: str) -> Callable[[Function], Function]:
+    """Decorator timing every call of a function as span ``name``."""
+    def decorator(function: Function) -> Function:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            profile = _thread_profile()
+            _open(profile, name)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                _close(profile)
+        return wrapper
+    return decorator
+
+
+def _open(profile: _ThreadProfile, name: str):
+    parent = profile.stack[-1] if profile.stack else None
+    stack = f"{parent[1]};{name}" if parent else name
+    if parent is None and _use_cprofile:
+        if profile.profiler is None:
+            profile.profiler = cProfile.Profile()
+        profile.profiler.enable()
+    profile.stack.append([name, stack, time.perf_counter(), 0.0])
+
+
+def _close(profile: _ThreadProfile):
+    end = time.perf_counter()
+    name, stack, start, children = profile.stack.pop()
+    elapsed = end - start
+    stats = profile.spans.get(name)
+    if stats is None:
+        stats = profile.spans[name] = SpanStats()
+    stats.add(elapsed)
+    profile.folded[stack] = profile.folded.get(stack, 0.0) + elapsed - children
+    if profile.stack:
+        profile.stack[-1][3] += elapsed
+    elif profile.profiler is not None:
+        profile.profiler.disable()
+
+
+def report() -> Dict[str, Dict]:
+    """
+    Return the span statistics of every thread and merged over threads.
+
+    Returns:
+        Dict: {"total": {span: stats}, "threads": {thread: {span: stats}}}
+    """
+    with _threads_lock:
+        threads = list(_threads)
+    total: Dict[str, SpanStats] = {}
+    per_thread = {}
+    for profile in threads:
+        spans = dict(profile.spans)
+        per_thread[profile.thread_name] = {
+            name: stats.to_dict() for name, stats in spans.items()}
+        for name, stats in spans.items():
+            total.setdefault(name, SpanStats()).merge(stats)
+    return {"total": {name: stats.to_dict() for name, stats in total.items()},
+            "threads": per_thread}
+
+
+def folded_stacks() -> List[str]:
+    """
+    Return the spans as folded stacks, "outer;inner <microseconds>" per line,
+    the input format of flamegraph.pl and speedscope.
+    """
+    with _threads_lock:
+        threads = list(_threads)
+    merged: Dict[str, float] = {}
+    for profile in threads:
+        for stack, seconds in list(profile.folded.items()):
+            merged[stack] = merged.get(stack, 0.0) + seconds
+    return [f"{stack} {round(seconds * 1_000_000)}"
+            for stack, seconds in sorted(merged.items())]
+
+
+def dump(directory: str):
+    """
+    Write spans.json, spans.folded and, with cProfile, profile.pstats.
+
+    Args:
+        directory (str): Created if missing.
+    """
+    path = Path(directory)
+    path.mkdir(parents=True, exist_ok=True)
+    span_report = report()
+    (path / "spans.json").write_text(json.dumps(span_report, indent=2))
+    (path / "spans.folded").write_text("\n".join(folded_stacks()) + "\n")
+
+    with _threads_lock:
+        # Profilers cleared by reset() may have nothing recorded since.
+        profilers = [profile.profiler for profile in _threads
+                     if profile.profiler is not None
+                     and profile.profiler.getstats()]
+    if profilers:
+        stats = pstats.Stats(profilers[0])
+        for profiler in profilers[1:]:
+            stats.add(profiler)
+        stats.dump_stats(str(path / "profile.pstats"))
+
+    for name, stats in sorted(span_report["total"].items(),
+                              key=lambda item: -item[1]["total_seconds"]):
+        logger.info("Span %s: %d calls, %.3fs total, %.1fus mean", name,
+                    stats["count"], stats["total_seconds"],
+                    stats["mean_seconds"] * 1_000_000)
+    logger.info("Profiling reports written to %s", path)
+
+
+if PROFILING:
+    enable()
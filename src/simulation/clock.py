@@ -0,0 +1,80 @@
+"""Clocks used to timestamp and pace the simulation"""
+import datetime
+import time
+from typing import Optional
+
+
+class Clock:
+    """Source of time for booths and traffic generators."""
+
+    def now(self) -> float:
+        """Return the current time in seconds since the epoch."""
+        raise NotImplementedError
+
+    def sleep(self, seconds: float) -> None:
+        """Let the given number of seconds elapse."""
+        raise NotImplementedError
+
+    def isoformat(self) -> str:
+        """Return the current time as an ISO 8601 string."""
+        return datetime.datetime.fromtimestamp(self.now()).isoformat()
+
+    def timestamp_ns(self) -> int:
+        """Return the current time in integer nanoseconds since the epoch."""
+        return int(self.now() * 1_000_000_000)
+
+
+class WallClock(Clock):
+    """Real time: sleeping blocks the calling thread."""
+
+    def __init__(self):
+        # Offset turning the monotonic clock into epoch time, so integer
+        # timestamps are cheap to take and never go backwards.
+        self._epoch_offset_ns = time.time_ns() - time.monotonic_ns()
+
+    def now(self) -> float:
+        return time.time()
+
+    def sleep(self, seconds: float) -> None:
+        time.sleep(seconds)
+
+    def isoformat(self) -> str:
+        return datetime.datetime.now().isoformat()
+
+    def timestamp_ns(self) -> int:
+        return time.monotonic_ns() + self._epoch_offset_ns
+
+
+class VirtualClock(Clock):
+    """Simulated time, only moved forward by the discrete-event engine."""
+
+    def __init__(self, start: Optional[datetime.datetime] = None):
+        start = start or datetime.datetime.now()
+        self.start_time = start.timestamp()
+        self._now = self.start_time
+
+    def now(self) -> float:
+        return self._now
+
+    def elapsed(self) -> float:
+        """Return the simulated seconds since the clock started."""
+        return self._now - self.start_time
+
+    def advance_to(self, timestamp: float) -> None:
+        """Move the clock forward to the given timestamp."""
+        if timestamp < self._now:
+            raise ValueError(
+                f"Cannot move clock backwards to {timestamp} (now {self._now})")
+        self._now = timestamp
+
+    def sleep(self, seconds: float) -> None:
+        # Nothing to wait for, simulated time simply moves on.
+        self.advance_to(self._now + seconds)
+
+
+def isoformat_ns(timestamp_ns: int) -> str:
+    """Format integer nanoseconds since the epoch as an ISO 8601 string."""
+    return datetime.datetime.fromtimestamp(timestamp_ns / 1_000_000_000).isoformat()
+
+
+WALL_CLOCK = WallClock()
@@ -0,0 +1,131 @@
+"""Discrete-event execution of the toll plaza simulation"""
+import heapq
+import itertools
+import logging
+import math
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+import pydantic
+
+from simulation.clock import VirtualClock
+from toll_plaza_management.toll_plaza import TollPlaza
+from toll_plaza_management.toll_plazas_controller import TollPlazasController
+from traffic_management.booth import Booth, VEHICLE_PROCESSING_SLEEP_TIME
+from traffic_management.traffic_generator import TrafficGenerator
+
+logger = logging.getLogger(__name__)
+
+
+class SimulationReport(pydantic.BaseModel):
+    """Summary of a discrete-event run"""
+    simulated_seconds: float
+    vehicles_generated: int
+    vehicles_processed: int
+    events_processed: int
+
+
+class DiscreteEventEngine:
+    """
+    Runs plazas, booths and traffic on a virtual clock.
+
+    Instead of sleeping, every delay becomes an entry in an event heap and the
+    clock jumps straight to the next entry, so a whole day of traffic runs as
+    fast as the booth, plaza and controller logic allows. No thread is
+    started: booths are driven through ``BoothBusinessLogic.processing_steps``.
+    """
+
+    def __init__(self, plazas_controller: TollPlazasController,
+                 traffic_generator: Optional[TrafficGenerator] = None,
+                 clock: Optional[VirtualClock] = None):
+        """
+        Args:
+            plazas_controller (TollPlazasController): The plazas to simulate.
+            traffic_generator (TrafficGenerator): Source of arrivals, defaults
+                to an unbounded generator on the controller.
+            clock (VirtualClock): Simulated clock, starting now by default.
+        """
+        self.plazas_controller = plazas_controller
+        self.traffic_generator = traffic_generator or TrafficGenerator(
+            plazas_controller)
+        self.clock = clock or VirtualClock()
+        self._events: List[Tuple[float, int, Callable[[], None]]] = []
+        self._sequence = itertools.count()
+        self._serving: Set[Booth] = set()
+        self._plaza_of_booth: Dict[Booth, TollPlaza] = {}
+        self.vehicles_processed = 0
+        self.events_processed = 0
+
+        for plaza in self.plazas_controller.plazas:
+            for booth in plaza.booths:
+                booth.clock = self.clock
+                self._plaza_of_booth[booth] = plaza
+
+    def schedule(self, delay: float, action: Callable[[], None]):
+        """Run ``action`` after ``delay`` simulated seconds."""
+        heapq.heappush(self._events, (self.clock.now() + delay,
+                                      next(self._sequence), action))
+
+    def run(self, duration: float = math.inf) -> SimulationReport:
+        """
+        Simulate until ``duration`` simulated seconds elapsed or until the
+        generator is exhausted and every queued vehicle has been processed.
+        """
+        end_time = self.clock.now() + duration
+        if self.traffic_generator.has_vehicles_left():
+            self.schedule(0, self._on_arrival)
+
+        while self._events and self._events[0][0] <= end_time:
+            timestamp, _, action = heapq.heappop(self._events)
+            self.clock.advance_to(timestamp)
+            action()
+            self.events_processed += 1
+
+        if not self._events and duration != math.inf:
+            self.clock.advance_to(max(self.clock.now(), end_time))
+
+        for plaza in self.plazas_controller.plazas:
+            for booth in plaza.booths:
+                booth.message_sender.drain()
+
+        report = SimulationReport(
+            simulated_seconds=self.clock.elapsed(),
+            vehicles_generated=self.traffic_generator.generated_count,
+            vehicles_processed=self.vehicles_processed,
+            events_processed=self.events_processed)
+        logger.info("Discrete-event run finished: %s", report)
+        return report
+
+    def _on_arrival(self):
+        plaza = self.traffic_generator.generate_next_vehicle()
+        if plaza is not None:
+            self._wake_idle_booths(plaza)
+        if self.traffic_generator.has_vehicles_left():
+            self.schedule(self.traffic_generator.get_inter_arrival_delay(),
+                          self._on_arrival)
+
+    def _wake_idle_booths(self, plaza: TollPlaza):
+        for booth in plaza.booths:
+            if booth not in self._serving and not booth.queue_is_empty():
+                self._serving.add(booth)
+                self._serve_next_vehicle(booth)
+
+    def _serve_next_vehicle(self, booth: Booth):
+        plaza = self._plaza_of_booth.get(booth)
+        spilled = plaza.spilled_vehicles() if plaza is not None else 0
+        if not booth._set_next_vehicle_to_process():
+            self._serving.discard(booth)
+            return
+        if spilled and plaza.spilled_vehicles() < spilled:
+            # Spilled vehicles moved to booths that may be idle
+            self._wake_idle_booths(plaza)
+        self._run_step(booth, booth.processing_steps(booth.message_sender))
+
+    def _run_step(self, booth: Booth, steps: Iterator[float]):
+        try:
+            delay = next(steps)
+        except StopIteration:
+            self.vehicles_processed += 1
+            self.schedule(VEHICLE_PROCESSING_SLEEP_TIME,
+                          lambda: self._serve_next_vehicle(booth))
+            return
+        self.schedule(delay, lambda: self._run_step(booth, steps))
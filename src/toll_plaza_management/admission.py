@@ -0,0 +1,89 @@
+"""
+Admission control of the vehicles sent to a plaza.
+
+A plaza admits at most ADMISSION_RATE_LIMIT vehicles per second, measured
+over a sliding window of ADMISSION_WINDOW seconds. Vehicles its chosen booth
+refuses are retried on ADMISSION_BOOTH_RETRIES other booths, then wait in a
+spill queue of PLAZA_SPILL_SIZE vehicles until a booth has room. The
+controller retries vehicles a plaza refuses on ADMISSION_PLAZA_RETRIES other
+plazas. Every outcome is counted in the toll_plaza_admissions metric.
+"""
+import enum
+import os
+import threading
+import time
+from typing import Callable
+
+import pydantic
+
+# Admitted vehicles per second and plaza, 0 for no limit.
+ADMISSION_RATE_LIMIT = float(os.getenv("ADMISSION_RATE_LIMIT", "0"))
+ADMISSION_WINDOW = float(os.getenv("ADMISSION_WINDOW", "1"))
+ADMISSION_BOOTH_RETRIES = int(os.getenv("ADMISSION_BOOTH_RETRIES", "1"))
+ADMISSION_PLAZA_RETRIES = int(os.getenv("ADMISSION_PLAZA_RETRIES", "1"))
+# Vehicles waiting for a booth of a full plaza, 0 drops them at once.
+PLAZA_SPILL_SIZE = int(os.getenv("PLAZA_SPILL_SIZE", "100"))
+
+
+class AdmissionOutcome(str, enum.Enum):
+    """What happened to a vehicle sent to a plaza"""
+    ADMITTED = "admitted"
+    # Admitted by another booth than the one the strategy picked
+    RETRIED = "retried"
+    SPILLED = "spilled"
+    RATE_LIMITED = "rate_limited"
+    REJECTED = "rejected"
+    # Spilled vehicles left when the plaza stopped
+    DROPPED = "dropped"
+
+
+class AdmissionSettings(pydantic.BaseModel):
+    """Admission control of a plaza"""
+    rate_limit: float = ADMISSION_RATE_LIMIT
+    window: float = ADMISSION_WINDOW
+    booth_retries: int = ADMISSION_BOOTH_RETRIES
+    spill_size: int = PLAZA_SPILL_SIZE
+
+
+class SlidingWindowRateLimiter:
+    """
+    Allows ``rate`` events per second over a sliding window.
+
+    Uses a sliding window counter: the count of the previous fixed window,
+    weighted by how much of it the sliding window still covers, plus the
+    count of the current one. Constant memory, unlike a log of timestamps.
+    Thread-safe.
+    """
+
+    def __init__(self, rate: float, window: float = ADMISSION_WINDOW,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        Args:
+            rate (float): Events allowed per second.
+            window (float): Length of the sliding window, in seconds.
+            clock (Callable[[], float]): Time source, in seconds.
+        """
+        self.limit = rate * window
+        self.window = window
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._window_index = 0
+        self._current = 0
+        self._previous = 0
+
+    def try_acquire(self) -> bool:
+        """Count an event, returns False if the rate is exceeded."""
+        now = self.clock()
+        window_index = int(now // self.window)
+        with self._lock:
+            if window_index != self._window_index:
+                self._previous = (self._current
+                                  if window_index == self._window_index + 1
+                                  else 0)
+                self._current = 0
+                self._window_index = window_index
+            covered = 1 - (now % self.window) / self.window
+            if self._previous * covered + self._current >= self.limit:
+                return False
+            self._current += 1
+            return True
@@ -0,0 +1,90 @@
+import asyncio
+import logging
+from typing import List
+
+from messaging import message_sender
+from toll_plaza_management.toll_plaza_business_logic import (
+    TollPlazaBusinessLogic,
+    TollPlazaState)
+from toll_plaza_management.toll_plazas_controller import (
+    PLAZA_ROUTING_STRATEGY, PlazaRoutingStrategy, TollPlazasController)
+from traffic_management.async_booth import AsyncBooth
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncTollPlaza(TollPlazaBusinessLogic):
+    """Toll plaza whose booths run as tasks on the current event loop."""
+
+    def __init__(self, plaza_id: int, booths: List[AsyncBooth]):
+        """
+        Initialize the toll plaza.
+
+        Args:
+            plaza_id (int): Unique ID for the toll plaza.
+            booths (List[AsyncBooth]): List of AsyncBooth instances.
+        """
+        super().__init__(plaza_id, booths)
+        # No dedicated thread, kept for TollPlazasController.monitor_system.
+        self.thread = None
+        self.state: TollPlazaState = TollPlazaState.CLOSED
+
+    def is_closed(self):
+        return self.state == TollPlazaState.CLOSED
+
+    def start_plaza(self):
+        """Start the booth tasks. Must be called from the event loop."""
+        if self.is_closed():
+            self._start_plaza_logic()
+            self.state = TollPlazaState.OPEN
+            logger.info("Toll Plaza %d is now OPEN.", self.plaza_id)
+        else:
+            logger.info("Toll Plaza %d is already running.", self.plaza_id)
+
+    async def stop_plaza(self):
+        """Stop every booth of the plaza concurrently."""
+        if not self.is_closed():
+            logger.info("Stopping Toll Plaza %d.", self.plaza_id)
+            await asyncio.gather(*(booth.stop_booth() for booth in self.booths))
+            self.state = TollPlazaState.CLOSED
+            logger.info("Toll plaza %d stopped.", self.plaza_id)
+
+
+class AsyncTollPlazasController(TollPlazasController):
+    """TollPlazasController for AsyncTollPlaza instances."""
+
+    def __init__(self, plazas: List[AsyncTollPlaza],
+                 routing_strategy: PlazaRoutingStrategy = PLAZA_ROUTING_STRATEGY):
+        # The autoscaler drives threaded booths only
+        super().__init__(plazas, routing_strategy, autoscale=False)
+
+    def stop_plaza_by_id(self, plaza_id: int):
+        """Plazas stop asynchronously, await astop_plaza_by_id instead."""
+        raise RuntimeError("Await astop_plaza_by_id to stop the plaza of an "
+                           "AsyncTollPlazasController.")
+
+    def stop_controller(self):
+        """Plazas stop asynchronously, await astop_controller instead."""
+        raise RuntimeError("Await astop_controller to stop an "
+                           "AsyncTollPlazasController.")
+
+    async def astop_plaza_by_id(self, plaza_id: int):
+        """Stop the booth tasks of the specified toll plaza."""
+        plaza = self._get_plaza_by_id(plaza_id)
+        if plaza:
+            await plaza.stop_plaza()
+        else:
+            logger.error("Toll Plaza %d does not exist.", plaza_id)
+
+    async def astop_controller(self):
+        """
+        Stop the entire toll system by stopping all plazas, awaiting their
+        booth tasks.
+        """
+        if self.system_running:
+            logger.info("Stopping the central toll system.")
+            await asyncio.gather(*(plaza.stop_plaza() for plaza in self.plazas))
+            message_sender.close_publishers()
+            self.system_running = False
+        else:
+            logger.info("Central toll system is not running.")
@@ -0,0 +1,203 @@
+"""
+Opens and closes the booths of running plazas as their queues fill and drain.
+
+Every interval, the autoscaler compares the queued vehicles of each plaza
+with the capacity of its open booth queues. Above the high watermark, or
+when every open booth is busy with vehicles waiting, a stopped booth is
+started. Below the low watermark, with an open booth idle, the least loaded
+booth closes its queue and is stopped once it has drained, so its thread
+exits. Plazas keep between AUTOSCALE_MIN_BOOTHS and AUTOSCALE_MAX_BOOTHS
+running booths, and wait AUTOSCALE_COOLDOWN seconds between two changes.
+"""
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+import pydantic
+
+from monitoring import metrics
+from toll_plaza_management.toll_plaza import TollPlaza
+from traffic_management.booth import Booth
+
+logger = logging.getLogger(__name__)
+
+AUTOSCALE = os.getenv("AUTOSCALE", "0") == "1"
+AUTOSCALE_INTERVAL = float(os.getenv("AUTOSCALE_INTERVAL", "1"))
+AUTOSCALE_MIN_BOOTHS = int(os.getenv("AUTOSCALE_MIN_BOOTHS", "1"))
+# 0 lets a plaza run all of its booths.
+AUTOSCALE_MAX_BOOTHS = int(os.getenv("AUTOSCALE_MAX_BOOTHS", "0"))
+# Fractions of the open booths' queue capacity.
+AUTOSCALE_HIGH_WATERMARK = float(os.getenv("AUTOSCALE_HIGH_WATERMARK", "0.5"))
+AUTOSCALE_LOW_WATERMARK = float(os.getenv("AUTOSCALE_LOW_WATERMARK", "0.1"))
+AUTOSCALE_COOLDOWN = float(os.getenv("AUTOSCALE_COOLDOWN", "5"))
+
+AUTOSCALER_ACTIONS = metrics.REGISTRY.counter(
+    "toll_autoscaler_actions", "Booths started or stopped by the autoscaler.",
+    ["plaza_id", "action"])
+
+
+class AutoscalerSettings(pydantic.BaseModel):
+    """Bounds and thresholds of a BoothAutoscaler"""
+    interval: float = AUTOSCALE_INTERVAL
+    min_booths: int = AUTOSCALE_MIN_BOOTHS
+    max_booths: int = AUTOSCALE_MAX_BOOTHS
+    high_watermark: float = AUTOSCALE_HIGH_WATERMARK
+    low_watermark: float = AUTOSCALE_LOW_WATERMARK
+    cooldown: float = AUTOSCALE_COOLDOWN
+
+    @pydantic.model_validator(mode="after")
+    def check_watermarks(self):
+        if self.low_watermark >= self.high_watermark:
+            raise ValueError("low_watermark must be below high_watermark")
+        return self
+
+
+class PlazaLoad(pydantic.BaseModel):
+    """Load of a plaza as seen by the autoscaler"""
+    plaza_id: int
+    running_booths: int
+    open_booths: int
+    busy_booths: int
+    queued_vehicles: int
+    # Queued vehicles over the capacity of the open queues
+    queue_fill: float
+
+
+def _queue_capacity(booth: Booth) -> int:
+    # Unbounded queues count as one waiting vehicle per booth
+    return booth.vehicle_queue.maxsize or 1
+
+
+class BoothAutoscaler:
+    """
+    Thread scaling the booths of a controller's plazas with their load.
+
+    Only threaded ``TollPlaza`` booths are scaled; booths are started and
+    stopped with ``start_booth`` and ``stop_booth``, so a plaza never runs
+    more booths than it was built with.
+    """
+
+    def __init__(self, plazas: List[TollPlaza],
+                 settings: Optional[AutoscalerSettings] = None):
+        """
+        Args:
+            plazas (List[TollPlaza]): Plazas to scale, read at every check
+                so plazas added later are scaled too.
+            settings (AutoscalerSettings): Bounds and thresholds, from the
+                AUTOSCALE_* environment variables by default.
+        """
+        self.plazas = plazas
+        self.settings = settings or AutoscalerSettings()
+        self._last_change: Dict[int, float] = {}
+        # Booths whose queue was closed to be stopped once drained
+        self._draining: Dict[Booth, TollPlaza] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """Start checking the plazas in a background thread."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="Autoscaler",
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background thread, draining booths are left to their plaza."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._draining.clear()
+
+    def _run(self):
+        while not self._stop.wait(self.settings.interval):
+            try:
+                self.check()
+            except Exception as e:
+                logger.error("Autoscaler check failed: %s", e)
+
+    def plaza_load(self, plaza: TollPlaza) -> PlazaLoad:
+        """Measure the load of a plaza."""
+        running = [booth for booth in plaza.booths if not booth.is_stopped()]
+        open_booths = [booth for booth in running if booth.queue_is_open()]
+        capacity = sum(_queue_capacity(booth) for booth in open_booths)
+        queued = plaza.queued_vehicles()
+        return PlazaLoad(
+            plaza_id=plaza.plaza_id,
+            running_booths=len(running),
+            open_booths=len(open_booths),
+            busy_booths=sum(booth.is_busy() for booth in open_booths),
+            queued_vehicles=queued,
+            queue_fill=queued / capacity if capacity else float(queued > 0))
+
+    def check(self):
+        """Stop drained booths and scale every open plaza once."""
+        self._stop_drained_booths()
+        now = time.monotonic()
+        for plaza in list(self.plazas):
+            if plaza.is_closed():
+                continue
+            if now - self._last_change.get(plaza.plaza_id, -float("inf")) \
+                    < self.settings.cooldown:
+                continue
+            if self._scale(plaza, self.plaza_load(plaza)):
+                self._last_change[plaza.plaza_id] = now
+
+    def _scale(self, plaza: TollPlaza, load: PlazaLoad) -> bool:
+        settings = self.settings
+        max_booths = settings.max_booths or len(plaza.booths)
+        saturated = (load.busy_booths == load.open_booths
+                     and load.queued_vehicles > 0)
+        if ((load.queue_fill > settings.high_watermark or saturated)
+                and load.open_booths < max_booths):
+            return self._scale_up(plaza, load)
+        if (load.queue_fill < settings.low_watermark
+                and load.busy_booths < load.open_booths
+                and load.open_booths > settings.min_booths):
+            return self._scale_down(plaza, load)
+        return False
+
+    def _scale_up(self, plaza: TollPlaza, load: PlazaLoad) -> bool:
+        # Reopening a draining booth is cheaper than starting a stopped one
+        booth = next((booth for booth in plaza.booths
+                      if not booth.is_stopped() and booth.queue_is_closed()),
+                     None)
+        if booth is not None:
+            self._draining.pop(booth, None)
+            booth.open_queue()
+        else:
+            booth = next((booth for booth in plaza.booths if booth.is_stopped()),
+                         None)
+            if booth is None:
+                return False
+            booth.start_booth()
+        AUTOSCALER_ACTIONS.labels(plaza_id=str(plaza.plaza_id),
+                                  action="start").inc()
+        logger.info("Autoscaler opened booth %s of plaza %d: %s",
+                    booth.booth_id, plaza.plaza_id, load)
+        return True
+
+    def _scale_down(self, plaza: TollPlaza, load: PlazaLoad) -> bool:
+        booth = plaza.booth_index.min_item()
+        if booth is None:
+            return False
+        booth.close_queue()
+        self._draining[booth] = plaza
+        AUTOSCALER_ACTIONS.labels(plaza_id=str(plaza.plaza_id),
+                                  action="stop").inc()
+        logger.info("Autoscaler closed booth %s of plaza %d: %s",
+                    booth.booth_id, plaza.plaza_id, load)
+        return True
+
+    def _stop_drained_booths(self):
+        for booth, plaza in list(self._draining.items()):
+            if booth.queue_is_open() or booth.is_stopped():
+                del self._draining[booth]
+            elif (booth.queue_is_empty() and not booth.is_busy()
+                    and not plaza.is_closed()):
+                del self._draining[booth]
+                booth.stop_booth()
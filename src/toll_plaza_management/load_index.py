@@ -0,0 +1,169 @@
+import random
+import threading
+from typing import Callable, Dict, Generic, Hashable, List, Optional, TypeVar
+
+Item = TypeVar("Item", bound=Hashable)
+
+
+class LoadIndex(Generic[Item]):
+    """
+    Index of items (booths, plazas) bucketed by their current load.
+
+    Loads are updated incrementally as they change, so finding the least or
+    most loaded active item and picking a random active item do not depend on
+    how many items are indexed. Loads are small integers (queue depths), which
+    keeps the scans over empty buckets short. Thread-safe.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loads: Dict[Item, int] = {}
+        self._active: Dict[Item, bool] = {}
+        # Active items per load; dicts are used as insertion-ordered sets.
+        self._buckets: Dict[int, Dict[Item, None]] = {}
+        self._min_load = 0
+        self._max_load = 0
+        # Active items in a list for O(1) random choice with swap removal.
+        self._active_list: List[Item] = []
+        self._active_positions: Dict[Item, int] = {}
+        self.total_load = 0
+
+    def __len__(self) -> int:
+        return len(self._loads)
+
+    def __contains__(self, item: Item) -> bool:
+        return item in self._loads
+
+    def add(self, item: Item, load: int = 0, active: bool = True):
+        """Index a new item with its current load."""
+        with self._lock:
+            if item in self._loads:
+                return
+            self._loads[item] = load
+            self._active[item] = False
+            self.total_load += load
+            if active:
+                self._activate(item)
+
+    def remove(self, item: Item):
+        """Stop indexing an item."""
+        with self._lock:
+            if item not in self._loads:
+                return
+            self._deactivate(item)
+            self.total_load -= self._loads.pop(item)
+            del self._active[item]
+
+    def update(self, item: Item, delta: int):
+        """Add ``delta`` to the load of an item."""
+        with self._lock:
+            load = self._loads[item]
+            self._loads[item] = load + delta
+            self.total_load += delta
+            if self._active[item]:
+                self._unbucket(item, load)
+                self._bucket(item, load + delta)
+
+    def refresh(self, item: Item, load_of: Callable[[Item], int]):
+        """
+        Set the load of an item to ``load_of(item)``, for loads that are not
+        a running count. Computed under the index lock, so the last of
+        concurrent refreshes keeps the latest value.
+        """
+        with self._lock:
+            load = self._loads[item]
+            new_load = load_of(item)
+            self._loads[item] = new_load
+            self.total_load += new_load - load
+            if self._active[item]:
+                self._unbucket(item, load)
+                self._bucket(item, new_load)
+
+    def set_active(self, item: Item, active: bool):
+        """Include or exclude an item from selections, keeping its load."""
+        with self._lock:
+            if active:
+                self._activate(item)
+            else:
+                self._deactivate(item)
+
+    def load(self, item: Item) -> int:
+        """Return the current load of an item."""
+        return self._loads[item]
+
+    def min_item(self) -> Optional[Item]:
+        """Return the least loaded active item, None if there is none."""
+        with self._lock:
+            if not self._active_list:
+                return None
+            while not self._buckets.get(self._min_load):
+                self._min_load += 1
+            return next(iter(self._buckets[self._min_load]))
+
+    def max_item(self) -> Optional[Item]:
+        """Return the most loaded active item, None if there is none."""
+        with self._lock:
+            if not self._active_list:
+                return None
+            while not self._buckets.get(self._max_load):
+                self._max_load -= 1
+            return next(iter(self._buckets[self._max_load]))
+
+    def random_item(self) -> Optional[Item]:
+        """Return a random active item, None if there is none."""
+        active_list = self._active_list
+        if not active_list:
+            return None
+        try:
+            return active_list[random.randrange(len(active_list))]
+        except IndexError:
+            # Shrunk concurrently, fall back to a locked read.
+            with self._lock:
+                return random.choice(self._active_list) if self._active_list else None
+
+    def random_items(self, count: int) -> List[Item]:
+        """Return up to ``count`` distinct random active items."""
+        with self._lock:
+            return random.sample(self._active_list,
+                                 min(count, len(self._active_list)))
+
+    def active_count(self) -> int:
+        """Return the number of active items."""
+        return len(self._active_list)
+
+    def active_items(self) -> List[Item]:
+        """Return a snapshot of the active items."""
+        with self._lock:
+            return list(self._active_list)
+
+    def _activate(self, item: Item):
+        if self._active[item]:
+            return
+        self._active[item] = True
+        self._active_positions[item] = len(self._active_list)
+        self._active_list.append(item)
+        self._bucket(item, self._loads[item])
+
+    def _deactivate(self, item: Item):
+        if not self._active[item]:
+            return
+        self._active[item] = False
+        position = self._active_positions.pop(item)
+        last = self._active_list.pop()
+        if last is not item:
+            self._active_list[position] = last
+            self._active_positions[last] = position
+        self._unbucket(item, self._loads[item])
+
+    def _bucket(self, item: Item, load: int):
+        self._buckets.setdefault(load, {})[item] = None
+        if len(self._active_list) == 1 or load < self._min_load:
+            self._min_load = load
+        if len(self._active_list) == 1 or load > self._max_load:
+            self._max_load = load
+
+    def _unbucket(self, item: Item, load: int):
+        bucket = self._buckets[load]
+        del bucket[item]
+        if not bucket:
+            del self._buckets[load]
@@ -0,0 +1,328 @@
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import random
+import signal
+import threading
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+import pydantic
+
+from messaging import message_sender
+from monitoring import log_config, profiling
+from toll_plaza_management.toll_plaza import TollPlaza
+from toll_plaza_management.toll_plaza_business_logic import NoAvailableBoothsException
+from toll_plaza_management.toll_plazas_controller import TollPlazasController
+from traffic_management.booth import Booth
+from traffic_management.vehicle import Vehicle, VehicleFactory, VehicleType
+
+logger = logging.getLogger(__name__)
+
+# Vehicles sent to a shard in one IPC message, and the longest time a
+# vehicle waits in the coordinator before being sent anyway.
+SHARD_IPC_BATCH_SIZE = int(os.getenv("SHARD_IPC_BATCH_SIZE", "64"))
+SHARD_FLUSH_INTERVAL = float(os.getenv("SHARD_FLUSH_INTERVAL", "0.05"))
+SHARD_STATS_TIMEOUT = float(os.getenv("SHARD_STATS_TIMEOUT", "5"))
+# Longest time to drain the shards when stopping, before they are terminated.
+SHARD_STOP_TIMEOUT = float(os.getenv("SHARD_STOP_TIMEOUT", "60"))
+# Seconds between checks for dead shards while waiting for their replies.
+_SHARD_POLL_INTERVAL = 0.5
+
+# (plaza_id, plate number, vehicle type value) as sent over IPC.
+RoutedVehicle = Tuple[int, str, str]
+
+
+class PlazaSpec(pydantic.BaseModel):
+    """Description of a plaza, built inside the shard that runs it"""
+    plaza_id: int
+    booth_ids: List[str]
+    processing_speed: float = 1
+    messaging_system: message_sender.MessagingSystem = message_sender.MessagingSystem.STDOUT
+
+
+class PlazaStats(pydantic.BaseModel):
+    """Counters of a plaza, as reported by its shard"""
+    plaza_id: int
+    vehicles_received: int = 0
+    vehicles_assigned: int = 0
+    vehicles_rejected: int = 0
+    vehicles_processed: int = 0
+    vehicles_queued: int = 0
+
+
+class ShardedStats(pydantic.BaseModel):
+    """Monitoring stats merged over every shard"""
+    shards_reporting: int = 0
+    vehicles_received: int = 0
+    vehicles_assigned: int = 0
+    vehicles_rejected: int = 0
+    vehicles_processed: int = 0
+    vehicles_queued: int = 0
+    plazas: Dict[int, PlazaStats] = {}
+
+
+def _build_plaza(spec: PlazaSpec) -> TollPlaza:
+    booths = [Booth(booth_id, spec.processing_speed, spec.messaging_system)
+              for booth_id in spec.booth_ids]
+    return TollPlaza(plaza_id=spec.plaza_id, booths=booths)
+
+
+def _collect_plaza_stats(plaza: TollPlaza, stats: PlazaStats) -> PlazaStats:
+    stats.vehicles_processed = sum(booth.processed_count
+                                   for booth in plaza.booths)
+    stats.vehicles_queued = plaza.booth_index.total_load
+    return stats
+
+
+def _run_shard(shard_id: int, specs: List[PlazaSpec],
+               inbox: multiprocessing.Queue, outbox: multiprocessing.Queue):
+    """Entry point of a shard process: run its plazas until told to stop."""
+    log_config.configure_logging()
+    controller = TollPlazasController([_build_plaza(spec) for spec in specs])
+    stats = {spec.plaza_id: PlazaStats(plaza_id=spec.plaza_id)
+             for spec in specs}
+    controller.start_controller()
+    logger.info("Shard %d running plazas %s.", shard_id, list(stats))
+
+    running = True
+    while running:
+        try:
+            command, payload = inbox.get()
+            running = _handle_shard_command(shard_id, controller, stats,
+                                            command, payload, outbox)
+        except KeyboardInterrupt:
+            # Ctrl+C reaches the whole process group: keep running until the
+            # coordinator sends "stop", so booths drain and stats are reported.
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            logger.info("Shard %d interrupted, waiting for the stop command.",
+                        shard_id)
+
+
+def _handle_shard_command(shard_id: int, controller: TollPlazasController,
+                          stats: Dict[int, PlazaStats], command: str, payload,
+                          outbox: multiprocessing.Queue) -> bool:
+    """Run one command of the coordinator, returns False after "stop"."""
+    if command == "vehicles":
+        for plaza_id, plate_number, vehicle_type in payload:
+            plaza = controller._get_plaza_by_id(plaza_id)
+            plaza_stats = stats[plaza_id]
+            plaza_stats.vehicles_received += 1
+            vehicle = VehicleFactory._create_vehicle(
+                plate_number, VehicleType(vehicle_type))
+            try:
+                added = plaza.add_vehicle(
+                    vehicle, plaza.shortest_queue_booth_strategy)
+            except NoAvailableBoothsException:
+                added = False
+            if added:
+                plaza_stats.vehicles_assigned += 1
+            else:
+                plaza_stats.vehicles_rejected += 1
+    elif command in ("stats", "stop"):
+        if command == "stop":
+            controller.stop_controller()
+        # The payload is the request number, echoed with the reply
+        outbox.put((shard_id, payload, [
+            _collect_plaza_stats(plaza, stats[plaza.plaza_id]).model_dump()
+            for plaza in controller.plazas]))
+        return command != "stop"
+    return True
+
+
+class ShardedTollPlazasController:
+    """
+    Runs plazas in a pool of processes so booth work is not serialized by a
+    single interpreter lock.
+
+    Plazas are described by PlazaSpec and built inside their shard. The
+    coordinator picks a plaza for each vehicle and routes it to the owning
+    shard over a multiprocessing queue, batching vehicles per shard. Exposes
+    the same start/assign/monitor/stop interface as TollPlazasController so a
+    TrafficGenerator can drive it.
+    """
+
+    def __init__(self, plaza_specs: List[PlazaSpec],
+                 num_shards: Optional[int] = None,
+                 ipc_batch_size: int = SHARD_IPC_BATCH_SIZE,
+                 flush_interval: float = SHARD_FLUSH_INTERVAL):
+        """
+        Args:
+            plaza_specs (List[PlazaSpec]): Plazas of the system.
+            num_shards (int): Number of processes, one per CPU by default.
+            ipc_batch_size (int): Vehicles sent to a shard per IPC message.
+            flush_interval (float): Seconds between flushes of partial batches.
+        """
+        self.plaza_specs = plaza_specs
+        self.num_shards = max(1, min(num_shards or os.cpu_count() or 1,
+                                     len(plaza_specs)))
+        self.ipc_batch_size = max(1, ipc_batch_size)
+        self.flush_interval = flush_interval
+        self.system_running = False
+
+        self.plaza_ids = [spec.plaza_id for spec in plaza_specs]
+        self._shard_of_plaza = {spec.plaza_id: index % self.num_shards
+                                for index, spec in enumerate(plaza_specs)}
+        self._context = multiprocessing.get_context("spawn")
+        self._processes: List[multiprocessing.Process] = []
+        self._inboxes: List[multiprocessing.Queue] = []
+        self._outbox: Optional[multiprocessing.Queue] = None
+        self._buffers: List[List[RoutedVehicle]] = [
+            [] for _ in range(self.num_shards)]
+        self._buffers_lock = threading.Lock()
+        self._flusher: Optional[threading.Thread] = None
+        self._flusher_stop = threading.Event()
+        # Numbers stats requests, so late replies to an earlier one are
+        # told apart; one request at a time.
+        self._stats_requests = itertools.count(1)
+        self._stats_lock = threading.Lock()
+        self.final_stats: Optional[ShardedStats] = None
+
+    def start_controller(self):
+        """Start one process per shard and the batch flusher."""
+        if self.system_running:
+            logger.info("Sharded toll system is already running.")
+            return
+        logger.info("Starting %d plazas over %d shards.",
+                    len(self.plaza_specs), self.num_shards)
+        self._outbox = self._context.Queue()
+        for shard_id in range(self.num_shards):
+            specs = [spec for spec in self.plaza_specs
+                     if self._shard_of_plaza[spec.plaza_id] == shard_id]
+            inbox = self._context.Queue()
+            process = self._context.Process(
+                target=_run_shard, args=(shard_id, specs, inbox, self._outbox),
+                name=f"Shard-{shard_id}", daemon=True)
+            process.start()
+            self._inboxes.append(inbox)
+            self._processes.append(process)
+        self._flusher_stop.clear()
+        self._flusher = threading.Thread(target=self._flush_periodically,
+                                         name="Shard-flusher", daemon=True)
+        self._flusher.start()
+        self.system_running = True
+
+    def stop_controller(self):
+        """Drain every shard, stop it and keep its final stats."""
+        if not self.system_running:
+            logger.info("Sharded toll system is not running.")
+            return
+        logger.info("Stopping the sharded toll system.")
+        self._flusher_stop.set()
+        if self._flusher:
+            self._flusher.join()
+        self.flush()
+        # Shards drain their booths before answering
+        deadline = time.monotonic() + SHARD_STOP_TIMEOUT
+        self.final_stats = self._request_stats("stop", SHARD_STOP_TIMEOUT)
+        for shard_id, process in enumerate(self._processes):
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.error("Shard %d did not stop in time, terminating it.",
+                             shard_id)
+                process.terminate()
+                process.join()
+        self._processes, self._inboxes = [], []
+        self.system_running = False
+        logger.info("Sharded toll system stopped: %s", self.final_stats)
+
+    def find_random_plaza(self) -> Optional[int]:
+        """Pick a random plaza id, None if there are no plazas."""
+        return random.choice(self.plaza_ids) if self.plaza_ids else None
+
+    @profiling.profiled("controller.assign_vehicle_to_plaza")
+    def assign_vehicle_to_plaza(self, new_vehicle: Vehicle) -> Optional[int]:
+        """
+        Route a vehicle to a random plaza's shard.
+
+        Returns:
+            Optional[int]: The selected plaza id, None if there is none.
+        """
+        plaza_id = self.find_random_plaza()
+        if plaza_id is None:
+            logger.error("No plazas available to assign vehicle %s.",
+                         new_vehicle.plate_number)
+            return None
+        shard_id = self._shard_of_plaza[plaza_id]
+        routed = (plaza_id, new_vehicle.plate_number.plate_number,
+                  new_vehicle.vehicle_type.value)
+        with self._buffers_lock:
+            buffer = self._buffers[shard_id]
+            buffer.append(routed)
+            if len(buffer) < self.ipc_batch_size:
+                return plaza_id
+            self._buffers[shard_id] = []
+        self._inboxes[shard_id].put(("vehicles", buffer))
+        return plaza_id
+
+    def flush(self):
+        """Send every partially filled batch to its shard."""
+        with self._buffers_lock:
+            buffers = self._buffers
+            self._buffers = [[] for _ in range(self.num_shards)]
+        for shard_id, buffer in enumerate(buffers):
+            if buffer:
+                self._inboxes[shard_id].put(("vehicles", buffer))
+
+    def collect_stats(self) -> ShardedStats:
+        """Ask every shard for its counters and merge them."""
+        if not self.system_running:
+            return self.final_stats or ShardedStats()
+        self.flush()
+        return self._request_stats("stats", SHARD_STATS_TIMEOUT)
+
+    def monitor_system(self):
+        """Report dead shard processes and log the merged stats."""
+        for shard_id, process in enumerate(self._processes):
+            if not process.is_alive():
+                logger.error("Shard %d process is not running.", shard_id)
+        logger.info("Sharded system status: %s", self.collect_stats())
+
+    def _request_stats(self, command: str, timeout: float) -> ShardedStats:
+        """Send a command to the live shards and merge their replies, waiting
+        at most ``timeout`` seconds and not for the shards that died."""
+        with self._stats_lock:
+            request = next(self._stats_requests)
+            waiting = {shard_id for shard_id, process
+                       in enumerate(self._processes) if process.is_alive()}
+            for shard_id in waiting:
+                self._inboxes[shard_id].put((command, request))
+            merged = ShardedStats()
+            deadline = time.monotonic() + timeout
+            # Dead shards are given up one poll later, their last reply may
+            # still be in the queue
+            dead: Set[int] = set()
+            while waiting:
+                remaining = deadline - time.monotonic()
+                try:
+                    shard_id, reply_to, plazas = self._outbox.get(
+                        timeout=max(0.0, min(remaining, _SHARD_POLL_INTERVAL)))
+                except queue.Empty:
+                    if remaining <= 0:
+                        logger.warning("Shards %s did not report stats in time.",
+                                       sorted(waiting))
+                        break
+                    waiting -= dead
+                    dead = {shard_id for shard_id in waiting
+                            if not self._processes[shard_id].is_alive()}
+                    continue
+                if reply_to != request or shard_id not in waiting:
+                    # Answer to a request that timed out
+                    continue
+                waiting.discard(shard_id)
+                merged.shards_reporting += 1
+                for plaza in plazas:
+                    plaza_stats = PlazaStats(**plaza)
+                    merged.plazas[plaza_stats.plaza_id] = plaza_stats
+                    merged.vehicles_received += plaza_stats.vehicles_received
+                    merged.vehicles_assigned += plaza_stats.vehicles_assigned
+                    merged.vehicles_rejected += plaza_stats.vehicles_rejected
+                    merged.vehicles_processed += plaza_stats.vehicles_processed
+                    merged.vehicles_queued += plaza_stats.vehicles_queued
+            return merged
+
+    def _flush_periodically(self):
+        while not self._flusher_stop.wait(self.flush_interval):
+            self.flush()
@@ -1,35 +1,70 @@
 
 import logging
+import os
 import threading
 from typing import List, Optional
 
+from toll_plaza_management.admission import AdmissionSettings
 from toll_plaza_management.toll_plaza_business_logic import (
     TollPlazaBusinessLogic,
     TollPlazaState)
+from monitoring import log_config, metrics
 from traffic_management.booth import Booth
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
+_ASSIGNMENT = log_config.category(log_config.LogCategory.ASSIGNMENT)
 
-
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+# Idle booths take waiting vehicles from the longest queue of their plaza.
+WORK_STEALING = os.getenv("WORK_STEALING", "0") == "1"
 
 
 class TollPlaza(TollPlazaBusinessLogic):
     """Class to encapsulate a toll plaza and its associated thread."""
 
-    def __init__(self, plaza_id: int, booths: List[Booth]):
+    def __init__(self, plaza_id: int, booths: List[Booth],
+                 work_stealing: bool = WORK_STEALING,
+                 admission: Optional[AdmissionSettings] = None):
         """
         Initialize the toll plaza and set up threading.
 
         Args:
             plaza_id (int): Unique ID for the toll plaza.
             booths (List[BoothManager]): List of BoothManager instances.
+            work_stealing (bool): Let idle booths take the last waiting
+            vehicle of the longest queue.
+            admission (AdmissionSettings): Rate limit, retries and spill
+            queue size, ADMISSION_* environment variables by default.
         """
-        super().__init__(plaza_id, booths)  # Correctly initialize the parent class
+        super().__init__(plaza_id, booths, admission)  # Correctly initialize the parent class
         self.thread: Optional[threading.Thread] = None
         self.state: TollPlazaState = TollPlazaState.CLOSED
+        self.work_stealing = work_stealing
+        if work_stealing:
+            for booth in booths:
+                booth.work_source = self.steal_vehicle_for
+
+    def steal_vehicle_for(self, thief: Booth) -> bool:
+        """
+        Move the last waiting vehicle of the longest sibling queue to an
+        idle booth.
+
+        Returns:
+            bool: True if a vehicle was moved.
+        """
+        victim = self.booth_index.max_item()
+        if victim is None or victim is thief or self.booth_index.load(victim) == 0:
+            return False
+        stolen_vehicle = victim.steal_vehicle(thief)
+        if stolen_vehicle is None:
+            return False
+        if not thief.take_stolen_vehicle(stolen_vehicle):
+            victim.return_stolen_vehicle(stolen_vehicle)
+            return False
+        metrics.BOOTH_VEHICLES_STOLEN.labels(booth_id=thief.booth_id).inc()
+        logger.info("Booth %s took vehicle %s from booth %s.", thief.booth_id,
+                    stolen_vehicle.plate_number, victim.booth_id,
+                    extra=_ASSIGNMENT)
+        return True
 
     def is_closed(self):
         return self.state == TollPlazaState.CLOSED
@@ -54,3 +89,4 @@ class TollPlaza(TollPlazaBusinessLogic):
             if self.thread:
                 self.thread.join()  # Wait for the thread to finish
                 logger.info("Stopped thread for Toll Plaza %d.", self.plaza_id)
+            self.state = TollPlazaState.CLOSED
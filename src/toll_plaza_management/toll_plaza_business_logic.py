@@ -1,13 +1,21 @@
+import collections
 import logging
-from typing import List, Callable
 import random
+import threading
+from typing import Callable, Deque, Dict, List, Optional
 import enum
 
+from monitoring import log_config, metrics
+from toll_plaza_management.admission import (
+    AdmissionOutcome, AdmissionSettings, SlidingWindowRateLimiter)
+from toll_plaza_management.load_index import LoadIndex
 from traffic_management.booth import Booth
+from traffic_management.booth_business_logic import BoothQueueListener
+from traffic_management.lanes import BoothLane
 from traffic_management.vehicle import Vehicle
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
+_ASSIGNMENT = log_config.category(log_config.LogCategory.ASSIGNMENT)
 
 
 class TollPlazaState(str, enum.Enum):
@@ -24,12 +32,89 @@ class NoAvailableBoothsException(Exception):
         super().__init__(self.message)
 
 
-class TollPlazaBusinessLogic:
+class PlazaLoadListener:
+    """Notified when the load of a plaza changes, e.g. to route between plazas."""
+
+    def on_plaza_load_changed(self, plaza: "TollPlazaBusinessLogic", delta: int):
+        """Called after vehicles were queued at (delta > 0) or left
+        (delta < 0) one of the plaza's booths."""
+
+    def on_plaza_capacity_changed(self, plaza: "TollPlazaBusinessLogic"):
+        """Called after one of the plaza's booths was opened or closed."""
+
+
+class TollPlazaBusinessLogic(BoothQueueListener):
     """Encapsulates the core business logic for managing a toll plaza."""
 
-    def __init__(self, plaza_id: int, booths: List[Booth]):
+    def __init__(self, plaza_id: int, booths: List[Booth],
+                 admission: Optional[AdmissionSettings] = None):
+        """
+        Args:
+            plaza_id (int): Unique ID for the toll plaza.
+            booths (List[Booth]): Booths of the plaza.
+            admission (AdmissionSettings): Rate limit, retries and spill
+                queue size, ADMISSION_* environment variables by default.
+        """
         self.plaza_id = plaza_id
         self.booths: List[Booth] = booths
+        # Open booths by queue depth, kept up to date by the booths
+        # themselves so routing never scans every queue.
+        self.booth_index: LoadIndex[Booth] = LoadIndex()
+        # The same booths split by lane, to route vehicles to lanes they
+        # may use.
+        self.lane_indexes: Dict[BoothLane, LoadIndex[Booth]] = {}
+        for booth in booths:
+            self.booth_index.add(booth, booth.vehicle_queue.qsize(),
+                                 booth.queue_is_open())
+            self.lane_indexes.setdefault(booth.lane, LoadIndex()).add(
+                booth, booth.vehicle_queue.qsize(), booth.queue_is_open())
+            booth.add_queue_listener(self)
+        self.load_listeners: List[PlazaLoadListener] = []
+        self.admission = admission or AdmissionSettings()
+        self.rate_limiter: Optional[SlidingWindowRateLimiter] = (
+            SlidingWindowRateLimiter(self.admission.rate_limit,
+                                     self.admission.window)
+            if self.admission.rate_limit > 0 else None)
+        # Vehicles no booth had room for, admitted as soon as one has
+        self._spill: Deque[Vehicle] = collections.deque()
+        self._spill_lock = threading.Lock()
+        # Set by drains that found the lock taken, its holder drains again
+        self._drain_requested = False
+        self._admission_metrics = {
+            outcome: metrics.PLAZA_ADMISSIONS.labels(
+                plaza_id=str(plaza_id), outcome=outcome.value)
+            for outcome in AdmissionOutcome}
+        metrics.track_plaza(self)
+
+    def add_load_listener(self, listener: PlazaLoadListener):
+        """Register a listener notified of the plaza's load changes."""
+        self.load_listeners.append(listener)
+
+    def queued_vehicles(self) -> int:
+        """Number of vehicles waiting in the plaza's booth queues."""
+        return self.booth_index.total_load
+
+    def has_open_booths(self) -> bool:
+        """Returns True if at least one booth accepts vehicles."""
+        return self.booth_index.active_count() > 0
+
+    def spilled_vehicles(self) -> int:
+        """Number of vehicles waiting in the plaza's spill queue."""
+        return len(self._spill)
+
+    def on_queue_depth_changed(self, booth: Booth, delta: int):
+        self.booth_index.update(booth, delta)
+        self.lane_indexes[booth.lane].update(booth, delta)
+        for listener in self.load_listeners:
+            listener.on_plaza_load_changed(self, delta)
+        if delta < 0 and self._spill:
+            self._drain_spill()
+
+    def on_queue_state_changed(self, booth: Booth):
+        self.booth_index.set_active(booth, booth.queue_is_open())
+        self.lane_indexes[booth.lane].set_active(booth, booth.queue_is_open())
+        for listener in self.load_listeners:
+            listener.on_plaza_capacity_changed(self)
 
     def _start_plaza_logic(self):
         """Start all booths in the toll plaza."""
@@ -44,44 +129,169 @@ class TollPlazaBusinessLogic:
         logger.info("Stopping Toll Plaza %d.", self.plaza_id)
         for booth in self.booths:
             booth.stop_booth()  # Stop processing for each booth
+        self._drop_spill()
         # Fixed the log message
         logger.info("Toll plaza %d stopped.", self.plaza_id)
 
-    def shortest_queue_booth_strategy(self) -> Booth:
-        """Find the booth with the shortest queue."""
-        available_booths = [
-            booth for booth in self.booths if booth.queue_is_open()]
-        if not available_booths:
+    def _lane_indexes_for(self, vehicle: Optional[Vehicle]) -> List[LoadIndex[Booth]]:
+        """Indexes of the lanes ``vehicle`` may use, every booth if None."""
+        if vehicle is None:
+            return [self.booth_index]
+        if len(self.lane_indexes) == 1:
+            # The plaza index holds the same booths as its only lane
+            lane = next(iter(self.lane_indexes))
+            return [self.booth_index] if lane.accepts(vehicle.vehicle_type) else []
+        return [index for lane, index in self.lane_indexes.items()
+                if lane.accepts(vehicle.vehicle_type)]
+
+    def shortest_queue_booth_strategy(self, vehicle: Optional[Vehicle] = None) -> Booth:
+        """
+        Find the booth with the shortest queue among the lanes the vehicle
+        may use. Queues of different lanes are compared by their expected
+        service time, so a fast lane takes longer queues than a standard one.
+        """
+        booth = None
+        best = None
+        for index in self._lane_indexes_for(vehicle):
+            candidate = index.min_item()
+            if candidate is None:
+                continue
+            lane_factor = candidate.service_model.lane_factor(candidate.lane)
+            # Ties go to the faster lane
+            wait = (index.load(candidate) * lane_factor, lane_factor)
+            if best is None or wait < best:
+                booth, best = candidate, wait
+        if booth is None:
             logger.warning("No available booths to process vehicles.")
             raise NoAvailableBoothsException()
-        return min(available_booths, key=lambda booth: booth.vehicle_queue.qsize())
+        return booth
 
-    def random_booth_strategy(self) -> Booth:
-        """Select a random booth from the list."""
-        available_booths = [
-            booth for booth in self.booths if booth.queue_is_open()]
-        if not available_booths:
+    def random_booth_strategy(self, vehicle: Optional[Vehicle] = None) -> Booth:
+        """Select a random booth among the lanes the vehicle may use."""
+        indexes = self._lane_indexes_for(vehicle)
+        if len(indexes) == 1:
+            booth = indexes[0].random_item()
+        else:
+            booth = None
+            counts = [index.active_count() for index in indexes]
+            if sum(counts) > 0:
+                pick = random.randrange(sum(counts))
+                for index, count in zip(indexes, counts):
+                    if pick < count:
+                        booth = index.random_item()
+                        break
+                    pick -= count
+        if booth is None:
             logger.warning("No available booths to process vehicles.")
             raise NoAvailableBoothsException()
-        return random.choice(available_booths)
-
-    def add_vehicle(self, vehicle: Vehicle, strategy: Callable[[], Booth]):
-        """Add a vehicle to the booth using the given strategy."""
-        booth: Booth = strategy()  # Use the passed strategy function
-        if booth.add_vehicle(vehicle):
-            logger.info("Assigned vehicle %s to booth %s.",
-                        vehicle.plate_number, booth.booth_id)
-        else:
-            logger.warning("Failed to assign vehicle %s to booth %d. Booth is full or closed.",
+        return booth
+
+    def add_vehicle(self, vehicle: Vehicle,
+                    strategy: Callable[[Optional[Vehicle]], Booth]) -> bool:
+        """
+        Admit a vehicle in the booth the given strategy picks for it.
+
+        The vehicle is retried on other booths if that one refuses it, and
+        waits in the spill queue if every booth is full.
+
+        Returns:
+            bool: True if a booth accepted the vehicle or it was spilled,
+            False if it was refused.
+        """
+        if self.rate_limiter is not None and not self.rate_limiter.try_acquire():
+            self._admission_metrics[AdmissionOutcome.RATE_LIMITED].inc()
+            logger.info("Plaza %d is over its admission rate, refusing vehicle %s.",
+                        self.plaza_id, vehicle.plate_number, extra=_ASSIGNMENT)
+            return False
+
+        if self._spill:
+            # Wait behind the spilled vehicles, which arrived first
+            return self._admit_spilled(vehicle)
+
+        for attempt in range(1 + max(0, self.admission.booth_retries)):
+            try:
+                # Use the passed strategy function, then any other booth
+                booth: Booth = (strategy(vehicle) if attempt == 0
+                                else self.random_booth_strategy(vehicle))
+            except NoAvailableBoothsException:
+                break
+            if booth.add_vehicle(vehicle):
+                logger.info("Assigned vehicle %s to booth %s.",
+                            vehicle.plate_number, booth.booth_id,
+                            extra=_ASSIGNMENT)
+                self._admission_metrics[AdmissionOutcome.ADMITTED if attempt == 0
+                                        else AdmissionOutcome.RETRIED].inc()
+                return True
+            logger.warning("Failed to assign vehicle %s to booth %s. Booth is full, closed "
+                           "or in another lane.",
                            vehicle.plate_number, booth.booth_id)
 
+        return self._admit_spilled(vehicle)
+
+    def _admit_spilled(self, vehicle: Vehicle) -> bool:
+        """Spill a vehicle, or reject it if the spill queue is full."""
+        if self._spill_vehicle(vehicle):
+            self._admission_metrics[AdmissionOutcome.SPILLED].inc()
+            logger.info("Vehicle %s waits for a booth of plaza %d.",
+                        vehicle.plate_number, self.plaza_id, extra=_ASSIGNMENT)
+            return True
+        self._admission_metrics[AdmissionOutcome.REJECTED].inc()
+        return False
+
+    def _spill_vehicle(self, vehicle: Vehicle) -> bool:
+        if not any(index.active_count()
+                   for index in self._lane_indexes_for(vehicle)):
+            return False  # Nothing would ever drain it
+        with self._spill_lock:
+            if len(self._spill) >= self.admission.spill_size:
+                return False
+            self._spill.append(vehicle)
+        # A booth may have dequeued since it refused the vehicle
+        self._drain_spill()
+        return True
+
+    def _drain_spill(self):
+        """Move spilled vehicles to booths with room, in arrival order."""
+        # A drain finding the lock taken leaves the request to its holder,
+        # which checks it again once it released the lock.
+        self._drain_requested = True
+        while self._drain_requested and self._spill_lock.acquire(blocking=False):
+            try:
+                self._drain_requested = False
+                self._move_spilled_vehicles()
+            finally:
+                self._spill_lock.release()
+
+    def _move_spilled_vehicles(self):
+        while self._spill:
+            vehicle = self._spill[0]
+            try:
+                booth = self.shortest_queue_booth_strategy(vehicle)
+            except NoAvailableBoothsException:
+                return
+            if booth.queue_is_full() or not booth.add_vehicle(vehicle):
+                return
+            self._spill.popleft()
+            logger.info("Assigned spilled vehicle %s to booth %s.",
+                        vehicle.plate_number, booth.booth_id,
+                        extra=_ASSIGNMENT)
+
+    def _drop_spill(self):
+        with self._spill_lock:
+            dropped = len(self._spill)
+            self._spill.clear()
+        if dropped:
+            self._admission_metrics[AdmissionOutcome.DROPPED].inc(dropped)
+            logger.warning("Toll plaza %d dropped %d spilled vehicles.",
+                           self.plaza_id, dropped)
+
     def monitor_booths(self):
         """Monitor the status of each booth."""
         for booth in self.booths:
             if booth.is_busy():
                 logger.info(
-                    "Booth %d in Toll Plaza %d is currently processing a vehicle.",
+                    "Booth %s in Toll Plaza %d is currently processing a vehicle.",
                     booth.booth_id, self.plaza_id)
             else:
-                logger.info("Booth %d in Toll Plaza %d is available.",
+                logger.info("Booth %s in Toll Plaza %d is available.",
                             booth.booth_id, self.plaza_id)
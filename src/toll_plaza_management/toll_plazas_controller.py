@@ -1,31 +1,98 @@
+import enum
 import logging
+import os
 import random
-from typing import List, Optional
+from typing import Dict, List, Optional
 
+from messaging import message_sender
+from monitoring import log_config, metrics, profiling
 from traffic_management.vehicle import Vehicle
+from toll_plaza_management.admission import ADMISSION_PLAZA_RETRIES
+from toll_plaza_management.autoscaler import (
+    AUTOSCALE, AutoscalerSettings, BoothAutoscaler)
+from toll_plaza_management.load_index import LoadIndex
 from toll_plaza_management.toll_plaza import TollPlaza
+from toll_plaza_management.toll_plaza_business_logic import PlazaLoadListener
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
+_ASSIGNMENT = log_config.category(log_config.LogCategory.ASSIGNMENT)
 
 
-class TollPlazasController:
+class PlazaRoutingStrategy(str, enum.Enum):
+    """How the controller picks the plaza of a new vehicle"""
+    RANDOM = "random"
+    LEAST_LOADED = "least_loaded"
+    POWER_OF_TWO = "power_of_two"
+
+
+PLAZA_ROUTING_STRATEGY = PlazaRoutingStrategy(
+    os.getenv("PLAZA_ROUTING_STRATEGY", PlazaRoutingStrategy.RANDOM.value))
+
+# Plaza loads are indexed in 1/_PLAZA_LOAD_SCALE vehicles so they stay
+# integers; 60 divides evenly by the usual booth counts.
+_PLAZA_LOAD_SCALE = 60
+
+
+def _plaza_load(plaza: TollPlaza) -> int:
+    """Queued vehicles per open booth of a plaza, in fixed point."""
+    return (plaza.queued_vehicles() * _PLAZA_LOAD_SCALE
+            // max(1, plaza.booth_index.active_count()))
+
+
+class TollPlazasController(PlazaLoadListener):
     """Central system to manage multiple toll plazas."""
 
-    def __init__(self, plazas: List[TollPlaza]):
+    def __init__(self, plazas: List[TollPlaza],
+                 routing_strategy: PlazaRoutingStrategy = PLAZA_ROUTING_STRATEGY,
+                 autoscale: bool = AUTOSCALE,
+                 autoscaler_settings: Optional[AutoscalerSettings] = None,
+                 plaza_retries: int = ADMISSION_PLAZA_RETRIES):
         """
         Initialize the TollPlazasController.
 
         Args:
             plazas (List[TollPlaza]): List of toll plazas managed by the system.
+            routing_strategy (PlazaRoutingStrategy): How vehicles are spread
+            over plazas.
+            autoscale (bool): Start and stop booths with the plazas' load
+            while the system runs.
+            autoscaler_settings (AutoscalerSettings): Bounds and thresholds
+            of the autoscaler, AUTOSCALE_* environment variables by default.
+            plaza_retries (int): Other plazas a vehicle is offered to when
+            the selected one refuses it.
         """
-        self.plazas: List[TollPlaza] = plazas
+        self.plazas: List[TollPlaza] = []
         self.system_running = False
+        self.routing_strategy = routing_strategy
+        self.plaza_retries = plaza_retries
+        self.autoscaler: Optional[BoothAutoscaler] = (
+            BoothAutoscaler(self.plazas, autoscaler_settings)
+            if autoscale else None)
+        self._plazas_by_id: Dict[int, TollPlaza] = {}
+        # Plazas with open booths by number of queued vehicles, updated by
+        # the plazas as vehicles come and go.
+        self.plaza_index: LoadIndex[TollPlaza] = LoadIndex()
+        for plaza in plazas:
+            self._register_plaza(plaza)
+
+    def _register_plaza(self, toll_plaza: TollPlaza):
+        self.plazas.append(toll_plaza)
+        self._plazas_by_id[toll_plaza.plaza_id] = toll_plaza
+        self.plaza_index.add(toll_plaza, _plaza_load(toll_plaza),
+                             toll_plaza.has_open_booths())
+        toll_plaza.add_load_listener(self)
+
+    def on_plaza_load_changed(self, plaza: TollPlaza, delta: int):
+        self.plaza_index.refresh(plaza, _plaza_load)
+
+    def on_plaza_capacity_changed(self, plaza: TollPlaza):
+        self.plaza_index.refresh(plaza, _plaza_load)
+        self.plaza_index.set_active(plaza, plaza.has_open_booths())
 
     def add_plaza(self, toll_plaza: TollPlaza, start_immediately: bool = False):
         """Add a toll plaza to the system."""
-        if not any(plaza.plaza_id == toll_plaza.plaza_id for plaza in self.plazas):
-            self.plazas.append(toll_plaza)
+        if toll_plaza.plaza_id not in self._plazas_by_id:
+            self._register_plaza(toll_plaza)
             logger.info("Toll Plaza %d added to the system.",
                         toll_plaza.plaza_id)
             if start_immediately:
@@ -51,7 +118,7 @@ class TollPlazasController:
 
     def _get_plaza_by_id(self, plaza_id: int) -> Optional[TollPlaza]:
         """Helper method to retrieve a plaza by its ID."""
-        return next((plaza for plaza in self.plazas if plaza.plaza_id == plaza_id), None)
+        return self._plazas_by_id.get(plaza_id)
 
     def start_controller(self):
         """Start the entire toll system by starting all plazas."""
@@ -60,6 +127,8 @@ class TollPlazasController:
                 "Starting the central toll system with %d plazas.", len(self.plazas))
             for plaza in self.plazas:
                 plaza.start_plaza()
+            if self.autoscaler:
+                self.autoscaler.start()
             self.system_running = True
         else:
             logger.info("Central toll system is already running.")
@@ -68,28 +137,79 @@ class TollPlazasController:
         """Stop the entire toll system by stopping all plazas."""
         if self.system_running:
             logger.info("Stopping the central toll system.")
+            if self.autoscaler:
+                self.autoscaler.stop()
             for plaza in self.plazas:
                 plaza.stop_plaza()
+            message_sender.close_publishers()
             self.system_running = False
         else:
             logger.info("Central toll system is not running.")
 
-    def assign_vehicle_to_plaza(self, new_vehicle: Vehicle):
-        """Assign a vehicle to a plaza based on a random selection."""
-        selected_plaza = self.find_random_plaza()
-        if selected_plaza:
-            logger.info("Assigning vehicle %s to plaza %d.",
-                        new_vehicle.plate_number, selected_plaza.plaza_id)
-            selected_plaza.add_vehicle(
-                new_vehicle, selected_plaza.shortest_queue_booth_strategy)
-        else:
+    @profiling.profiled("controller.assign_vehicle_to_plaza")
+    def assign_vehicle_to_plaza(self, new_vehicle: Vehicle) -> Optional[TollPlaza]:
+        """
+        Assign a vehicle to a plaza selected by the routing strategy, or to
+        the least loaded other plazas if it refuses the vehicle.
+
+        Returns:
+            Optional[TollPlaza]: The plaza that admitted the vehicle, None if
+            there is none.
+        """
+        selected_plaza = self.select_plaza()
+        if not selected_plaza:
             logger.error("No plazas available to assign vehicle %s.",
                          new_vehicle.plate_number)
+            return None
+        logger.info("Assigning vehicle %s to plaza %d.",
+                    new_vehicle.plate_number, selected_plaza.plaza_id,
+                    extra=_ASSIGNMENT)
+        tried: List[TollPlaza] = []
+        while selected_plaza is not None:
+            if selected_plaza.add_vehicle(
+                    new_vehicle, selected_plaza.shortest_queue_booth_strategy):
+                return selected_plaza
+            tried.append(selected_plaza)
+            if len(tried) > self.plaza_retries:
+                break
+            refusing_plaza = selected_plaza
+            selected_plaza = self._find_fallback_plaza(tried)
+            if selected_plaza is not None:
+                metrics.PLAZA_REROUTED_VEHICLES.labels(
+                    plaza_id=str(refusing_plaza.plaza_id)).inc()
+        logger.warning("No plaza admitted vehicle %s.", new_vehicle.plate_number)
+        return None
+
+    def _find_fallback_plaza(self, tried: List[TollPlaza]) -> Optional[TollPlaza]:
+        """Least loaded plaza with open booths that was not tried yet."""
+        candidates = [plaza for plaza in self.plazas
+                      if plaza not in tried and plaza.has_open_booths()]
+        return min(candidates, key=_plaza_load, default=None)
+
+    def select_plaza(self) -> Optional[TollPlaza]:
+        """Pick a plaza with the configured routing strategy."""
+        if self.routing_strategy == PlazaRoutingStrategy.LEAST_LOADED:
+            return self.find_least_loaded_plaza()
+        if self.routing_strategy == PlazaRoutingStrategy.POWER_OF_TWO:
+            return self.find_power_of_two_plaza()
+        return self.find_random_plaza()
 
     def find_random_plaza(self) -> Optional[TollPlaza]:
         """Find a random toll plaza, returns None if no plazas are available."""
         return random.choice(self.plazas) if self.plazas else None
 
+    def find_least_loaded_plaza(self) -> Optional[TollPlaza]:
+        """Find the plaza with the fewest queued vehicles per open booth."""
+        return self.plaza_index.min_item() or self.find_random_plaza()
+
+    def find_power_of_two_plaza(self) -> Optional[TollPlaza]:
+        """Sample two distinct plazas with open booths and keep the less
+        loaded one."""
+        sampled = self.plaza_index.random_items(2)
+        if not sampled:
+            return self.find_random_plaza()
+        return min(sampled, key=self.plaza_index.load)
+
     def monitor_system(self):
         """Monitor the status of all plazas."""
         logger.info("Monitoring all plazas.")
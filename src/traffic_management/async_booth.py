@@ -0,0 +1,165 @@
+import asyncio
+import logging
+from typing import Optional
+
+from traffic_management.booth import VEHICLE_PROCESSING_SLEEP_TIME, BOOTH_STOP_TIMEOUT
+from traffic_management.booth_business_logic import (
+    BoothBusinessLogic, BoothState, AddVehiculeReturnCode)
+from traffic_management.lanes import (
+    AsyncVehiclePriorityQueue, BoothLane, QueueDiscipline)
+from traffic_management.vehicle import Vehicle
+from messaging import message_sender
+from monitoring import log_config
+
+logger = logging.getLogger(__name__)
+_IDLE = log_config.category(log_config.LogCategory.IDLE)
+
+
+class AsyncBooth(BoothBusinessLogic):
+    """
+    Booth running as an asyncio task instead of an OS thread.
+
+    Its lane is an ``asyncio.Queue``, so vehicles must be added from the
+    event loop running the booth. Drop-in replacement for ``Booth`` in an
+    ``AsyncTollPlaza``.
+    """
+
+    def __init__(self, booth_id: str,
+                 processing_speed: int = 1,
+                 message_publisher_type: message_sender.MessagingSystem = message_sender.MessagingSystem.STDOUT,
+                 lane: Optional[BoothLane] = None):
+        super().__init__(booth_id, processing_speed, lane=lane)
+        self.task: Optional[asyncio.Task] = None
+        self.state: BoothState = BoothState.STOPPED
+        self.message_sender = message_sender.AsyncMessageSender(
+            message_publisher_type)
+        # Set on new vehicles, pause/resume and stop.
+        self._wakeup = asyncio.Event()
+        self._stop_requested = False
+        self._abort_requested = False
+
+    def _create_vehicle_queue(self, queue_length: int):
+        if self.queue_discipline == QueueDiscipline.PRIORITY:
+            return AsyncVehiclePriorityQueue(queue_length,
+                                             self.vehicle_priority)
+        return asyncio.Queue(queue_length)
+
+    def is_running(self):
+        """Returns True if the booth is running and False otherwise"""
+        return self.state == BoothState.RUNNING
+
+    def is_paused(self):
+        """Returns True if the booth is paused and False otherwise"""
+        return self.state == BoothState.PAUSED
+
+    def is_stopped(self):
+        """Returns True if the booth is sopped and False otherwise"""
+        return self.state == BoothState.STOPPED
+
+    def start_booth(self):
+        """Start the booth's processing task on the running event loop."""
+        if not self.is_running():
+            self.state = BoothState.RUNNING
+            self._stop_requested = False
+            self._abort_requested = False
+            self.task = asyncio.get_running_loop().create_task(
+                self.process_vehicles(), name=f"Booth-{self.booth_id}")
+            self.open_queue_logic()
+            logger.info("Booth %s started processing.", self.booth_id)
+        else:
+            logger.info("Booth %s is already running.", self.booth_id)
+
+    async def stop_booth(self):
+        """Stop the booth once its queue is drained."""
+        if not self.is_stopped():
+            self.close_queue_logic()
+            self._stop_requested = True
+            self._wakeup.set()
+            if self.task:
+                try:
+                    await asyncio.wait_for(asyncio.shield(self.task),
+                                           BOOTH_STOP_TIMEOUT)
+                except asyncio.TimeoutError:
+                    logger.warning(
+                        "Booth %s did not drain its queue in %s seconds, "
+                        "stopping after the current vehicle.",
+                        self.booth_id, BOOTH_STOP_TIMEOUT)
+                    self._abort_requested = True
+                    self._wakeup.set()
+                    await self.task
+            self.message_sender.flush_envelope()
+            await self.message_sender.flush()
+            self.state = BoothState.STOPPED
+            logger.info("Booth %s has stopped processing.", self.booth_id)
+        else:
+            logger.info("Booth %s is not running.", self.booth_id)
+
+    def pause_booth(self):
+        """Pause the booth's processing."""
+        if self.is_running():
+            self.state = BoothState.PAUSED
+            logger.info("Booth %s is paused.", self.booth_id)
+        else:
+            logger.info(
+                "Booth %s cannot be paused because it is not running.",
+                self.booth_id)
+
+    def resume_booth(self):
+        """Resume the booth's processing after being paused."""
+        if self.is_paused():
+            self.state = BoothState.RUNNING
+            self._wakeup.set()
+            logger.info("Booth %s has resumed processing.", self.booth_id)
+
+    def enqueue_vehicle(self, new_vehicle: Vehicle) -> int:
+        """Add a vehicle to the queue and wake the worker up."""
+        return_code = super().enqueue_vehicle(new_vehicle)
+        if return_code == AddVehiculeReturnCode.QUEUE_VEHICULE_ADDED:
+            self._wakeup.set()
+        return return_code
+
+    def add_vehicle(self, new_vehicle: Vehicle) -> bool:
+        """Add a vehicle to the booth's queue."""
+        if self.enqueue_vehicle(new_vehicle) != AddVehiculeReturnCode.QUEUE_VEHICULE_ADDED:
+            logger.info("Booth %s could not add vehicle %s.",
+                        self.booth_id, new_vehicle.plate_number)
+            return False
+        return True
+
+    async def _wait_for_work(self) -> bool:
+        """
+        Wait until there is a vehicle to process.
+
+        Returns False once the booth is stopping and its queue is drained.
+        """
+        idle_logged = False
+        while True:
+            # Nothing can run between these checks and the wait below, so
+            # clearing first cannot lose a wakeup.
+            self._wakeup.clear()
+            if self._abort_requested:
+                return False
+            if self.is_paused() and not self._stop_requested:
+                await self._wakeup.wait()
+                continue
+            if not self.queue_is_empty():
+                return True
+            if self._stop_requested:
+                return False
+            if not idle_logged:
+                logger.info(
+                    "Booth %s is idle. No vehicles to process.", self.booth_id,
+                    extra=_IDLE)
+                idle_logged = True
+            await self._wakeup.wait()
+
+    async def process_vehicles(self):
+        """Process vehicles as they arrive until the booth is stopped"""
+        while await self._wait_for_work():
+            if self._set_next_vehicle_to_process():
+                for delay in self.processing_steps(self.message_sender):
+                    await asyncio.sleep(delay)
+                await asyncio.sleep(VEHICLE_PROCESSING_SLEEP_TIME)
+        logger.info(
+            "Booth %s queue is closed. Stopping vehicle processing.",
+            self.booth_id)
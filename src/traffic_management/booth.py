@@ -1,35 +1,49 @@
 import threading
 import logging
-from typing import Optional
+import queue
+from typing import Callable, Optional
 import time
 import os
 
 from dotenv import load_dotenv
 
 from traffic_management.booth_business_logic import (
-    BoothBusinessLogic, BoothState, AddVehiculeReturnCode,
-    BoothQueueState)
+    BoothBusinessLogic, BoothState, AddVehiculeReturnCode)
+from traffic_management.lanes import BoothLane
 from traffic_management.vehicle import Vehicle
 from messaging import message_sender
+from monitoring import log_config
 
 load_dotenv()
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
+_IDLE = log_config.category(log_config.LogCategory.IDLE)
 
 VEHICLE_PROCESSING_SLEEP_TIME = float(os.getenv(
     "VEHICLE_PROCESSING_SLEEP_TIME", "0.5"))
+# Seconds stop_booth waits for the queue to drain before dropping the rest.
+BOOTH_STOP_TIMEOUT = float(os.getenv("BOOTH_STOP_TIMEOUT", "10"))
+# Seconds between two attempts of an idle booth to steal a waiting vehicle.
+BOOTH_STEAL_INTERVAL = float(os.getenv("BOOTH_STEAL_INTERVAL", "0.05"))
 
 class Booth(BoothBusinessLogic):
     """Class representing booth"""
 
     def __init__(self, booth_id: str,
                  processing_speed: int = 1,
-                 message_publisher_type: message_sender.MessagingSystem = message_sender.MessagingSystem.STDOUT):
-        super().__init__(booth_id, processing_speed)
+                 message_publisher_type: message_sender.MessagingSystem = message_sender.MessagingSystem.STDOUT,
+                 lane: Optional[BoothLane] = None):
+        super().__init__(booth_id, processing_speed, lane=lane)
         self.thread: Optional[threading.Thread] = None
         self.state: BoothState = BoothState.STOPPED
         self.message_sender = message_sender.MessageSender(message_publisher_type)
+        # Wakes the worker thread on new vehicles, pause/resume and stop.
+        self._wakeup = threading.Condition()
+        self._stop_requested = False
+        self._abort_requested = False
+        # Called by the idle worker to move a waiting vehicle of another
+        # booth to this one, returns True if it did.
+        self.work_source: Optional[Callable[["Booth"], bool]] = None
 
     def is_running(self):
         """Returns True if the booth is running and False otherwise"""
@@ -47,6 +61,8 @@ class Booth(BoothBusinessLogic):
         """Start the booth's processing in a separate thread."""
         if not self.is_running():
             self.state = BoothState.RUNNING
+            self._stop_requested = False
+            self._abort_requested = False
             self.thread = threading.Thread(target=self.process_vehicles)
             self.thread.start()
             self.open_queue()
@@ -56,19 +72,23 @@ class Booth(BoothBusinessLogic):
 
     def stop_booth(self):
         """Stop the booth's processing and terminate the thread."""
-        if self.is_running():
-            self.queue_state = BoothQueueState.CLOSED
-            # wait until all vehicle in the queue are processed
-            start_time = time.time()
-            # Timeout after 10 seconds
-            while not self.queue_is_empty() and (time.time() - start_time < 10):
-                time.sleep(2)
+        if not self.is_stopped():
+            self.close_queue()
+            # The worker exits as soon as the queue is drained
+            self._notify_worker(stop=True)
             if self.thread:
-                self.thread.join()
-                self.state = BoothState.STOPPED
-                self.close_queue()
-                logger.info("Booth %s has stopped processing.",
-                            self.booth_id)
+                self.thread.join(BOOTH_STOP_TIMEOUT)
+                if self.thread.is_alive():
+                    logger.warning(
+                        "Booth %s did not drain its queue in %s seconds, "
+                        "stopping after the current vehicle.",
+                        self.booth_id, BOOTH_STOP_TIMEOUT)
+                    self._notify_worker(abort=True)
+                    self.thread.join()
+            self.message_sender.drain()
+            self.state = BoothState.STOPPED
+            logger.info("Booth %s has stopped processing.",
+                        self.booth_id)
         else:
             logger.info("Booth %s is not running.", self.booth_id)
 
@@ -86,6 +106,7 @@ class Booth(BoothBusinessLogic):
         """Resume the booth's processing after being paused."""
         if self.is_paused():
             self.state = BoothState.RUNNING
+            self._notify_worker()
             logger.info("Booth %s has resumed processing.",
                         self.booth_id)
 
@@ -97,6 +118,13 @@ class Booth(BoothBusinessLogic):
         """Close the booth's queue to stop accepting new vehicles."""
         self.close_queue_logic()
 
+    def enqueue_vehicle(self, new_vehicle: Vehicle) -> int:
+        """Add a vehicle to the queue and wake the worker up."""
+        return_code = super().enqueue_vehicle(new_vehicle)
+        if return_code == AddVehiculeReturnCode.QUEUE_VEHICULE_ADDED:
+            self._notify_worker()
+        return return_code
+
     def add_vehicle(self, new_vehicle: Vehicle) -> bool:
         """Add a vehicle to the booth's queue."""
         if self.enqueue_vehicle(new_vehicle) != AddVehiculeReturnCode.QUEUE_VEHICULE_ADDED:
@@ -105,19 +133,82 @@ class Booth(BoothBusinessLogic):
             return False
         return True
 
-    def process_vehicles(self):
-        """Process vehicle continuoulsy"""
-        while True:
-            if self.is_stopped():
-                logger.info(
-                    "Booth %s queue is closed. Stopping vehicle processing.",
-                    self.booth_id)
-                break
+    def take_stolen_vehicle(self, stolen_vehicle: Vehicle) -> bool:
+        """
+        Queue a vehicle taken from another booth. Skips the checks and
+        metrics of ``enqueue_vehicle``, the vehicle was already admitted.
+
+        Returns:
+            bool: False if the queue is full, the vehicle must then be
+                given back with ``return_stolen_vehicle``.
+        """
+        try:
+            self.vehicle_queue.put_nowait(stolen_vehicle)
+        except queue.Full:
+            return False
+        self._notify_queue_depth(1)
+        return True
 
+    def return_stolen_vehicle(self, stolen_vehicle: Vehicle):
+        """Give back a vehicle ``steal_vehicle`` returned but the thief
+        could not queue."""
+        self.vehicle_queue.put_back(stolen_vehicle)
+        self._notify_queue_depth(1)
+        # Not woken up: the thief holds its own wakeup lock, and the worker
+        # of a booth with a work source polls its queue anyway.
+
+    def steal_vehicle(self, thief: "Booth") -> Optional[Vehicle]:
+        """Give the waiting vehicle ``thief`` may take, None if there is none."""
+        try:
+            stolen_vehicle = self.vehicle_queue.steal_nowait(thief.accepts_vehicle)
+        except queue.Empty:
+            return None
+        self._notify_queue_depth(-1)
+        return stolen_vehicle
+
+    def _notify_worker(self, stop: bool = False, abort: bool = False):
+        with self._wakeup:
+            self._stop_requested = self._stop_requested or stop
+            self._abort_requested = self._abort_requested or abort
+            self._wakeup.notify()
+
+    def _wait_for_work(self) -> bool:
+        """
+        Block until there is a vehicle to process.
+
+        Returns False once the booth is stopping and its queue is drained.
+        """
+        with self._wakeup:
+            idle_logged = False
+            while True:
+                if self._abort_requested:
+                    return False
+                if self.is_paused() and not self._stop_requested:
+                    self._wakeup.wait()
+                    continue
+                if not self.queue_is_empty():
+                    return True
+                if self._stop_requested:
+                    return False
+                # A closed queue drains for scale-down, it takes no more work
+                if (self.work_source is not None and self.queue_is_open()
+                        and self.work_source(self)):
+                    return True
+                if not idle_logged:
+                    logger.info(
+                        "Booth %s is idle. No vehicles to process.", self.booth_id,
+                        extra=_IDLE)
+                    idle_logged = True
+                # Look for vehicles to steal again while idle
+                self._wakeup.wait(None if self.work_source is None
+                                  else BOOTH_STEAL_INTERVAL)
+
+    def process_vehicles(self):
+        """Process vehicles as they arrive until the booth is stopped"""
+        while self._wait_for_work():
             if self._set_next_vehicle_to_process():
                 self.process_current_vehicle(self.message_sender)
                 time.sleep(VEHICLE_PROCESSING_SLEEP_TIME)
-            else:
-                logger.info(
-                    "Booth %s is idle. No vehicles to process.", self.booth_id)
-                time.sleep(1)  # Wait before checking again
+        logger.info(
+            "Booth %s queue is closed. Stopping vehicle processing.",
+            self.booth_id)
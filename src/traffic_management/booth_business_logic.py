@@ -1,40 +1,39 @@
-import time
+import asyncio
 import os
 import enum
 import logging
-import datetime
-from queue import Queue
+import queue
 import random
-from typing import Optional
+from typing import Iterator, List, Optional
 
 from dotenv import load_dotenv
-import pydantic
 
-from traffic_management import vehicle
+from traffic_management import lanes, vehicle
+from traffic_management.booth_event import (
+    BoothEvent, BoothEventType, CompactBoothEvent)
 from messaging import message_sender
+from monitoring import log_config, metrics, profiling
+from simulation.clock import Clock, WALL_CLOCK
 
 load_dotenv()
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
+_PROCESSING = log_config.category(log_config.LogCategory.PROCESSING)
+_PUBLISHING = log_config.category(log_config.LogCategory.PUBLISHING)
 
 BOTH_QUEUE_MAX_SIZE = int(os.getenv("BOTH_QUEUE_MAX_SIZE", "10"))
+BOOTH_EVENT_FAST_PATH = os.getenv("BOOTH_EVENT_FAST_PATH", "0") == "1"
 
 
 class AddVehiculeReturnCode(int, enum.Enum):
     """Error codes for adding vehicle"""
     QUEUE_FULL = 1
     QUEUE_CLOSED = 2
+    # The booth's lane is not open to the vehicle's type
+    LANE_REFUSED = 3
     QUEUE_VEHICULE_ADDED = 0
 
 
-class BoothEventType(str, enum.Enum):
-    """Class representing booth events"""
-    ENTER = 'enter'
-    PAY = "pay"
-    EXIT = "exit"
-
-
 class BoothState(str, enum.Enum):
     """Class representing booth state"""
     STOPPED = 'stopped'
@@ -48,20 +47,27 @@ class BoothQueueState(str, enum.Enum):
     CLOSED = 'closed'
 
 
-class BoothEvent(pydantic.BaseModel):
-    """Processing event at Booth"""
-    booth_id: str
-    vehicle_plate_number: vehicle.PlateNumber
-    vehicle_type: vehicle.VehicleType
-    event_type: BoothEventType
-    timestamp: str
+# Events published for each processed vehicle, in order, with the
+# description used when logging them.
+PROCESSING_STEPS = (
+    (BoothEventType.ENTER, "entrance"),
+    (BoothEventType.PAY, "payment"),
+    (BoothEventType.EXIT, "exit"),
+)
+_STEP_SECONDS = {event_type: metrics.BOOTH_STEP_SECONDS.labels(
+                     event_type=event_type.value)
+                 for event_type, _ in PROCESSING_STEPS}
+
+
+class BoothQueueListener:
+    """Notified when a booth's queue changes, e.g. to keep a routing index."""
 
-    def __str__(self) -> str:
-        return (f"booth_id: {self.booth_id},"
-                f"vehicle_plate_number: {self.vehicle_plate_number},"
-                f"vehicle_type: {self.vehicle_type},"
-                f"event_type: {self.event_type},"
-                f"timestamp: {self.timestamp})")
+    def on_queue_depth_changed(self, booth: "BoothBusinessLogic", delta: int):
+        """Called after vehicles were added to (delta > 0) or removed from
+        (delta < 0) the booth's queue."""
+
+    def on_queue_state_changed(self, booth: "BoothBusinessLogic"):
+        """Called after the booth's queue was opened or closed."""
 
 
 class BoothBusinessLogic:
@@ -72,6 +78,11 @@ class BoothBusinessLogic:
                  processing_speed: float = 1,
                  queue_length: int = BOTH_QUEUE_MAX_SIZE,
                  queue_state: BoothQueueState = BoothQueueState.OPEN,
+                 clock: Clock = WALL_CLOCK,
+                 compact_events: bool = BOOTH_EVENT_FAST_PATH,
+                 lane: Optional[lanes.BoothLane] = None,
+                 queue_discipline: lanes.QueueDiscipline = lanes.BOOTH_QUEUE_DISCIPLINE,
+                 service_model: lanes.ServiceTimeModel = lanes.DEFAULT_SERVICE_MODEL,
                  ):
         """
         Initialize a Booth instance.
@@ -80,12 +91,59 @@ class BoothBusinessLogic:
             booth_id (int): The unique identifier for the booth.
             processing_speed (float): The speed at which the booth processes
             vehicles.
+            clock (Clock): Time source used for event timestamps and
+            processing delays.
+            compact_events (bool): Build CompactBoothEvent instead of
+            BoothEvent while processing vehicles.
+            lane (BoothLane): Vehicles the booth accepts, FAST_LANE_BOOTHS
+            decides by default.
+            queue_discipline (QueueDiscipline): Order waiting vehicles are
+            served in.
+            service_model (ServiceTimeModel): Processing delay multipliers
+            per vehicle type and lane.
         """
         self.booth_id = booth_id
         self.current_vehicle: Optional[vehicle.Vehicle] = None
-        self.vehicle_queue = Queue(queue_length)
+        self.lane = lane or lanes.default_lane(booth_id)
+        self.queue_discipline = queue_discipline
+        self.service_model = service_model
+        self.vehicle_queue = self._create_vehicle_queue(queue_length)
         self.processing_speed = processing_speed
         self.queue_state = queue_state
+        self.clock = clock
+        self.compact_events = compact_events
+        self.processed_count = 0
+        self.queue_listeners: List[BoothQueueListener] = []
+        self._enqueued_metric = metrics.BOOTH_VEHICLES_ENQUEUED.labels(
+            booth_id=booth_id)
+        self._rejected_metrics = {
+            reason: metrics.BOOTH_VEHICLES_REJECTED.labels(
+                booth_id=booth_id, reason=reason.name.lower())
+            for reason in (AddVehiculeReturnCode.QUEUE_FULL,
+                           AddVehiculeReturnCode.QUEUE_CLOSED,
+                           AddVehiculeReturnCode.LANE_REFUSED)}
+        self._processed_metric = metrics.BOOTH_VEHICLES_PROCESSED.labels(
+            booth_id=booth_id)
+        metrics.track_booth(self)
+
+    def _create_vehicle_queue(self, queue_length: int):
+        """Create the queue of vehicles waiting at this booth."""
+        if self.queue_discipline == lanes.QueueDiscipline.PRIORITY:
+            return lanes.VehiclePriorityQueue(queue_length,
+                                              self.vehicle_priority)
+        return lanes.StealableQueue(queue_length)
+
+    def vehicle_priority(self, queued_vehicle: vehicle.Vehicle) -> float:
+        """Priority of a waiting vehicle, the shortest to serve go first."""
+        return self.service_model.type_factor(queued_vehicle.vehicle_type)
+
+    def accepts(self, vehicle_type: vehicle.VehicleType) -> bool:
+        """Returns True if the booth's lane is open to ``vehicle_type``."""
+        return self.lane.accepts(vehicle_type)
+
+    def accepts_vehicle(self, queued_vehicle: vehicle.Vehicle) -> bool:
+        """Returns True if the booth's lane is open to ``queued_vehicle``."""
+        return self.lane.accepts(queued_vehicle.vehicle_type)
 
     def is_busy(self) -> bool:
         """ Return True if the booth is busy and False if not """
@@ -107,6 +165,16 @@ class BoothBusinessLogic:
 
     def set_queue_state(self, new_state):
         self.queue_state = new_state
+        for listener in self.queue_listeners:
+            listener.on_queue_state_changed(self)
+
+    def add_queue_listener(self, listener: BoothQueueListener):
+        """Register a listener notified of queue depth and state changes."""
+        self.queue_listeners.append(listener)
+
+    def _notify_queue_depth(self, delta: int):
+        for listener in self.queue_listeners:
+            listener.on_queue_depth_changed(self, delta)
 
     def open_queue_logic(self) -> None:
         """Open the booth and start accepting vehicles."""
@@ -120,27 +188,46 @@ class BoothBusinessLogic:
         logger.info("Booth %s queue is now closed to new vehicles.",
                     self.booth_id)
 
+    @profiling.profiled("booth.enqueue_vehicle")
     def enqueue_vehicle(self, new_vehicle: vehicle.Vehicle) -> int:
         """
-        Adds a vehicle to the processing queue of the booth if it's not full 
-        and the booth is open.
+        Adds a vehicle to the processing queue of the booth if it's not full,
+        the booth is open and its lane accepts the vehicle.
 
         Args:
             new_vehicle (Vehicle): the vehicle to add
         Returns:
             bool: True if the vehicle is added, False otherwise
         """
+        if not self.accepts_vehicle(new_vehicle):
+            logger.info("Booth %s: %s lane refuses %s %s.", self.booth_id,
+                        self.lane.value, new_vehicle.vehicle_type.value,
+                        new_vehicle.plate_number)
+            self._rejected_metrics[AddVehiculeReturnCode.LANE_REFUSED].inc()
+            return AddVehiculeReturnCode.LANE_REFUSED
+
         if self.queue_state == BoothQueueState.CLOSED:
             logger.info("Booth %s queue is closed. Cannot add vehicle %s.",
                         self.booth_id, new_vehicle.plate_number)
+            self._rejected_metrics[AddVehiculeReturnCode.QUEUE_CLOSED].inc()
             return AddVehiculeReturnCode.QUEUE_CLOSED
 
         if self.queue_is_full():
             logger.info("Booth %s: Queue is full. Cannot add vehicle %s.",
                         self.booth_id, new_vehicle.plate_number)
+            self._rejected_metrics[AddVehiculeReturnCode.QUEUE_FULL].inc()
             return AddVehiculeReturnCode.QUEUE_FULL
 
-        self.vehicle_queue.put(new_vehicle)
+        try:
+            self.vehicle_queue.put_nowait(new_vehicle)
+        except (queue.Full, asyncio.QueueFull):
+            # Another producer filled the queue since the check above
+            logger.info("Booth %s: Queue is full. Cannot add vehicle %s.",
+                        self.booth_id, new_vehicle.plate_number)
+            self._rejected_metrics[AddVehiculeReturnCode.QUEUE_FULL].inc()
+            return AddVehiculeReturnCode.QUEUE_FULL
+        self._enqueued_metric.inc()
+        self._notify_queue_depth(1)
         return AddVehiculeReturnCode.QUEUE_VEHICULE_ADDED
 
     def get_booth_event(self, concerned_vehicle: vehicle.Vehicle,
@@ -150,56 +237,89 @@ class BoothBusinessLogic:
                           vehicle_plate_number=concerned_vehicle.plate_number,
                           vehicle_type=concerned_vehicle.vehicle_type,
                           event_type=booth_event,
-                          timestamp=datetime.datetime.now().isoformat()
+                          timestamp=self.clock.isoformat()
                           )
 
+    def get_compact_booth_event(self, concerned_vehicle: vehicle.Vehicle,
+                                booth_event: BoothEventType) -> CompactBoothEvent:
+        """ Build and return a compact event, skipping validation """
+        return CompactBoothEvent(self.booth_id,
+                                 concerned_vehicle.plate_number.plate_number,
+                                 concerned_vehicle.vehicle_type,
+                                 booth_event,
+                                 self.clock.timestamp_ns())
+
     def _set_next_vehicle_to_process(self) -> bool:
         """
         Get the next vehicleto process from the queue and set it as the 
         curent vehicle to process
         """
-        if not self.is_busy() and not self.queue_is_empty():
-            self.current_vehicle = self.vehicle_queue.get()
-            if self.current_vehicle:
-                logger.info("Booth %s is now processing the vehicle %s.",
-                            self.booth_id,
-                            self.current_vehicle.plate_number.plate_number)
-            return True
-        return False
-
-    def get_processing_delay(self):
+        if self.is_busy():
+            return False
+        try:
+            # A sibling booth may steal the last vehicle, no separate check
+            self.current_vehicle = self.vehicle_queue.get_nowait()
+        except queue.Empty:
+            return False
+        self._notify_queue_depth(-1)
+        if self.current_vehicle:
+            logger.info("Booth %s is now processing the vehicle %s.",
+                        self.booth_id,
+                        self.current_vehicle.plate_number.plate_number,
+                        extra=_PROCESSING)
+        return True
+
+    def get_processing_delay(self,
+                             concerned_vehicle: Optional[vehicle.Vehicle] = None):
         """Define the range for random delays (in seconds)"""
         min_delay = self.processing_speed / 3  # Minimum delay
         max_delay = self.processing_speed * 3  # Maximum delay
+        if concerned_vehicle is not None:
+            factor = self.service_model.service_factor(
+                concerned_vehicle.vehicle_type, self.lane)
+            min_delay *= factor
+            max_delay *= factor
 
         return random.uniform(min_delay, max_delay)
 
 
+    def processing_steps(self, messaging_system: message_sender.MessageSender
+                         ) -> Iterator[float]:
+        """
+        Process the current vehicle step by step.
+
+        Yields the delay each ENTER/PAY/EXIT step takes; the event of a step
+        is published when the caller resumes the iteration after that delay.
+        Lets both real-time threads and the discrete-event engine drive the
+        same processing logic.
+        """
+        if self.current_vehicle is None:
+            return
+
+        build_event = (self.get_compact_booth_event if self.compact_events
+                       else self.get_booth_event)
+        for event_type, description in PROCESSING_STEPS:
+            event = build_event(self.current_vehicle, event_type)
+            delay = self.get_processing_delay(self.current_vehicle)
+            yield delay
+            _STEP_SECONDS[event_type].observe(delay)
+            # Serialized once, for sending and logging
+            message = messaging_system.send_event(event)
+            logger.info("Publishing %s event: %s", description, message,
+                        extra=_PUBLISHING)
+
+        self.current_vehicle = None  # Reset current vehicle after processing
+        self.processed_count += 1
+        self._processed_metric.inc()
+
+    @profiling.profiled("booth.process_current_vehicle")
     def process_current_vehicle(self, messaging_system: message_sender.MessageSender) -> bool:
         """Simulate processing the curent vehicle."""
         if self.current_vehicle is None:
             logger.info("No vehicle to process")
             return False
 
-        # Process entrance event
-        event = self.get_booth_event(
-            self.current_vehicle, BoothEventType.ENTER)
-        time.sleep(self.get_processing_delay())
-        messaging_system.send_message(f"{event}")
-        logger.info("Publishing entrance event: %s", event)
-
-        # Process payment event
-        event = self.get_booth_event(self.current_vehicle, BoothEventType.PAY)
-        time.sleep(self.get_processing_delay())
-        messaging_system.send_message(f"{event}")
-        logger.info("Publishing payment event: %s", event)
-
-        # Process exit event
-        event = self.get_booth_event(self.current_vehicle, BoothEventType.EXIT)
-        time.sleep(self.get_processing_delay())
-        messaging_system.send_message(f"{event}")
-        logger.info("Publishing exit event: %s", event)
-
-        self.current_vehicle = None  # Reset current vehicle after processing
+        for delay in self.processing_steps(messaging_system):
+            self.clock.sleep(delay)
 
         return True
@@ -0,0 +1,73 @@
+"""Events published by booths while processing vehicles"""
+import enum
+from typing import NamedTuple, Union
+
+import pydantic
+
+from traffic_management import vehicle
+from simulation.clock import isoformat_ns
+
+
+class BoothEventType(str, enum.Enum):
+    """Class representing booth events"""
+    ENTER = 'enter'
+    PAY = "pay"
+    EXIT = "exit"
+
+
+class BoothEvent(pydantic.BaseModel):
+    """Processing event at Booth"""
+    booth_id: str
+    vehicle_plate_number: vehicle.PlateNumber
+    vehicle_type: vehicle.VehicleType
+    event_type: BoothEventType
+    timestamp: str
+
+    def __str__(self) -> str:
+        return (f"booth_id: {self.booth_id},"
+                f"vehicle_plate_number: {self.vehicle_plate_number},"
+                f"vehicle_type: {self.vehicle_type},"
+                f"event_type: {self.event_type},"
+                f"timestamp: {self.timestamp})")
+
+
+# Text of enum members as rendered by BoothEvent.__str__, computed once since
+# formatting enum members is comparatively slow.
+_ENUM_TEXT = {member: f"{member}"
+              for enum_class in (vehicle.VehicleType, BoothEventType)
+              for member in enum_class}
+
+
+class CompactBoothEvent(NamedTuple):
+    """
+    Tuple-backed BoothEvent for high event rates.
+
+    Built from already validated vehicle fields with an integer timestamp;
+    the ISO timestamp is only formatted when the event is serialized.
+    BoothEvent stays the public schema, see ``to_booth_event``.
+    """
+    booth_id: str
+    vehicle_plate_number: str
+    vehicle_type: vehicle.VehicleType
+    event_type: BoothEventType
+    timestamp_ns: int
+
+    def to_booth_event(self) -> BoothEvent:
+        """Return the equivalent validated BoothEvent"""
+        return BoothEvent(
+            booth_id=self.booth_id,
+            vehicle_plate_number=vehicle.PlateNumber(
+                plate_number=self.vehicle_plate_number),
+            vehicle_type=self.vehicle_type,
+            event_type=self.event_type,
+            timestamp=isoformat_ns(self.timestamp_ns))
+
+    def __str__(self) -> str:
+        return (f"booth_id: {self.booth_id},"
+                f"vehicle_plate_number: {self.vehicle_plate_number},"
+                f"vehicle_type: {_ENUM_TEXT[self.vehicle_type]},"
+                f"event_type: {_ENUM_TEXT[self.event_type]},"
+                f"timestamp: {isoformat_ns(self.timestamp_ns)})")
+
+
+AnyBoothEvent = Union[BoothEvent, CompactBoothEvent]
@@ -0,0 +1,363 @@
+"""
+Open-loop load generation at a target arrival rate.
+
+Unlike ``TrafficGenerator``, which waits a random delay after each vehicle,
+arrivals are scheduled from the target rate alone: a dispatcher that falls
+behind sends the late vehicles at once instead of slowing the schedule
+down, so the offered load does not depend on how fast the plazas are.
+"""
+import asyncio
+import enum
+import logging
+import os
+import threading
+import time
+from typing import Callable, List, Optional
+
+import numpy as np
+import pydantic
+
+from monitoring import metrics
+from toll_plaza_management.admission import AdmissionOutcome
+from toll_plaza_management.toll_plazas_controller import TollPlazasController
+from traffic_management.vehicle import VehicleBatch, VehicleFactory
+
+logger = logging.getLogger(__name__)
+
+# Target arrivals per second, 0 keeps the paced TrafficGenerator.
+LOAD_RATE = float(os.getenv("LOAD_RATE", "0"))
+LOAD_DURATION = float(os.getenv("LOAD_DURATION", "60"))
+LOAD_DISPATCHERS = int(os.getenv("LOAD_DISPATCHERS", "4"))
+LOAD_BUCKET_SIZE = float(os.getenv("LOAD_BUCKET_SIZE", "10"))
+LOAD_REPORT_INTERVAL = float(os.getenv("LOAD_REPORT_INTERVAL", "5"))
+# 24 comma-separated multipliers of the rate, one per hour of the day.
+LOAD_HOURLY_FACTORS = os.getenv("LOAD_HOURLY_FACTORS", "")
+# Real seconds one profile day lasts, e.g. 240 plays a day in 4 minutes.
+LOAD_DAY_LENGTH = float(os.getenv("LOAD_DAY_LENGTH", "86400"))
+LOAD_START_HOUR = float(os.getenv("LOAD_START_HOUR", "0"))
+LOAD_BURST_FACTOR = float(os.getenv("LOAD_BURST_FACTOR", "1"))
+LOAD_BURST_DURATION = float(os.getenv("LOAD_BURST_DURATION", "0"))
+LOAD_BURST_PERIOD = float(os.getenv("LOAD_BURST_PERIOD", "0"))
+
+# Vehicles drawn at once by each dispatcher.
+_VEHICLE_BATCH_SIZE = 1024
+# Wait before checking again while the profile rate is 0.
+_IDLE_WAIT = 0.1
+
+
+class ArrivalProcess(str, enum.Enum):
+    """How arrivals are spaced at a given rate"""
+    # Exponential gaps; late arrivals are all sent to catch up.
+    POISSON = "poisson"
+    # Even gaps; arrivals later than the bucket size are skipped.
+    TOKEN_BUCKET = "token_bucket"
+
+
+LOAD_PROCESS = ArrivalProcess(os.getenv("LOAD_PROCESS",
+                                        ArrivalProcess.POISSON.value))
+
+
+class LoadProfile(pydantic.BaseModel):
+    """Target arrival rate over time"""
+    rate: float
+    # Multiplier of the rate for every hour of the profile day
+    hourly_factors: Optional[List[float]] = None
+    day_length: float = 86400
+    start_hour: float = 0
+    # Every burst_period seconds, the rate is multiplied by burst_factor
+    # for burst_duration seconds.
+    burst_factor: float = 1
+    burst_duration: float = 0
+    burst_period: float = 0
+
+    @pydantic.field_validator("hourly_factors")
+    @classmethod
+    def check_hourly_factors(cls, factors):
+        if factors is not None and len(factors) != 24:
+            raise ValueError("hourly_factors needs one factor per hour")
+        return factors
+
+    @classmethod
+    def from_environment(cls, rate: float = LOAD_RATE) -> "LoadProfile":
+        """Build the profile from the LOAD_* environment variables."""
+        factors = ([float(factor) for factor in LOAD_HOURLY_FACTORS.split(",")]
+                   if LOAD_HOURLY_FACTORS else None)
+        return cls(rate=rate, hourly_factors=factors,
+                   day_length=LOAD_DAY_LENGTH, start_hour=LOAD_START_HOUR,
+                   burst_factor=LOAD_BURST_FACTOR,
+                   burst_duration=LOAD_BURST_DURATION,
+                   burst_period=LOAD_BURST_PERIOD)
+
+    def rate_at(self, elapsed: float) -> float:
+        """Target arrivals per second ``elapsed`` seconds into the run."""
+        rate = self.rate
+        if self.hourly_factors is not None:
+            hours = self.start_hour + elapsed * 24 / self.day_length
+            rate *= self.hourly_factors[int(hours) % 24]
+        if (self.burst_period > 0
+                and elapsed % self.burst_period < self.burst_duration):
+            rate *= self.burst_factor
+        return rate
+
+    def mean_rate(self, duration: float) -> float:
+        """Average target rate over the first ``duration`` seconds."""
+        steps = max(1, int(duration * 10))
+        return sum(self.rate_at(duration * (step + 0.5) / steps)
+                   for step in range(steps)) / steps
+
+
+class LoadReport(pydantic.BaseModel):
+    """Outcome of a load generation run"""
+    duration: float
+    target_rate: float
+    achieved_rate: float
+    offered: int = 0
+    sent: int = 0
+    # Arrivals dropped by the token bucket because dispatch fell behind
+    skipped: int = 0
+    # Vehicles no plaza was selected for
+    unrouted: int = 0
+    # Vehicles a plaza refused: rate limited, or no booth nor spill room
+    rejected: int = 0
+    errors: int = 0
+    max_lag: float = 0.0
+
+
+class _Dispatcher:
+    """Schedule and counters of one dispatching thread or task."""
+
+    def __init__(self, index: int, profile: LoadProfile, share: float,
+                 process: ArrivalProcess, bucket_size: float,
+                 start: float, seed: Optional[int]):
+        self.profile = profile
+        self.share = share
+        self.process = process
+        self.bucket_size = bucket_size
+        self.start = start
+        self.rng = np.random.default_rng(None if seed is None else seed + index)
+        # Spread the first arrivals of the dispatchers
+        self.next_arrival = start + index * 1e-3
+        self.batch: Optional[VehicleBatch] = None
+        self.batch_position = 0
+        self.offered = self.sent = self.skipped = 0
+        self.unrouted = self.errors = 0
+        self.max_lag = 0.0
+
+    def schedule_next(self, now: float) -> Optional[float]:
+        """
+        Advance to the next arrival and return its time, None while the
+        profile rate is 0.
+        """
+        rate = self.profile.rate_at(self.next_arrival - self.start) * self.share
+        if rate <= 0:
+            self.next_arrival = max(self.next_arrival, now) + _IDLE_WAIT
+            return None
+        if self.process == ArrivalProcess.POISSON:
+            self.next_arrival += float(self.rng.exponential(1.0 / rate))
+        else:
+            self.next_arrival += 1.0 / rate
+            # Lateness beyond the bucket size is not caught up
+            oldest = now - self.bucket_size / rate
+            if self.next_arrival < oldest:
+                missed = int((oldest - self.next_arrival) * rate)
+                self.skipped += missed
+                self.offered += missed
+                self.next_arrival += missed / rate
+        return self.next_arrival
+
+    def dispatch(self, assign: Callable, now: float):
+        self.offered += 1
+        self.max_lag = max(self.max_lag, now - self.next_arrival)
+        if self.batch is None or self.batch_position >= len(self.batch):
+            self.batch = VehicleFactory.generate_vehicle_batch(
+                _VEHICLE_BATCH_SIZE, rng=self.rng)
+            self.batch_position = 0
+        vehicle = self.batch[self.batch_position]
+        self.batch_position += 1
+        try:
+            if assign(vehicle) is None:
+                self.unrouted += 1
+            else:
+                self.sent += 1
+        except Exception as e:
+            self.errors += 1
+            logger.error("Failed to assign vehicle %s: %s",
+                         vehicle.plate_number, e)
+
+
+class LoadGenerator:
+    """
+    Sends vehicles to a controller at the rate of a LoadProfile, from
+    several dispatching threads (``run``) or asyncio tasks (``run_async``).
+    """
+
+    def __init__(self, plazas_controller: TollPlazasController,
+                 profile: LoadProfile,
+                 process: ArrivalProcess = LOAD_PROCESS,
+                 dispatchers: int = LOAD_DISPATCHERS,
+                 bucket_size: float = LOAD_BUCKET_SIZE,
+                 report_interval: float = LOAD_REPORT_INTERVAL,
+                 seed: Optional[int] = None):
+        """
+        Args:
+            plazas_controller (TollPlazasController): Controller, or sharded
+                controller, vehicles are sent to.
+            profile (LoadProfile): Target arrival rate over time.
+            process (ArrivalProcess): Spacing of the arrivals.
+            dispatchers (int): Threads or tasks sharing the rate.
+            bucket_size (float): Late TOKEN_BUCKET arrivals caught up at
+                once, beyond that they are skipped.
+            report_interval (float): Seconds between progress logs, 0 for
+                none.
+            seed (int): Seed of the arrival times and vehicles.
+        """
+        self.central_system = plazas_controller
+        self.profile = profile
+        self.process = process
+        self.dispatchers = max(1, dispatchers)
+        self.bucket_size = max(1.0, bucket_size)
+        self.report_interval = report_interval
+        self.seed = seed
+        self._stop = threading.Event()
+        self._workers: List[_Dispatcher] = []
+
+    def stop(self):
+        """End the current run early."""
+        self._stop.set()
+
+    def run(self, duration: float = LOAD_DURATION) -> LoadReport:
+        """Generate load from threads for ``duration`` seconds."""
+        start = self._begin()
+        threads = [threading.Thread(target=self._dispatch_loop,
+                                    args=(worker, start + duration),
+                                    name=f"Load-dispatcher-{index}",
+                                    daemon=True)
+                   for index, worker in enumerate(self._workers)]
+        for thread in threads:
+            thread.start()
+        self._wait_and_report(start, duration)
+        for thread in threads:
+            thread.join()
+        return self._finish(start, duration)
+
+    async def run_async(self, duration: float = LOAD_DURATION) -> LoadReport:
+        """Generate load from tasks on the running event loop."""
+        start = self._begin()
+        tasks = [asyncio.create_task(
+                     self._dispatch_loop_async(worker, start + duration))
+                 for worker in self._workers]
+        reporter = asyncio.create_task(self._report_async(start))
+        await asyncio.gather(*tasks)
+        reporter.cancel()
+        return self._finish(start, duration)
+
+    def sweep(self, rates: List[float],
+              step_duration: float = LOAD_DURATION) -> List[LoadReport]:
+        """
+        Run the profile at each rate in turn, e.g. to find the rate at
+        which a topology saturates.
+        """
+        reports = []
+        base_rate = self.profile.rate
+        try:
+            for rate in rates:
+                self.profile.rate = rate
+                reports.append(self.run(step_duration))
+                if self._stop.is_set():
+                    break
+        finally:
+            self.profile.rate = base_rate
+        return reports
+
+    def _begin(self) -> float:
+        self._stop.clear()
+        self.central_system.start_controller()
+        self._rejected_before = self._rejections()
+        start = time.monotonic()
+        self._workers = [
+            _Dispatcher(index, self.profile, 1.0 / self.dispatchers,
+                        self.process, self.bucket_size / self.dispatchers,
+                        start, self.seed)
+            for index in range(self.dispatchers)]
+        return start
+
+    def _dispatch_loop(self, worker: _Dispatcher, end: float):
+        assign = self.central_system.assign_vehicle_to_plaza
+        while not self._stop.is_set():
+            now = time.monotonic()
+            arrival = worker.schedule_next(now)
+            if worker.next_arrival >= end:
+                return
+            delay = worker.next_arrival - now
+            if delay > 0 and self._stop.wait(delay):
+                return
+            if arrival is not None:
+                worker.dispatch(assign, time.monotonic())
+
+    async def _dispatch_loop_async(self, worker: _Dispatcher, end: float):
+        assign = self.central_system.assign_vehicle_to_plaza
+        while not self._stop.is_set():
+            now = time.monotonic()
+            arrival = worker.schedule_next(now)
+            if worker.next_arrival >= end:
+                return
+            delay = worker.next_arrival - now
+            # Yield to the booths even when dispatch is late
+            await asyncio.sleep(max(0.0, delay))
+            if arrival is not None:
+                worker.dispatch(assign, time.monotonic())
+
+    def _wait_and_report(self, start: float, duration: float):
+        end = start + duration
+        interval = self.report_interval if self.report_interval > 0 else duration
+        while not self._stop.wait(max(0.0, min(interval, end - time.monotonic()))):
+            if time.monotonic() >= end:
+                return
+            self._log_progress(start)
+
+    async def _report_async(self, start: float):
+        if self.report_interval <= 0:
+            return
+        while True:
+            await asyncio.sleep(self.report_interval)
+            self._log_progress(start)
+
+    def _log_progress(self, start: float):
+        elapsed = time.monotonic() - start
+        sent = sum(worker.sent for worker in self._workers)
+        logger.info("Load: %.1f vehicles/s sent, target %.1f/s now, "
+                    "%d rejected by plazas.", sent / elapsed,
+                    self.profile.rate_at(elapsed),
+                    self._rejections() - self._rejected_before)
+
+    def _finish(self, start: float, duration: float) -> LoadReport:
+        elapsed = min(time.monotonic() - start, duration)
+        if hasattr(self.central_system, "flush"):
+            self.central_system.flush()  # Partial batches of a sharded controller
+        workers = self._workers
+        sent = sum(worker.sent for worker in workers)
+        report = LoadReport(
+            duration=elapsed,
+            target_rate=self.profile.mean_rate(elapsed),
+            achieved_rate=sent / elapsed if elapsed > 0 else 0.0,
+            offered=sum(worker.offered for worker in workers),
+            sent=sent,
+            skipped=sum(worker.skipped for worker in workers),
+            unrouted=sum(worker.unrouted for worker in workers),
+            rejected=int(self._rejections() - self._rejected_before),
+            errors=sum(worker.errors for worker in workers),
+            max_lag=max(worker.max_lag for worker in workers))
+        logger.info("Load run finished: %s", report)
+        return report
+
+    def _rejections(self) -> float:
+        collect_stats = getattr(self.central_system, "collect_stats", None)
+        if collect_stats is not None:
+            # Booths of a sharded controller run in other processes
+            return collect_stats().vehicles_rejected
+        # Booth rejections count every booth retry and spill attempt of a
+        # vehicle, plaza refusals every plaza it was sent to: the refusals
+        # followed by another plaza are left out to count vehicles.
+        refusals = metrics.PLAZA_ADMISSIONS.total(outcome=[
+            AdmissionOutcome.REJECTED.value, AdmissionOutcome.RATE_LIMITED.value])
+        return refusals - metrics.PLAZA_REROUTED_VEHICLES.total()
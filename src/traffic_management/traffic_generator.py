@@ -1,12 +1,50 @@
+import asyncio
+import os
 import time
 import logging
 import math
 import random
-from traffic_management.vehicle import VehicleFactory
+from typing import Iterator, Optional
+
+from traffic_management.traffic_trace import (
+    TraceArrival, TraceReader, TraceWriter)
+from traffic_management.vehicle import (
+    ArrivalDistribution, Vehicle, VehicleBatch, VehicleFactory)
+from monitoring import log_config
+from toll_plaza_management.toll_plaza import TollPlaza
 from toll_plaza_management.toll_plazas_controller import TollPlazasController
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
+_ASSIGNMENT = log_config.category(log_config.LogCategory.ASSIGNMENT)
+
+# Number of vehicles drawn at once with VehicleFactory.generate_vehicle_batch,
+# 0 generates vehicles one by one.
+TRAFFIC_BATCH_SIZE = int(os.getenv("TRAFFIC_BATCH_SIZE", "0"))
+# Distribution of the time between two arrivals, uniform between 0.5 and 2
+# seconds by default, and the arrivals per second of the poisson and
+# constant distributions.
+TRAFFIC_DISTRIBUTION = ArrivalDistribution(
+    os.getenv("TRAFFIC_DISTRIBUTION", ArrivalDistribution.UNIFORM.value))
+TRAFFIC_RATE = float(os.getenv("TRAFFIC_RATE", "1"))
+# Trace file the generated arrivals are recorded to, nothing is recorded if
+# empty.
+TRAFFIC_TRACE_RECORD = os.getenv("TRAFFIC_TRACE_RECORD", "")
+# Trace file to replay instead of generating random traffic.
+TRAFFIC_TRACE_REPLAY = os.getenv("TRAFFIC_TRACE_REPLAY", "")
+
+
+def _parse_replay_speed(value: str) -> float:
+    speed = float(value.replace("max", "inf"))
+    if not speed > 0:
+        raise ValueError(f"TRAFFIC_REPLAY_SPEED must be positive or max, "
+                         f"got {value!r}")
+    return speed
+
+
+# Replay speed: 1 is the recorded pace, N is N times faster and "max" does
+# not wait between arrivals.
+TRAFFIC_REPLAY_SPEED = _parse_replay_speed(
+    os.getenv("TRAFFIC_REPLAY_SPEED", "1"))
 
 
 class TrafficGenerator:
@@ -14,13 +52,148 @@ class TrafficGenerator:
     Class to generate vehicles and send them to the TollPlazaManager.
     """
 
-    def __init__(self, plazas_controller: TollPlazasController, num_vehicles: int = 0):
+    def __init__(self, plazas_controller: TollPlazasController, num_vehicles: int = 0,
+                 batch_size: int = TRAFFIC_BATCH_SIZE,
+                 recorder: Optional[TraceWriter] = None,
+                 replay: Optional[TraceReader] = None,
+                 replay_speed: float = TRAFFIC_REPLAY_SPEED,
+                 distribution: ArrivalDistribution = TRAFFIC_DISTRIBUTION,
+                 rate: float = TRAFFIC_RATE):
+        """
+        Args:
+            plazas_controller (TollPlazasController): Controller vehicles
+                are sent to.
+            num_vehicles (int): Vehicles to generate, 0 for no limit.
+            batch_size (int): Vehicles drawn at once, 0 for one by one.
+            recorder (TraceWriter): Records every arrival.
+            replay (TraceReader): Trace whose arrivals are sent instead of
+                random vehicles, routed by the controller again.
+            replay_speed (float): Pace of the replay relative to the trace,
+                math.inf to send the arrivals without waiting.
+            distribution (ArrivalDistribution): Distribution of the time
+                between two generated arrivals.
+            rate (float): Arrivals per second of the POISSON and CONSTANT
+                distributions.
+        """
+        if distribution != ArrivalDistribution.UNIFORM and rate <= 0:
+            raise ValueError(f"Arrival rate must be positive, got {rate}")
+        if not replay_speed > 0:
+            raise ValueError(
+                f"Replay speed must be positive, got {replay_speed}")
         self.central_system = plazas_controller
         self.generated_count = 0
         if num_vehicles != 0:
             self.num_vehicles = num_vehicles
         else:
             self.num_vehicles = math.inf
+        self.batch_size = batch_size
+        self.distribution = distribution
+        self.rate = rate
+        self._batch: Optional[VehicleBatch] = None
+        self._batch_position = 0
+
+        self.recorder = recorder
+        # Offset of the next arrival from the first one, in seconds
+        self._arrival_offset = 0.0
+        self.replay = replay
+        self.replay_speed = replay_speed
+        self._arrivals: Optional[Iterator[TraceArrival]] = None
+        self._next_arrival: Optional[TraceArrival] = None
+        self._replay_delay = 0.0
+        if replay is not None:
+            self.num_vehicles = min(self.num_vehicles, len(replay))
+            self._arrivals = iter(replay)
+            self._next_arrival = next(self._arrivals, None)
+
+    @classmethod
+    def from_environment(cls, plazas_controller: TollPlazasController,
+                         num_vehicles: int = 0) -> "TrafficGenerator":
+        """
+        Build a generator recording to TRAFFIC_TRACE_RECORD and replaying
+        TRAFFIC_TRACE_REPLAY when they are set.
+        """
+        recorder = TraceWriter(TRAFFIC_TRACE_RECORD) if TRAFFIC_TRACE_RECORD else None
+        replay = TraceReader(TRAFFIC_TRACE_REPLAY) if TRAFFIC_TRACE_REPLAY else None
+        return cls(plazas_controller, num_vehicles, recorder=recorder,
+                   replay=replay)
+
+    def close(self):
+        """Write the recorded trace and release the replayed one."""
+        if self.recorder is not None:
+            self.recorder.close()
+        if self.replay is not None:
+            self.replay.close()
+
+    def has_vehicles_left(self) -> bool:
+        """Returns True while the requested number of vehicles is not reached."""
+        if self._arrivals is not None and self._next_arrival is None:
+            return False  # End of the replayed trace
+        return self.generated_count < self.num_vehicles
+
+    def get_inter_arrival_delay(self) -> float:
+        """Seconds to wait before the next vehicle arrives."""
+        if self.replay is not None:
+            delay = self._replay_delay
+            self._arrival_offset += delay
+            return delay / self.replay_speed
+        if self._batch is not None:
+            delay = float(
+                self._batch.inter_arrival_times[self._batch_position - 1])
+        elif self.distribution == ArrivalDistribution.POISSON:
+            delay = random.expovariate(self.rate)
+        elif self.distribution == ArrivalDistribution.CONSTANT:
+            delay = 1.0 / self.rate
+        else:
+            delay = random.uniform(0.5, 2.0)
+        self._arrival_offset += delay
+        return delay
+
+    def _next_vehicle(self) -> Vehicle:
+        if self._arrivals is not None:
+            arrival = self._next_arrival
+            self._next_arrival = next(self._arrivals, None)
+            self._replay_delay = (
+                0.0 if self._next_arrival is None
+                else self._next_arrival.arrival_offset - arrival.arrival_offset)
+            return VehicleFactory._create_vehicle(arrival.plate_number,
+                                                  arrival.vehicle_type)
+        if self.batch_size <= 0:
+            return VehicleFactory.generate_random_vehicle()
+        if self._batch is None or self._batch_position >= len(self._batch):
+            remaining = self.num_vehicles - self.generated_count
+            self._batch = VehicleFactory.generate_vehicle_batch(
+                int(min(self.batch_size, max(remaining, 1))),
+                distribution=self.distribution, rate=self.rate)
+            self._batch_position = 0
+        vehicle = self._batch[self._batch_position]
+        self._batch_position += 1
+        return vehicle
+
+    def generate_next_vehicle(self) -> Optional[TollPlaza]:
+        """
+        Generate one vehicle and send it to the toll plaza controller.
+
+        Returns:
+            Optional[TollPlaza]: The plaza the vehicle was sent to, if any.
+        """
+        veh = self._next_vehicle()
+        plaza = None
+        try:
+            plaza = self.central_system.assign_vehicle_to_plaza(veh)
+            if plaza is not None:
+                logger.info("Vehicle %s assigned to a plaza.",
+                            veh.plate_number, extra=_ASSIGNMENT)
+            self.generated_count += 1
+            return plaza
+        except Exception as e:
+            logger.error("Failed to assign vehicle %s: %s",
+                         veh.plate_number, str(e))
+            return None
+        finally:
+            if self.recorder is not None:
+                # Sharded controllers return the plaza id
+                plaza_id = getattr(plaza, "plaza_id", plaza)
+                self.recorder.record(self._arrival_offset, veh, plaza_id)
 
     def generate_vehicle_flow(self):
         """
@@ -30,22 +203,38 @@ class TrafficGenerator:
         self.central_system.start_controller()
 
         try:
-            while self.generated_count < self.num_vehicles:
-                veh = VehicleFactory.generate_random_vehicle()
-                try:
-                    self.central_system.assign_vehicle_to_plaza(veh)
-                    logger.info("Vehicle %s assigned to a plaza.",
-                                veh.plate_number)
-                    self.generated_count += 1
-                except Exception as e:
-                    logger.error("Failed to assign vehicle %s: %s",
-                                 veh.plate_number, str(e))
+            while self.has_vehicles_left():
+                self.generate_next_vehicle()
 
                 if self.generated_count % 10 == 0:  # Monitor every 10 vehicles
                     logger.info("Monitoring system status...")
                     self.central_system.monitor_system()
 
-                time.sleep(random.uniform(0.5, 2.0))
+                time.sleep(self.get_inter_arrival_delay())
         except KeyboardInterrupt:
             logger.info("Stopping vehicle generation.")
             self.central_system.stop_controller()  # Gracefully stop all plazas
+        finally:
+            self.close()
+
+    async def generate_vehicle_flow_async(self):
+        """
+        Generate vehicles for an AsyncTollPlazasController on the running
+        event loop, then stop the controller once every vehicle is sent.
+        """
+        logger.info("Starting vehicle generation...")
+        self.central_system.start_controller()
+
+        try:
+            while self.has_vehicles_left():
+                self.generate_next_vehicle()
+
+                if self.generated_count % 10 == 0:  # Monitor every 10 vehicles
+                    logger.info("Monitoring system status...")
+                    self.central_system.monitor_system()
+
+                await asyncio.sleep(self.get_inter_arrival_delay())
+        finally:
+            logger.info("Stopping vehicle generation.")
+            self.close()
+            await self.central_system.astop_controller()
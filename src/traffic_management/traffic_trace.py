@@ -0,0 +1,215 @@
+"""
+Columnar traces of generated traffic, to replay the same arrivals later.
+
+    trace  := magic:"TTRC" version:u16 reserved:u16 chunk*
+    chunk  := records:u32 plate_width:u16 reserved:u16
+              arrival_offsets:f64[records] plaza_ids:i32[records]
+              vehicle_types:u8[records] plates:bytes[plate_width][records]
+              padding up to a multiple of 8 bytes
+
+Arrival offsets are in seconds from the first arrival, plaza ids are -1 for
+vehicles no plaza accepted and vehicle types index ``VEHICLE_TYPES``.
+Readers memory-map the file and expose each chunk as NumPy views, so a trace
+is streamed without being loaded.
+"""
+import mmap
+import os
+import struct
+from typing import BinaryIO, Iterator, List, NamedTuple, Optional
+
+import numpy as np
+
+from traffic_management.vehicle import VEHICLE_TYPES, Vehicle, VehicleType
+
+TRACE_CHUNK_SIZE = int(os.getenv("TRACE_CHUNK_SIZE", "4096"))
+
+TRACE_MAGIC = b"TTRC"
+TRACE_VERSION = 1
+_FILE_HEADER = struct.Struct("<4sHH")
+_CHUNK_HEADER = struct.Struct("<IHH")
+_NO_PLAZA = -1
+_TYPE_INDICES = {vehicle_type: index
+                 for index, vehicle_type in enumerate(VEHICLE_TYPES)}
+
+
+class TraceFormatError(ValueError):
+    """Raised when a file is not a valid traffic trace."""
+
+
+class TraceArrival(NamedTuple):
+    """One recorded arrival"""
+    arrival_offset: float
+    plate_number: str
+    vehicle_type: VehicleType
+    plaza_id: Optional[int]
+
+
+class TraceChunk(NamedTuple):
+    """Columns of consecutive arrivals, as views on the trace file"""
+    arrival_offsets: np.ndarray
+    plaza_ids: np.ndarray
+    type_indices: np.ndarray
+    plates: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.arrival_offsets)
+
+
+def _padding(size: int) -> int:
+    return -size % 8
+
+
+class TraceWriter:
+    """
+    Appends arrivals to a trace file, one chunk of columns at a time.
+
+    The file is only created when the first chunk is written.
+    """
+
+    def __init__(self, path: str, chunk_size: int = TRACE_CHUNK_SIZE):
+        """
+        Args:
+            path (str): Trace file, overwritten if it exists.
+            chunk_size (int): Arrivals buffered before a chunk is written.
+        """
+        self.path = path
+        self.chunk_size = max(1, chunk_size)
+        self.recorded = 0
+        self._file: Optional[BinaryIO] = None
+        self._offsets: List[float] = []
+        self._plaza_ids: List[int] = []
+        self._types: List[int] = []
+        self._plates: List[bytes] = []
+
+    def __enter__(self) -> "TraceWriter":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def record(self, arrival_offset: float, vehicle: Vehicle,
+               plaza_id: Optional[int]):
+        """
+        Add an arrival to the trace.
+
+        Args:
+            arrival_offset (float): Seconds since the first arrival.
+            vehicle (Vehicle): The arriving vehicle.
+            plaza_id (Optional[int]): Plaza it was sent to, None if none.
+        """
+        self._offsets.append(arrival_offset)
+        self._plaza_ids.append(_NO_PLAZA if plaza_id is None else plaza_id)
+        self._types.append(_TYPE_INDICES[vehicle.vehicle_type])
+        self._plates.append(str(vehicle.plate_number).encode("ascii"))
+        self.recorded += 1
+        if len(self._offsets) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered arrivals as one chunk."""
+        if not self._offsets:
+            return
+        if self._file is None:
+            self._file = open(self.path, "wb")
+            self._file.write(_FILE_HEADER.pack(TRACE_MAGIC, TRACE_VERSION, 0))
+        plates = np.array(self._plates, dtype=np.bytes_)
+        columns = (np.array(self._offsets, dtype="<f8").tobytes()
+                   + np.array(self._plaza_ids, dtype="<i4").tobytes()
+                   + np.array(self._types, dtype=np.uint8).tobytes()
+                   + plates.tobytes())
+        self._file.write(_CHUNK_HEADER.pack(len(self._offsets),
+                                            plates.dtype.itemsize, 0))
+        self._file.write(columns + bytes(_padding(len(columns))))
+        self._file.flush()
+        self._offsets.clear()
+        self._plaza_ids.clear()
+        self._types.clear()
+        self._plates.clear()
+
+    def close(self):
+        """Write the last chunk and close the file."""
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class TraceReader:
+    """Memory-mapped reader of a trace file."""
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path (str): Trace file written by a TraceWriter.
+
+        Raises:
+            TraceFormatError: If the file is not a trace or is truncated.
+        """
+        self.path = path
+        self._file = open(path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        if size < _FILE_HEADER.size:
+            self._file.close()
+            raise TraceFormatError(f"{path} is too short to be a trace")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _ = _FILE_HEADER.unpack_from(self._map, 0)
+        if magic != TRACE_MAGIC or version != TRACE_VERSION:
+            self.close()
+            raise TraceFormatError(f"{path} is not a version {TRACE_VERSION} "
+                                   f"traffic trace")
+        # (position of the columns, records, plate width) of every chunk
+        self._chunks = []
+        position = _FILE_HEADER.size
+        while position < size:
+            if position + _CHUNK_HEADER.size > size:
+                self.close()
+                raise TraceFormatError(f"{path} is truncated")
+            records, plate_width, _ = _CHUNK_HEADER.unpack_from(self._map,
+                                                                position)
+            position += _CHUNK_HEADER.size
+            self._chunks.append((position, records, plate_width))
+            columns = records * (8 + 4 + 1 + plate_width)
+            position += columns + _padding(columns)
+        if position > size:
+            self.close()
+            raise TraceFormatError(f"{path} is truncated")
+        self._length = sum(records for _, records, _ in self._chunks)
+
+    def __enter__(self) -> "TraceReader":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self) -> int:
+        return self._length
+
+    def chunks(self) -> Iterator[TraceChunk]:
+        """Yield the chunks of the trace, without copying them."""
+        for position, records, plate_width in self._chunks:
+            offsets = np.frombuffer(self._map, "<f8", records, position)
+            position += 8 * records
+            plaza_ids = np.frombuffer(self._map, "<i4", records, position)
+            position += 4 * records
+            type_indices = np.frombuffer(self._map, np.uint8, records, position)
+            position += records
+            plates = np.frombuffer(self._map, f"S{plate_width}", records,
+                                   position)
+            yield TraceChunk(offsets, plaza_ids, type_indices, plates)
+
+    def __iter__(self) -> Iterator[TraceArrival]:
+        for chunk in self.chunks():
+            # Python lists are much faster to index than NumPy arrays
+            for offset, plaza_id, type_index, plate in zip(
+                    chunk.arrival_offsets.tolist(), chunk.plaza_ids.tolist(),
+                    chunk.type_indices.tolist(), chunk.plates.tolist()):
+                yield TraceArrival(offset, plate.decode("ascii"),
+                                   VEHICLE_TYPES[type_index],
+                                   None if plaza_id == _NO_PLAZA else plaza_id)
+
+    def close(self):
+        try:
+            self._map.close()
+        except BufferError:
+            pass  # Chunk views are still alive, the map closes with them
+        self._file.close()
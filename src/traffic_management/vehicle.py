@@ -3,12 +3,17 @@ import os
 from enum import Enum
 import re
 import random
+from typing import Iterator, Optional
 
+import numpy as np
 import pydantic
 
 DEFAULT_PLATE_NUMBER_REGEX = r"^[A-Z]{2} \d{4}$"
 PLATE_NUMBER_REGEX = os.getenv("PLATE_NUMBER_REGEX", DEFAULT_PLATE_NUMBER_REGEX)
 
+PLATE_PREFIXES = ('AA', 'AB', 'CD', 'CF', 'GA')
+
+
 class VehicleType(str, Enum):
     """Class representing the different type of vehicles"""
     CAR = "car"
@@ -16,6 +21,16 @@ class VehicleType(str, Enum):
     VAN = "van"
 
 
+VEHICLE_TYPES = tuple(VehicleType)
+
+
+class ArrivalDistribution(str, Enum):
+    """Distribution of the time between two vehicle arrivals"""
+    UNIFORM = "uniform"
+    POISSON = "poisson"
+    CONSTANT = "constant"
+
+
 class PlateNumber(pydantic.BaseModel):
     """Class representing a vehicle plate number"""
     plate_number: str
@@ -82,8 +97,100 @@ class VehicleFactory:
         Returns:
             Vehicle: An instance of the Vehicle class with random attributes.
         """
-        plate_letters = random.choice(['AA', 'AB', 'CD', 'CF', 'GA'])
+        plate_letters = random.choice(PLATE_PREFIXES)
         plate_numbers = random.randint(1000, 9999)
         plate_number_str = f"{plate_letters} {plate_numbers}"
         vehicle_type = random.choice(list(VehicleType))
         return VehicleFactory._create_vehicle(plate_number_str, vehicle_type)
+
+    @staticmethod
+    def generate_vehicle_batch(size: int,
+                               distribution: ArrivalDistribution = ArrivalDistribution.UNIFORM,
+                               min_delay: float = 0.5,
+                               max_delay: float = 2.0,
+                               rate: float = 1.0,
+                               rng: Optional[np.random.Generator] = None
+                               ) -> "VehicleBatch":
+        """
+        Generate the attributes of many random vehicles at once.
+
+        Args:
+            size (int): Number of vehicles to generate.
+            distribution (ArrivalDistribution): Inter-arrival time distribution.
+            min_delay (float): Lower bound of UNIFORM delays, in seconds.
+            max_delay (float): Upper bound of UNIFORM delays, in seconds.
+            rate (float): Arrivals per second for POISSON and CONSTANT.
+            rng (np.random.Generator): Random source, for reproducible runs.
+
+        Returns:
+            VehicleBatch: Columnar batch, Vehicle objects are built on access.
+        """
+        rng = rng or np.random.default_rng()
+        if distribution == ArrivalDistribution.UNIFORM:
+            inter_arrival_times = rng.uniform(min_delay, max_delay, size)
+        elif distribution == ArrivalDistribution.POISSON:
+            inter_arrival_times = rng.exponential(1.0 / rate, size)
+        elif distribution == ArrivalDistribution.CONSTANT:
+            inter_arrival_times = np.full(size, 1.0 / rate)
+        else:
+            raise ValueError(distribution)
+
+        return VehicleBatch(
+            prefix_indices=rng.integers(0, len(PLATE_PREFIXES), size,
+                                        dtype=np.uint8),
+            plate_numbers=rng.integers(1000, 10000, size, dtype=np.uint16),
+            type_indices=rng.integers(0, len(VEHICLE_TYPES), size,
+                                      dtype=np.uint8),
+            inter_arrival_times=inter_arrival_times,
+        )
+
+
+class VehicleBatch:
+    """
+    Columnar batch of generated vehicles.
+
+    Attributes are kept as NumPy arrays and a Vehicle is only built when it is
+    accessed, so consumers that only need plates or types never pay for
+    model construction.
+    """
+
+    def __init__(self, prefix_indices: np.ndarray, plate_numbers: np.ndarray,
+                 type_indices: np.ndarray, inter_arrival_times: np.ndarray):
+        self.prefix_indices = prefix_indices
+        self.plate_numbers = plate_numbers
+        self.type_indices = type_indices
+        self.inter_arrival_times = inter_arrival_times
+        # Python lists of the columns, converted once on first access since
+        # indexing NumPy arrays element by element is slow.
+        self._columns: Optional[tuple] = None
+
+    def __len__(self) -> int:
+        return len(self.plate_numbers)
+
+    def __getitem__(self, index: int) -> Vehicle:
+        return VehicleFactory._create_vehicle(self.plate_number(index),
+                                              self.vehicle_type(index))
+
+    def __iter__(self) -> Iterator[Vehicle]:
+        for index in range(len(self)):
+            yield self[index]
+
+    def _get_columns(self) -> tuple:
+        if self._columns is None:
+            self._columns = (self.prefix_indices.tolist(),
+                             self.plate_numbers.tolist(),
+                             self.type_indices.tolist())
+        return self._columns
+
+    def plate_number(self, index: int) -> str:
+        """Plate number of a vehicle, without building the Vehicle."""
+        prefixes, numbers, _ = self._get_columns()
+        return f"{PLATE_PREFIXES[prefixes[index]]} {numbers[index]}"
+
+    def vehicle_type(self, index: int) -> VehicleType:
+        """Type of a vehicle, without building the Vehicle."""
+        return VEHICLE_TYPES[self._get_columns()[2][index]]
+
+    def arrival_offsets(self) -> np.ndarray:
+        """Arrival time of every vehicle, in seconds from the batch start."""
+        return np.cumsum(self.inter_arrival_times)
@@ -0,0 +1,109 @@
+import pytest
+
+from messaging import event_codec
+from traffic_management.booth_event import BoothEventType, CompactBoothEvent
+from traffic_management.vehicle import VehicleType
+
+# Whole microseconds, which the ISO timestamps of TEXT messages keep exactly
+TIMESTAMP_NS = 1_700_000_000_123_456_000
+
+
+def make_event(booth_id="1-1", plate="AB 1234",
+               vehicle_type=VehicleType.TRUCK,
+               event_type=BoothEventType.PAY,
+               timestamp_ns=TIMESTAMP_NS) -> CompactBoothEvent:
+    return CompactBoothEvent(booth_id, plate, vehicle_type, event_type,
+                             timestamp_ns)
+
+
+def test_text_event_round_trip():
+    event = make_event()
+    assert event_codec.decode_message(str(event)) == [event]
+
+
+def test_text_event_matches_booth_event_text():
+    event = make_event()
+    assert event_codec.decode_message(str(event.to_booth_event())) == [event]
+
+
+@pytest.mark.parametrize("vehicle_type, event_type", [
+    ("VehicleType.VAN", "BoothEventType.EXIT"),  # Python 3.11 and later
+    ("van", "exit"),  # Python 3.10, str enums format as their value
+])
+def test_text_event_enum_formats(vehicle_type, event_type):
+    text = (f"booth_id: 2-3,vehicle_plate_number: CD 5678,"
+            f"vehicle_type: {vehicle_type},event_type: {event_type},"
+            f"timestamp: {make_event().to_booth_event().timestamp})")
+    assert event_codec.decode_message(text) == [make_event(
+        "2-3", "CD 5678", VehicleType.VAN, BoothEventType.EXIT)]
+
+
+def test_text_event_wrapped_for_pubsub():
+    event = make_event()
+    message = f'{{"message": "{event}"}}'.encode("utf-8")
+    assert event_codec.decode_message(message) == [event]
+
+
+@pytest.mark.parametrize("text", [
+    "hello",
+    "booth_id: 1-1,vehicle_plate_number: AB 1234,vehicle_type: plane,"
+    "event_type: pay,timestamp: 2023-11-14T22:13:20)",
+])
+def test_text_event_invalid(text):
+    with pytest.raises(event_codec.EventDecodeError):
+        event_codec.decode_message(text)
+
+
+def test_binary_event_round_trip():
+    event = make_event(timestamp_ns=TIMESTAMP_NS + 789)
+    message = event_codec.encode_event(event)
+    assert message[0] == event_codec.KIND_EVENT
+    assert event_codec.decode_message(message) == [event]
+
+
+def test_binary_event_from_booth_event():
+    event = make_event()
+    assert event_codec.decode_message(
+        event_codec.encode_event(event.to_booth_event())) == [event]
+
+
+@pytest.mark.parametrize("compress", [True, False])
+def test_envelope_round_trip(compress):
+    events = [make_event(f"1-{index}", f"AB {1000 + index}",
+                         vehicle_type, event_type, TIMESTAMP_NS + index)
+              for index, (vehicle_type, event_type) in enumerate(
+                  (vehicle_type, event_type)
+                  for vehicle_type in VehicleType
+                  for event_type in BoothEventType)]
+    message = event_codec.encode_envelope(events, compress=compress)
+    assert event_codec.decode_message(message) == events
+
+
+def test_envelope_is_compressed():
+    events = [make_event() for _ in range(100)]
+    assert (len(event_codec.encode_envelope(events, compress=True))
+            < len(event_codec.encode_envelope(events, compress=False)))
+
+
+def test_empty_envelope():
+    assert event_codec.decode_message(event_codec.encode_envelope([])) == []
+
+
+def test_corrupted_envelope():
+    message = bytearray(event_codec.encode_envelope([make_event()]))
+    message[-1] ^= 0xFF
+    with pytest.raises(event_codec.EventDecodeError):
+        event_codec.decode_message(bytes(message))
+
+
+def test_truncated_binary_event():
+    message = event_codec.encode_event(make_event())
+    with pytest.raises(event_codec.EventDecodeError):
+        event_codec.decode_message(message[:10])
+
+
+def test_unsupported_version():
+    message = bytearray(event_codec.encode_event(make_event()))
+    message[1] = event_codec.FORMAT_VERSION + 1
+    with pytest.raises(event_codec.EventDecodeError):
+        event_codec.decode_message(bytes(message))